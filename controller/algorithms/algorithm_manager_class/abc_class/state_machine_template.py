@@ -1,14 +1,32 @@
+import itertools
+import math
+import os
 import threading
 import time
-from queue import Queue
+from enum import IntEnum
+from queue import PriorityQueue, Empty
 
 from concurrent.futures import ThreadPoolExecutor
 
 from operator_mod.logger.global_logger import Logger
+from operator_mod.in_mem_storage.in_memory_data import InMemoryData
+from controller.algorithms.data_writer.write_behind import WriteBehindQueue
 
 class Manager:
     _instance = None
     _lock = threading.Lock()
+    
+    class Priority(IntEnum):
+        # Lower values are scheduled first, tasks of the same priority in order of submission
+        HIGH = 0
+        NORMAL = 1
+        LOW = 2
+    
+    # Put into the queue on shutdown, it is scheduled before every task and ends the scheduler thread
+    _SHUTDOWN = -1
+    
+    # States running at once, further tasks wait in the priority queue
+    MAX_RUNNING_STATES = 5
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
@@ -21,11 +39,38 @@ class Manager:
         
         # Utils
         self.logger = Logger("Algorithm Manager").logger
+        self.data = InMemoryData()
         
         # Trying ThreadPoolExecutor
-        self.executor = ThreadPoolExecutor(max_workers=5)
+        self.executor = ThreadPoolExecutor(max_workers=self.MAX_RUNNING_STATES)
+        
+        # Free places for running states, a task is only taken from the queue when there is one
+        self._slots = threading.Semaphore(self.MAX_RUNNING_STATES)
+        
+        # Long-lived worker processes shared by all states, started by the subclass
+        self.process_pool = None
+        
+        # Bytes the work items of all states may hold in the worker processes at once, None for no limit
+        self.memory_budget = None
     
-        self.task_queue = Queue()
+        # Entries are (priority, sequence, task_id), the task itself is kept in _pending until it is scheduled
+        self.task_queue = PriorityQueue()
+        self._pending = {}
+        self._task_ids = itertools.count(1)
+        
+        # task_id -> state of the running tasks, they are terminated by cancel_task and stop
+        self._running = {}
+        
+        # Scheduler metrics, see get_metrics()
+        self._metrics = {
+            "Queued": 0,
+            "Scheduled": 0,
+            "Cancelled": 0,
+            "Completed": 0,
+            "LatencyTotal": 0.0,
+            "LatencyMax": 0.0,
+            "RuntimeTotal": 0.0
+        }
             
         # Necessary events        
         self.shutdown_flag = threading.Event()
@@ -42,69 +87,250 @@ class Manager:
         try:
             # First we go back to idle
             self.stop()
-                        
-            # Clear the task queue and task set
-            while self.task_queue.qsize() > 0:
-                self.task_queue.get()
 
             self.shutdown_flag.set()
      
-            # Stop the task processing thread
+            # Stop the task processing thread, the sentinel wakes it up
             if self.queue_thread.is_alive():
+                self.task_queue.put((self._SHUTDOWN, 0, None))
+                # In case all places are taken by running states
+                self._slots.release()
                 self.queue_thread.join()  # Wait for queue_thread to stop
 
             # Shutdown the executor for current state processing
             if self.executor:
                 self.executor.shutdown()
+            
+            # Shutdown the worker processes
+            if self.process_pool:
+                self.process_pool.shutdown(wait=True, cancel_futures=True)
+                self.process_pool = None
 
         except Exception as e:
             self.logger.error(f"Error during shutdown: {e}")
 
         finally:
+            # The states are done, their results still waiting to be written go to the databases now. Also after
+            # an error above, so no result is lost
+            try:
+                WriteBehindQueue().shutdown()
+            except Exception as e:
+                self.logger.error(f"Error flushing the write-behind queue: {e}")
+            
             self.logger.info("Gracefully shutdown.")
 
     ### Here is the state machine logic ###
     def _process_tasks(self):
         
-        while not self.shutdown_flag.is_set():
+        while True:
             
-            if not self.task_queue.empty():
-                
-                task = self.task_queue.get(timeout=0.25)
-                mode, runtime = task
-                
-                state_class = self.state_classes.get(mode, None)
-                
-                if not state_class:
-                    self.logger.error("Tried executing an unknown state.")
-                    continue
+            # Waiting for a free place first, so waiting tasks stay in the queue where priorities and cancellation apply
+            self._slots.acquire()
             
-                self.current_state = state_class(self, runtime)
-                self.executor.submit(self.current_state.run)
-                
-                time.sleep(0.05)
-            else:
-                time.sleep(0.05)
-
-    def add_task(self, mode: int, runtime: int):
+            # Blocks until a task or the shutdown sentinel arrives, an idle manager does not wake up
+            priority, _, task_id = self.task_queue.get()
+            
+            if priority == self._SHUTDOWN:
+                break
+            
+            with self._lock:
+                task = self._pending.pop(task_id, None)
+            
+            # Cancelled while waiting
+            if task is None:
+                self._slots.release()
+                continue
+            
+            mode, runtime, enqueued, callback = task
+            
+            state_class = self.state_classes.get(mode, None)
+            
+            if not state_class:
+                self.logger.error("Tried executing an unknown state.")
+                self._slots.release()
+                continue
+            
+            latency = time.perf_counter() - enqueued
+            
+            with self._lock:
+                self._metrics["Scheduled"] += 1
+                self._metrics["LatencyTotal"] += latency
+                self._metrics["LatencyMax"] = max(self._metrics["LatencyMax"], latency)
+        
+                self.current_state = state_class(self, runtime, task_id)
+                self._running[task_id] = self.current_state
+                self.executor.submit(self._run_state, task_id, self.current_state, callback)
+            
+            self.logger.info(f"Scheduled task {task_id} ({mode}) after {latency * 1000:.1f} ms in the queue.")
+    
+    def _run_state(self, task_id: int, state, callback) -> None:
+        
+        start = time.perf_counter()
+        
+        try:
+            state.run()
+        finally:
+            with self._lock:
+                self._running.pop(task_id, None)
+                self._metrics["Completed"] += 1
+                self._metrics["RuntimeTotal"] += time.perf_counter() - start
+            
+            self._slots.release()
         
-        self.task_queue.put((mode, runtime))
+        if callback is not None:
+            try:
+                callback(task_id, state.result)
+            except Exception as e:
+                self.logger.error(f"Error in the callback of task {task_id}: {e}")
 
-    def stop(self):
+    def add_task(self, mode: int, runtime: int, priority: "Manager.Priority" = Priority.NORMAL, inputs: dict = None, callback=None) -> int:
+        """Queues a state to run. Every task has its own namespace in the InMemoryData, so several tasks of the same
+        state can run at once without overwriting each others inputs and results.
+
+        Args:
+            mode (int): key of state_classes
+            runtime (int): runtime budget of the state in seconds, 0 for none
+            priority (Manager.Priority, optional): scheduling priority. Defaults to Priority.NORMAL.
+            inputs (dict, optional): InMemoryData.Keys -> value, put into the namespace of the task. Defaults to None (the state reads the default namespace).
+            callback (callable, optional): called with (task_id, result) from the manager thread when the state is done. Defaults to None.
+
+        Returns:
+            int: task id, e.g. for cancel_task or get_result
+        """
+        with self._lock:
+            task_id = next(self._task_ids)
+            
+            for key, value in (inputs or {}).items():
+                self.data.add_data(key, value, self.task_namespace(task_id))
+            
+            self._pending[task_id] = (mode, runtime, time.perf_counter(), callback)
+            self._metrics["Queued"] += 1
+            
+            # The task id doubles as sequence number, so equal priorities keep their order
+            self.task_queue.put((int(priority), task_id, task_id))
         
+        return task_id
+    
+    def cancel_task(self, task_id: int) -> bool:
+        """Cancels a task. A queued task is dropped, a running one is terminated and stops after its current work
+        items, keeping what it finished so far.
+
+        Args:
+            task_id (int): id from add_task
+
+        Returns:
+            bool: True if the task was still queued or running
+        """
         with self._lock:
+            state = self._running.get(task_id)
+            queued = self._pending.pop(task_id, None) is not None
+            cancelled = queued or state is not None
             
-            if self.current_state:
-                self.current_state.terminate()
-                self.executor.shutdown(wait=False)
+            if cancelled:
+                self._metrics["Cancelled"] += 1
+        
+        if queued:
+            self.release_task(task_id)
+        
+        if state is not None:
+            state.terminate()
+        
+        return cancelled
+    
+    @staticmethod
+    def task_namespace(task_id: int) -> str:
+        """Returns the InMemoryData namespace of a task."""
+        return f"Task-{task_id}"
+    
+    def get_result(self, task_id: int):
+        """Returns the result of a finished task, None if there is none (yet).
 
-            # Clearing the queue
-            while not self.task_queue.empty():
-                self.task_queue.get()
+        Args:
+            task_id (int): id from add_task
+        """
+        return self.data.get_data(self.data.Keys.TASK_RESULT, self.task_namespace(task_id))
+    
+    def release_task(self, task_id: int) -> None:
+        """Drops the inputs and the result of a finished task.
 
-            # Fresh executor
-            self.executor = ThreadPoolExecutor(max_workers=5)
+        Args:
+            task_id (int): id from add_task
+        """
+        namespace = self.task_namespace(task_id)
+        
+        if namespace in self.data.list_namespaces():
+            self.data.delete_namespace(namespace)
+    
+    def fair_share(self) -> int:
+        """Returns how many work items a state may have in the worker pool at once. The workers are split between
+        the running states, so a long batch does not block a later one until it is done.
+
+        Returns:
+            int: items in flight per state
+        """
+        workers = getattr(self.process_pool, "_max_workers", None) or os.cpu_count() or 1
+        
+        with self._lock:
+            running = max(len(self._running), 1)
+        
+        # One more than the share keeps the workers busy while results are collected
+        return math.ceil(workers / running) + 1
+    
+    def memory_share(self) -> int:
+        """Returns the part of the memory budget of one running state in bytes, None without a budget."""
+        
+        if self.memory_budget is None:
+            return None
+        
+        with self._lock:
+            running = max(len(self._running), 1)
+        
+        return self.memory_budget // running
     
+    def get_metrics(self) -> dict:
+        """Returns the scheduler metrics.
+
+        Returns:
+            dict: "Depth" queued tasks, "Queued", "Scheduled", "Cancelled" and "Completed" counts, "LatencyAvg" and "LatencyMax" time in the queue in s, "RuntimeAvg" in s
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["Depth"] = len(self._pending)
+        
+        metrics["LatencyAvg"] = metrics.pop("LatencyTotal") / metrics["Scheduled"] if metrics["Scheduled"] else 0.0
+        metrics["RuntimeAvg"] = metrics.pop("RuntimeTotal") / metrics["Completed"] if metrics["Completed"] else 0.0
+        
+        return metrics
+
+    def stop(self):
+        
+        with self._lock:
+            
+            # The states cancel their pending work and end on their own, so the executor threads are free again soon
+            running = list(self._running.values())
+            
+            # Clearing the queue, the scheduler skips the entries of tasks that are not pending anymore
+            queued = list(self._pending)
+            self._metrics["Cancelled"] += len(queued)
+            self._pending.clear()
+            
+            while True:
+                try:
+                    entry = self.task_queue.get_nowait()
+                except Empty:
+                    break
+                
+                # Keeping a shutdown sentinel
+                if entry[0] == self._SHUTDOWN:
+                    self.task_queue.put(entry)
+                    break
+        
+        for task_id in queued:
+            self.release_task(task_id)
+        
+        for state in running:
+            state.terminate()
+
     @classmethod
     def get_instance(cls):
         return cls._instance
@@ -1,8 +1,15 @@
 from enum import Enum
 import threading
+import os
+
+from concurrent.futures import ProcessPoolExecutor, wait
 
 from operator_mod.logger.global_logger import Logger
 
+from controller.algorithms.pellet_sizer.pellet_sizer import PelletSizer
+from controller.algorithms.pellet_sizer.shared_image import SharedImage
+from controller.algorithms.pellet_sizer.memory_budget import MemoryBudget
+from controller.algorithms.pellet_sizer.buffer_pool import BufferPool
 from controller.algorithms.algorithm_manager_class.states.all_states import PelletSizerSingleState
 from controller.algorithms.algorithm_manager_class.abc_class.state_machine_template import Manager
 
@@ -10,6 +17,7 @@ class AlgorithmManager(Manager):
 
     _instance = None
     _lock = threading.Lock()
+    _pool_lock = threading.Lock()
     
     class States(Enum):
         PELLET_SIZER_SINGLE_STATE = 0
@@ -32,12 +40,92 @@ class AlgorithmManager(Manager):
         # Synchronization
         self.measurement_start_event = threading.Event()
         self.shutdown_flag = threading.Event()
-                
-        # Trying ThreadPoolExecutor
-        self.executor._max_workers = 5
+        
+        # Size of the worker process pool, None = os.cpu_count()
+        self.process_workers = None
+        
+        # Large images are admitted to the workers only as long as their estimates fit into this
+        self.memory_budget = MemoryBudget.default_budget()
         
         self.logger.info("Algorithm Manager initialized and ready for work.")
 
+    def start_process_pool(self, workers: int = None, warmup: bool = True) -> None:
+        """Starts the long-lived worker process pool that is shared by all states.
+
+        Args:
+            workers (int, optional): number of worker processes. Defaults to os.cpu_count().
+            warmup (bool, optional): if every worker should process a dummy image to load cv2/numpy upfront. Defaults to True.
+        """
+        with self._pool_lock:
+            self._start_process_pool(workers, warmup)
+    
+    def _start_process_pool(self, workers: int = None, warmup: bool = True) -> None:
+        """Starts the pool, the caller holds _pool_lock."""
+        
+        if workers is not None:
+            self.process_workers = workers
+        
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+        
+        # Scratch files of result images left over from earlier runs, only while no state may still attach its own
+        with self._lock:
+            idle = not self._running
+        
+        if idle:
+            SharedImage.cleanup()
+        
+        workers = self.process_workers or os.cpu_count() or 1
+        
+        # The idle scratch buffers the workers keep are part of the memory budget, the images in flight get the rest
+        budget = MemoryBudget.default_budget()
+        pool_limit = BufferPool.worker_limit(budget, workers)
+        self.memory_budget = budget - workers * pool_limit
+        
+        self.process_pool = ProcessPoolExecutor(max_workers=workers, initializer=BufferPool.limit_worker, initargs=(pool_limit,))
+        
+        if warmup:
+            # One dummy task per worker so every process is spawned and has its imports loaded
+            warmups = [self.process_pool.submit(PelletSizer.warmup) for _ in range(workers)]
+            
+            # Waiting in the background, the GUI does not need to wait for it
+            threading.Thread(target=self._log_warmup, args=(warmups,), daemon=True).start()
+        
+        self.logger.info(f"Worker process pool started with {workers} workers, {pool_limit / 1024 ** 2:.0f} MiB of scratch buffers each.")
+            
+    def get_process_pool(self) -> ProcessPoolExecutor:
+        """Returns the shared worker process pool. Restarts it if it was never started or a worker died.
+
+        Returns:
+            ProcessPoolExecutor: the worker pool
+        """
+        # Checked and restarted under the lock, so states that find a broken pool at once restart it only once
+        # and never shut down the pool another state just got
+        with self._pool_lock:
+            if self.process_pool is None or getattr(self.process_pool, "_broken", False):
+                self.logger.warning("Worker process pool not running, starting it now.")
+                self._start_process_pool(warmup=False)
+            
+            return self.process_pool
+    
+    def shutdown(self):
+        
+        super().shutdown()
+        
+        # Removing the scratch files of result images that are not displayed anymore
+        SharedImage.cleanup()
+    
+    def _log_warmup(self, futures: list) -> None:
+        
+        wait(futures)
+        
+        failed = [future for future in futures if future.cancelled() or future.exception() is not None]
+        
+        if failed:
+            self.logger.warning(f"Warm-up of {len(failed)} worker processes failed.")
+        else:
+            self.logger.info("Worker process pool warmed up.")
+
     @classmethod
     def get_instance(cls):
-        return cls._instance
\ No newline at end of file
+        return cls._instance
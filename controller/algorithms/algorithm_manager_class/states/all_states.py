@@ -1,10 +1,20 @@
 
 
-from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+from datetime import datetime
+from concurrent.futures import CancelledError
 
 
 
 from controller.algorithms.pellet_sizer.pellet_sizer import PelletSizer
+from controller.algorithms.pellet_sizer.batch_threshold import BatchThreshold
+from controller.algorithms.pellet_sizer.shared_image import SharedImage
+from controller.algorithms.pellet_sizer.buffer_pool import BufferPool
+from controller.algorithms.pellet_sizer.memory_budget import MemoryBudget
+from controller.algorithms.pellet_sizer.stage_timer import StageTimer
+from controller.algorithms.pellet_sizer.result_cache import ResultCache
+from controller.algorithms.pellet_sizer.steps.overlay import Overlay
 from controller.algorithms.algorithm_manager_class.states.state_baseclass import State
 
 
@@ -12,41 +22,111 @@ class PelletSizerSingleState(State):
     
     def run_logic(self):
         
-        # Grabbing the reference PelletsizerWidget
-        reference = self.data.get_data(self.data.Keys.PELLET_SIZER_WIDGET_REFERENCE, self.data.Namespaces.DEFAULT)
+        # Grabbing the reference PelletsizerWidget, every widget passes itself with its task
+        reference = self.get_input(self.data.Keys.PELLET_SIZER_WIDGET_REFERENCE)
 
         ### Get the information
-        self.target_paths = self.data.get_data(self.data.Keys.PELLET_SIZER_IMAGES, self.data.Namespaces.DEFAULT)
-        self.target_settings = self.data.get_data(self.data.Keys.PELLET_SIZER_IMAGE_SETTINGS, self.data.Namespaces.DEFAULT)
+        self.target_paths = self.get_input(self.data.Keys.PELLET_SIZER_IMAGES)
+        self.target_settings = self.get_input(self.data.Keys.PELLET_SIZER_IMAGE_SETTINGS)
+        threshold_mode = self.get_input(self.data.Keys.PELLET_SIZER_THRESHOLD_MODE) or BatchThreshold.Mode.IMAGE
         
         pelletsizer = PelletSizer()
+        
+        # Unchanged images with unchanged settings are taken from the cache of the project, if asked for. The masks
+        # are stored as well, the widget renders the overlays from them
+        project_path = self.data.get_data(self.data.Keys.PROJECT_PATH, self.data.Namespaces.DEFAULT)
+        cache = None
+        
+        if self.get_input(self.data.Keys.PELLET_SIZER_USE_CACHE):
+            cache = ResultCache.for_project(project_path, store_masks=True)
+            
+            if cache is None:
+                self.logger.info("No project open, the pellet sizer results are not cached.")
+        
+        # The measurements are stored in the result database of the project, unless the task names another one
+        result_db = self.get_input(self.data.Keys.PELLET_SIZER_RESULT_DB)
+        if not result_db and project_path:
+            result_db = os.path.join(project_path, "pellet_results.db")
+        
+        if not result_db:
+            self.logger.info("No project open, the pellet sizer results are not stored in a database.")
+        
+        run = datetime.now().isoformat(timespec="seconds")
 
-        reference._progressbar_update(0.2)
+        reference.progress_changed.emit(self.task_id, 0)
         
-        results = []
-        with ProcessPoolExecutor() as executor:
+        # Only the measurement tables are kept here, the images are handed to the widget right away
+        results = [None] * len(self.target_paths)
+        
+        # Scratch memory and time per step of all images of this run
+        buffers = {}
+        timings = {}
+        
+        # The worker processes are owned by the AlgorithmManager and reused for every run
+        executor = self.instance.get_process_pool()
             
-            try:
-                futures = []
-                for i, path in enumerate(self.target_paths):
-                    
-                    futures.append(executor.submit(pelletsizer.processing, path, True, self.target_settings[i]))
+        try:
+            # Shared automatic thresholds are computed from the histograms of all images before the main pass
+            if threshold_mode != BatchThreshold.Mode.IMAGE:
+                thresholds = BatchThreshold.compute(self.target_paths, self.target_settings, threshold_mode, executor, self.track)
+                self.target_settings = BatchThreshold.apply(self.target_settings, thresholds)
                 
-                reference._progressbar_update(0.5)
+                self.logger.info(f"Shared thresholds ({threshold_mode.value}): {sorted(set(t for t in thresholds if t is not None))}.")
+            
+            # The result images come back as unrendered overlays in memory-mapped scratch files instead of through the pipe
+            calls = [(path, True, self.target_settings[i], PelletSizer.Transport.SHARED, True, cache, True) for i, path in enumerate(self.target_paths)]
+            
+            # Memory per image from the file headers, large images go first and only as many as fit into the budget
+            costs = [MemoryBudget.estimate(path) for path in self.target_paths]
+            
+            # Streaming the results in order of completion, the workers are shared fairly with other running tasks
+            # and it stops early when the state is terminated or out of time
+            for finished, (index, future) in enumerate(self.submit_fair(executor, pelletsizer.processing, calls, costs), start=1):
                 
-                for future in futures:
+                try:
                     result = future.result()
+                    start = time.perf_counter()
+                    
+                    if isinstance(result.get("Image"), SharedImage):
+                        result["Image"] = result["Image"].attach()
+                        
+                    elif isinstance(result.get("Image"), Overlay):
+                        result["Image"].attach()
+                    
+                    # Mapping the image in this process is the receiving end of the transport
+                    result["Timing"]["Attach"] = {"Seconds": time.perf_counter() - start}
+                    
+                    buffers = BufferPool.add(buffers, result["Buffers"])
+                    timings = StageTimer.add(timings, result["Timing"])
+                    results[index] = {"Data": result["Data"], "Pixels": result["Pixels"], "Threshold": result["Threshold"], "Settings": result["Settings"], "Timing": result["Timing"]}
+                    
+                    if result_db:
+                        self.alg_data_writer.pellet_size_writer(result_db, self.target_paths[index], results[index], run)
+                    
+                    reference.pellet_result_ready.emit(self.task_id, index, result)
+                    
+                except Exception as e:
+                    self.logger.error(f"Error occured in pellet sizer for {self.target_paths[index]}: {e}.")
+                
+                reference.progress_changed.emit(self.task_id, finished / len(results))
 
-                    if results is not None:
-                        results.append(result)
-
-                reference._progressbar_update(0.9)
+        except CancelledError:
+            self.logger.info("Pellet sizer cancelled during the threshold pass.")
 
-            except Exception as e:
-                self.logger.error(f"Error occured in pellet sizer: {e}.")
+        except Exception as e:
+            self.logger.error(f"Error occured in pellet sizer: {e}.")
+        
+        if self.terminated:
+            reason = "runtime budget exceeded" if self.timed_out else "stopped"
+            self.logger.warning(f"Pellet sizer {reason} after {len(results) - results.count(None)} of {len(results)} images, keeping the partial results.")
 
-        self.data.add_data(self.data.Keys.PELLET_SIZER_RESULT, results, self.data.Namespaces.DEFAULT)
+        self.logger.info(f"Pellet sizer scratch buffers: {buffers.get('Allocated', 0) / 1024 ** 2:.1f} MiB allocated, {buffers.get('Reused', 0) / 1024 ** 2:.1f} MiB reused.")
+        
+        if timings:
+            self.logger.info(f"Pellet sizer steps: {StageTimer.summary(timings)}.")
+        
+        self.set_result(results)
 
-        reference.pellet_sizing_done.emit()
+        reference.pellet_sizing_done.emit(self.task_id)
         
 
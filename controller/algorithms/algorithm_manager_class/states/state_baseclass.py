@@ -1,16 +1,19 @@
 
 import datetime
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import wait, FIRST_COMPLETED
 
 from model.utils.resource_manager import ResourceManager
 from operator_mod.logger.global_logger import Logger
 from operator_mod.in_mem_storage.in_memory_data import InMemoryData
 from controller.algorithms.data_writer.data_writer import DataWriter
+from controller.algorithms.pellet_sizer.memory_budget import MemoryBudget
 
 # Abstract State Class
 class State(ABC):
     
-    def __init__(self, instance, runtime):
+    def __init__(self, instance, runtime, task_id: int = None):
         
         self.data = InMemoryData()
         self.logger = Logger("Algorithm Manager").logger
@@ -24,8 +27,20 @@ class State(ABC):
         self.processed_images = set()
             
         self.instance = instance
-        self.runtime_target = datetime.datetime.now() + datetime.timedelta(seconds=runtime)
+        
+        # Inputs and the result of the task are kept in its own namespace
+        self.task_id = task_id
+        self.namespace = instance.task_namespace(task_id) if task_id is not None else self.data.Namespaces.DEFAULT
+        self.result = None
+        
+        # A runtime of 0 or less is no budget
+        self.runtime_target = datetime.datetime.now() + datetime.timedelta(seconds=runtime) if runtime and runtime > 0 else None
         self.terminated = False
+        self.timed_out = False
+        
+        # Futures of the worker processes, terminate() cancels the ones that did not start yet
+        self._futures = set()
+        self._futures_lock = threading.Lock()
 
     def run(self):
         try:
@@ -59,5 +74,150 @@ class State(ABC):
         except Exception as e:
             self.logger.warning(f"Error - Algorithm Manger could not check in resource manager: {e}")
 
+    def get_input(self, key):
+        """Returns an input of the task, falls back to the default namespace for tasks without inputs.
+
+        Args:
+            key (InMemoryData.Keys): key of the input
+        """
+        value = self.data.get_data(key, self.namespace)
+        
+        if value is None and self.namespace != self.data.Namespaces.DEFAULT:
+            value = self.data.get_data(key, self.data.Namespaces.DEFAULT)
+            
+        return value
+    
+    def set_result(self, result) -> None:
+        """Stores the result of the task, it is handed to the callback of the task and kept for Manager.get_result.
+        """
+        self.result = result
+        self.data.add_data(self.data.Keys.TASK_RESULT, result, self.namespace)
+    
+    def remaining(self) -> float:
+        """Returns the seconds left of the runtime budget, None without a budget."""
+        
+        if self.runtime_target is None:
+            return None
+        
+        return max((self.runtime_target - datetime.datetime.now()).total_seconds(), 0.0)
+    
+    def should_stop(self) -> bool:
+        """Checks if the state was terminated or ran out of its runtime budget. States check this between work items.
+        """
+        if not self.terminated and self.remaining() == 0.0:
+            self.logger.warning("Runtime budget of the state exceeded, stopping.")
+            self.timed_out = True
+            self.terminate()
+            
+        return self.terminated
+    
+    def track(self, futures) -> None:
+        """Registers futures that are cancelled when the state is terminated.
+
+        Args:
+            futures (Iterable[Future]): futures of the worker pool
+        """
+        with self._futures_lock:
+            self._futures.update(futures)
+            
+        # Terminated while the futures were submitted
+        if self.terminated:
+            self.terminate()
+    
+    def as_completed(self, futures):
+        """Yields the futures in order of completion like concurrent.futures.as_completed, but stops waiting for
+        work that did not start when the state is terminated or the runtime budget is over. Images that are already
+        running finish and are still yielded, so their results are kept.
+
+        Args:
+            futures (Iterable[Future]): futures of the worker pool
+
+        Yields:
+            Future: finished future, cancelled ones are skipped
+        """
+        pending = set(futures)
+        self.track(pending)
+        
+        while pending:
+            # Cancelling the futures in terminate() wakes us up, the timeout is the end of the budget
+            done, pending = wait(pending, timeout=None if self.terminated else self.remaining(), return_when=FIRST_COMPLETED)
+            
+            if not done:
+                self.should_stop()
+                continue
+            
+            for future in done:
+                if not future.cancelled():
+                    yield future
+        
+        with self._futures_lock:
+            self._futures.difference_update(futures)
+
+    def submit_fair(self, executor, fn, calls: list, costs: list = None):
+        """Submits fn for every argument tuple and yields the futures in order of completion. Only the fair share of
+        the manager is in the pool at once, so the workers are shared with the other running states. Stops like
+        as_completed when the state is terminated or out of time.
+
+        Args:
+            executor (Executor): worker pool
+            fn (callable): function to run
+            calls (list): argument tuples, one per call
+            costs (list, optional): memory estimate per call in bytes. The calls in flight stay within the memory share
+                of the manager and the largest are submitted first, so they do not end up in the tail. Defaults to None.
+
+        Yields:
+            tuple: (index in calls, finished future)
+        """
+        order = list(range(len(calls)))
+        
+        if costs is not None:
+            order.sort(key=lambda i: costs[i], reverse=True)
+        
+        queued = iter(order)
+        waiting = next(queued, None)
+        futures = {}
+        in_flight = 0
+        
+        while True:
+            # Refilling up to the share, it changes as other states start and end
+            while waiting is not None and not self.should_stop() and len(futures) < self.instance.fair_share():
+                cost = costs[waiting] if costs is not None else 0
+                
+                if not MemoryBudget.admit(cost, in_flight, len(futures), self.instance.memory_share() if costs is not None else None):
+                    break
+                
+                futures[executor.submit(fn, *calls[waiting])] = waiting
+                in_flight += cost
+                self.track(futures)
+                
+                waiting = next(queued, None)
+            
+            if not futures:
+                break
+            
+            done, _ = wait(futures, timeout=None if self.terminated else self.remaining(), return_when=FIRST_COMPLETED)
+            
+            if not done:
+                self.should_stop()
+            
+            for future in done:
+                index = futures.pop(future)
+                in_flight -= costs[index] if costs is not None else 0
+                
+                if not future.cancelled():
+                    yield index, future
+        
+        with self._futures_lock:
+            self._futures.clear()
+    
     def terminate(self):
-        self.terminated = True
\ No newline at end of file
+        self.terminated = True
+        
+        with self._futures_lock:
+            futures = list(self._futures)
+        
+        # Running futures can not be cancelled, they finish their image
+        cancelled = sum(future.cancel() for future in futures)
+        
+        if cancelled:
+            self.logger.info(f"Cancelled {cancelled} pending work items of the state.")
\ No newline at end of file
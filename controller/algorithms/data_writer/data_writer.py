@@ -1,15 +1,67 @@
 
+import json
+import threading
+
 from model.utils.SQL.sql_manager import SQLManager
+from controller.algorithms.data_writer.write_behind import WriteBehindQueue
 
 from operator_mod.in_mem_storage.in_memory_data import InMemoryData
 from operator_mod.logger.global_logger import Logger
 
 class DataWriter:
-    """The corresponding data writer functions for each executable algorithm in the AlgorithmManger."""
+    """The corresponding data writer functions for each executable algorithm in the AlgorithmManger.
+    
+    The rows are only enqueued, the WriteBehindQueue writes them in batches in the background."""
+
+    # Pellet sizer tables, one row per image and one per pellet. Run is the start of the analysis, so repeated
+    # analyses of the same image stay apart
+    PELLET_IMAGE_TABLE = "PelletSizeImages"
+    PELLET_IMAGE_COLUMNS = {
+        "Run": "TEXT",
+        "Image": "TEXT",
+        "Pellets": "INTEGER",
+        "Threshold": "REAL",
+        "Blur": "TEXT",
+        "Magnification": "TEXT",
+        "PixelToUm": "REAL",
+        "Settings": "TEXT",
+        "AlgorithmVersion": "INTEGER"
+    }
+    
+    PELLET_TABLE = "PelletSizeResults"
+    # In order of PelletSizer.RESULT_COLUMNS, followed by the pixel columns that are not part of them
+    PELLET_COLUMNS = {
+        "Run": "TEXT",
+        "Image": "TEXT",
+        "Pellet": "INTEGER",
+        "AreaPx": "REAL",
+        "EqDiameterPx": "REAL",
+        "EqPerimeterPx": "REAL",
+        "AreaUm2": "REAL",
+        "EqDiameterUm": "REAL",
+        "EqPerimeterUm": "REAL",
+        "PerimeterUm": "REAL",
+        "FeretMaxUm": "REAL",
+        "EqVolumeUm3": "REAL",
+        "Circularity": "REAL",
+        "Compactness": "REAL",
+        "ArcLengthPx": "REAL",
+        "FeretMaxPx": "REAL"
+    }
+    
+    PELLET_INDEXES = {
+        PELLET_IMAGE_TABLE: [["Image"], ["Run"]],
+        PELLET_TABLE: [["Image"], ["Run"], ["AreaUm2"], ["EqDiameterUm"], ["FeretMaxUm"]]
+    }
+    
+    # Databases the pellet tables were created in by this process
+    _pellet_databases = set()
+    _pellet_lock = threading.Lock()
 
     def __init__(self):
 
         self.sql = SQLManager()
+        self.write_queue = WriteBehindQueue()
         self.logger = Logger("Controller").logger
         
         self.data = InMemoryData()
@@ -33,27 +85,87 @@ class DataWriter:
             result_db = self.data.get_data(self.data.Keys.CURRENT_SLOT_RESULT_DB, namespace=self.data.Namespaces.MEASUREMENT)
 
             keys = ["CenterX", "CenterY", "EquivalentDiameter", "Area", "SurfaceArea", "Volume", "SpecificSurfaceVolume", "SauterDiameter", "Circularity"]
-            data_dict = {}
-
-            data_dict["Image"] = results["Image"]
+            rows = []
         
             for ellipse in results["Data"]:
                 
+                data_dict = {"Image": results["Image"]}
+                
                 if not ellipse:
                     for i, key in enumerate(keys):
                         data_dict[key] = "Faulty Data"
                 else:
                     for i, key in enumerate(keys):
                         data_dict[key] = ellipse[i]
+                
+                rows.append(data_dict)
 
-                table, insert = self.sql.generate_sql_statements("BubbleSizeResults", data_dict)
-
-                self.sql.read_or_write(result_db, table, "write")
-                self.sql.read_or_write(result_db, insert, "write")
+            # All bubbles of the image in one transaction
+            self.write_queue.put_rows(result_db, "BubbleSizeResults", rows)
                 
         except Exception as e:
             self.logger.warning(f"Error - Could not write bubble sizer results: {e}.")
 
+    def pellet_size_writer(self, result_db: str, path: str, result: dict, run: str) -> None:
+        """Writes the image row and the pellet rows of one pellet sizer result. The typed tables and their
+        indexes are created on the first write into a database.
+
+        Args:
+            result_db (str): path to the .db file
+            path (str): image path
+            result (dict): "Data", "Pixels", "Threshold" and "Settings" of PelletSizer.processing
+            run (str): start of the analysis, e.g. "2025-01-31T12:00:00"
+        """
+        # Imported here, the data writer is also used without the pellet sizer
+        from controller.algorithms.pellet_sizer.pellet_sizer import PelletSizer
+        from controller.algorithms.pellet_sizer.steps.scaling import Scaling
+        
+        try:
+            self._create_pellet_tables(result_db)
+            
+            settings = result["Settings"] or []
+            magnification = Scaling.magnification_from_settings(settings)
+            
+            image_row = {
+                "Run": run,
+                "Image": path,
+                "Pellets": len(result["Data"]),
+                "Threshold": result["Threshold"],
+                "Blur": settings[1] if len(settings) > 1 else None,
+                "Magnification": str(magnification),
+                "PixelToUm": Scaling.pixel_to_um(magnification),
+                "Settings": json.dumps(settings, default=str),
+                "AlgorithmVersion": PelletSizer.ALGORITHM_VERSION
+            }
+            
+            names = list(self.PELLET_COLUMNS)[3:]
+            pixels = result.get("Pixels") or [[None] * 3] * len(result["Data"])
+            
+            rows = []
+            # Numbered from 1 like the labels drawn on the result image
+            for number, (data, pixel) in enumerate(zip(result["Data"], pixels), start=1):
+                row = {"Run": run, "Image": path, "Pellet": number}
+                row.update(zip(names, [*data, pixel[1], pixel[2]]))
+                rows.append(row)
+            
+            self.write_queue.put_rows(result_db, self.PELLET_IMAGE_TABLE, [image_row])
+            self.write_queue.put_rows(result_db, self.PELLET_TABLE, rows)
+            
+        except Exception as e:
+            self.logger.warning(f"Error - Could not write pellet sizer results of {path}: {e}.")
+    
+    def _create_pellet_tables(self, result_db: str) -> None:
+        
+        with DataWriter._pellet_lock:
+            if result_db in DataWriter._pellet_databases:
+                return
+            
+            created = self.sql.create_table(result_db, self.PELLET_IMAGE_TABLE, self.PELLET_IMAGE_COLUMNS, self.PELLET_INDEXES[self.PELLET_IMAGE_TABLE])
+            created = self.sql.create_table(result_db, self.PELLET_TABLE, self.PELLET_COLUMNS, self.PELLET_INDEXES[self.PELLET_TABLE]) and created
+            
+            if created:
+                DataWriter._pellet_databases.add(result_db)
+
     def mixing_time_writer(self, data):
         """The data dict gets written to sql.
         
@@ -95,10 +207,7 @@ class DataWriter:
                 for reskey in resultskeys:
                     data_dict["Block" + str(key+1) + str(reskey)] = str(resultsdata[key][reskey])
 
-            table, insert = self.sql.generate_sql_statements("MixingTimeResults", data_dict)
-
-            self.sql.read_or_write(result_db, table, "write")
-            self.sql.read_or_write(result_db, insert, "write")
+            self.write_queue.put_rows(result_db, "MixingTimeResults", [data_dict])
 
         except Exception as e:
             self.logger.warning(f"Error - Could not write data: {e}.")
@@ -121,10 +230,7 @@ class DataWriter:
                 "Fanspeed": fanspeed
             }
                         
-            table, insert = self.sql.generate_sql_statements("EnvironmentData", write_data)
-            
-            self.sql.read_or_write(result_db, table, "write")
-            self.sql.read_or_write(result_db, insert, "write")
+            self.write_queue.put_rows(result_db, "EnvironmentData", [write_data])
         
         except Exception as e:
             self.logger.warning(f"Could not write Arduino data: {e}.")
@@ -144,10 +250,7 @@ class DataWriter:
                 "Massflow": read[0]
             }
             
-            table, insert = self.sql.generate_sql_statements("EnvironmentData", write_data)
-            
-            self.sql.read_or_write(result_db, table, "write")
-            self.sql.read_or_write(result_db, insert, "write")
+            self.write_queue.put_rows(result_db, "EnvironmentData", [write_data])
         
         except Exception as e:
             self.logger.warning(f"Error - Could not write MFC data: {e}.")
\ No newline at end of file
@@ -0,0 +1,215 @@
+import queue
+import threading
+import time
+
+from model.utils.SQL.sql_manager import SQLManager
+
+from operator_mod.logger.global_logger import Logger
+
+class WriteBehindQueue:
+    """Write-behind persistence for the DataWriter. Writers only enqueue their rows, a background thread collects
+    them per database and table and writes each batch in one transaction once it is MAX_BATCH_ROWS rows large or
+    its oldest row waited MAX_DELAY seconds.
+
+    Integration:
+        writer = WriteBehindQueue()
+        writer.put_rows(path, "EnvironmentData", [{"Fanspeed": 50.0}])
+        writer.flush()       # waits until everything enqueued is written
+        writer.get_metrics() # {"Backlog": rows, "FlushLatencyAvg": s, ...}
+        writer.shutdown()    # flushes and stops the thread
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    MAX_BATCH_ROWS = 5000
+    MAX_DELAY = 0.5
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(WriteBehindQueue, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self) -> None:
+
+        with self._lock:
+            if hasattr(self, '_initialized') and self._initialized:
+                return
+
+            self.logger = Logger("Controller").logger
+            self.sql = SQLManager()
+
+            # Entries are ("rows", path, table, rows, enqueued), ("flush", event) or ("stop", event)
+            self._queue = queue.Queue()
+
+            self._metrics_lock = threading.Lock()
+            self._metrics = {
+                "Backlog": 0,
+                "Enqueued": 0,
+                "Written": 0,
+                "Failed": 0,
+                "Batches": 0,
+                "LatencyTotal": 0.0,
+                "LatencyMax": 0.0,
+                "WriteTotal": 0.0,
+                "WriteMax": 0.0
+            }
+
+            self._thread = None
+            self._start()
+
+            self._initialized = True
+
+    def _start(self) -> None:
+
+        self._thread = threading.Thread(target=self._run, name="WriteBehindQueue", daemon=True)
+        self._thread.start()
+
+    def put_rows(self, path: str, table_name: str, rows: list) -> None:
+        """Enqueues rows, they are written in the background.
+
+        Args:
+            path (str): path to the .db file
+            table_name (str): table
+            rows (list): dicts of column -> value
+        """
+        if not path:
+            self.logger.warning(f"No database for {len(rows)} rows of {table_name}, dropped.")
+            return
+
+        if not rows:
+            return
+
+        # Restarted after a shutdown, e.g. when a new measurement is started
+        if not self._thread.is_alive():
+            with self._lock:
+                if not self._thread.is_alive():
+                    self._start()
+
+        with self._metrics_lock:
+            self._metrics["Backlog"] += len(rows)
+            self._metrics["Enqueued"] += len(rows)
+
+        self._queue.put(("rows", path, table_name, list(rows), time.perf_counter()))
+
+    def flush(self, timeout: float = None) -> bool:
+        """Writes everything enqueued so far and waits for it.
+
+        Args:
+            timeout (float, optional): seconds to wait. Defaults to None (no limit).
+
+        Returns:
+            bool: True if everything was written in time
+        """
+        if not self._thread.is_alive():
+            return True
+
+        done = threading.Event()
+        self._queue.put(("flush", done))
+
+        return done.wait(timeout)
+
+    def shutdown(self, timeout: float = None) -> bool:
+        """Flushes and stops the background thread.
+
+        Args:
+            timeout (float, optional): seconds to wait. Defaults to None (no limit).
+
+        Returns:
+            bool: True if everything was written in time
+        """
+        if not self._thread.is_alive():
+            return True
+
+        done = threading.Event()
+        self._queue.put(("stop", done))
+
+        flushed = done.wait(timeout)
+
+        if flushed:
+            self._thread.join()
+
+        self.logger.info(f"Write-behind queue stopped: {self.get_metrics()}.")
+
+        return flushed
+
+    def get_metrics(self) -> dict:
+        """Returns the metrics of the queue.
+
+        Returns:
+            dict: "Backlog" rows not written yet, "Enqueued", "Written" and "Failed" rows, "Batches", "FlushLatencyAvg"
+                and "FlushLatencyMax" from the oldest row of a batch to its commit in s, "WriteAvg" and "WriteMax" per batch in s
+        """
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+
+        batches = metrics["Batches"]
+
+        metrics["FlushLatencyAvg"] = metrics.pop("LatencyTotal") / batches if batches else 0.0
+        metrics["FlushLatencyMax"] = metrics.pop("LatencyMax")
+        metrics["WriteAvg"] = metrics.pop("WriteTotal") / batches if batches else 0.0
+
+        return metrics
+
+    def _run(self) -> None:
+
+        # (path, table) -> [rows, enqueued time of the oldest row]
+        pending = {}
+
+        while True:
+
+            # Sleeping until the oldest batch is due, without pending rows until the next entry arrives
+            timeout = None
+            if pending:
+                timeout = max(min(first for _, first in pending.values()) + self.MAX_DELAY - time.perf_counter(), 0.0)
+
+            try:
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                entry = None
+
+            if entry is not None and entry[0] == "rows":
+                _, path, table_name, rows, enqueued = entry
+
+                batch = pending.setdefault((path, table_name), [[], enqueued])
+                batch[0].extend(rows)
+
+                if len(batch[0]) >= self.MAX_BATCH_ROWS:
+                    self._write(pending.pop((path, table_name)), path, table_name)
+
+            elif entry is not None:
+                # Flush or stop, everything enqueued before is written
+                for (path, table_name), batch in list(pending.items()):
+                    self._write(batch, path, table_name)
+                pending.clear()
+
+                entry[1].set()
+
+                if entry[0] == "stop":
+                    break
+
+            now = time.perf_counter()
+
+            for key in [key for key, (_, first) in pending.items() if now - first >= self.MAX_DELAY]:
+                self._write(pending.pop(key), *key)
+
+    def _write(self, batch: list, path: str, table_name: str) -> None:
+
+        rows, first = batch
+
+        start = time.perf_counter()
+        written = self.sql.write_rows(path, table_name, rows)
+        end = time.perf_counter()
+
+        if not written:
+            self.logger.warning(f"Write-behind batch of {len(rows)} rows into {table_name} failed.")
+
+        with self._metrics_lock:
+            self._metrics["Backlog"] -= len(rows)
+            self._metrics["Written" if written else "Failed"] += len(rows)
+            self._metrics["Batches"] += 1
+            self._metrics["LatencyTotal"] += end - first
+            self._metrics["LatencyMax"] = max(self._metrics["LatencyMax"], end - first)
+            self._metrics["WriteTotal"] += end - start
+            self._metrics["WriteMax"] = max(self._metrics["WriteMax"], end - start)
@@ -0,0 +1,6 @@
+import sys
+
+from controller.algorithms.pellet_sizer.batch_runner import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,334 @@
+
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from operator_mod.logger.global_logger import Logger
+
+from controller.algorithms.pellet_sizer.pellet_sizer import PelletSizer
+from controller.algorithms.pellet_sizer.batch_threshold import BatchThreshold
+from controller.algorithms.pellet_sizer.result_cache import ResultCache
+from controller.algorithms.pellet_sizer.buffer_pool import BufferPool
+from controller.algorithms.pellet_sizer.memory_budget import MemoryBudget
+from controller.algorithms.pellet_sizer.stage_timer import StageTimer
+from controller.algorithms.pellet_sizer.steps.pipeline import PreprocessingPipeline
+from controller.algorithms.data_writer.data_writer import DataWriter
+
+class PelletBatchRunner:
+    """Headless batch processing of pellet images. Streams the image paths through a bounded process pool
+    and writes the results of every image as soon as it is finished.
+
+    Integration:
+        runner = PelletBatchRunner(output_dir, workers=4)
+        summary = runner.run(runner.collect_paths(["D:/images"]), [-1, "Gaussian", "2X"])
+    """
+
+    IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff")
+
+    def __init__(self, output_dir: str, workers: int = None, max_in_flight: int = None, save_images: bool = False, cache: ResultCache = None, threshold_mode: BatchThreshold.Mode = BatchThreshold.Mode.IMAGE, memory_budget: int = None, timing: bool = False, result_db: str = None) -> None:
+        """Sets up the runner.
+
+        Args:
+            output_dir (str): directory where the result tables are written to
+            workers (int, optional): number of worker processes. Defaults to os.cpu_count().
+            max_in_flight (int, optional): maximum of submitted but unfinished images. Defaults to 2 * workers.
+            save_images (bool, optional): if the annotated images should be exported as well. Defaults to False.
+            cache (ResultCache, optional): cache for results of unchanged images. Defaults to None.
+            threshold_mode (BatchThreshold.Mode, optional): how automatic thresholds are computed. Defaults to BatchThreshold.Mode.IMAGE.
+            memory_budget (int, optional): bytes the workers may use, for the images in flight by their estimates and the idle scratch buffers. Defaults to MemoryBudget.default_budget().
+            timing (bool, optional): if the time and memory of every step is written to timing.csv. Defaults to False.
+            result_db (str, optional): .db file the image and pellet rows are stored in as well. Defaults to None.
+        """
+        self.logger = Logger("PelletSizer").logger
+
+        self.output_dir = output_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or 2 * self.workers
+        self.save_images = save_images
+        self.cache = cache
+        self.threshold_mode = threshold_mode
+        # The idle scratch buffers of the workers are part of the memory budget, the images in flight get the rest
+        memory_budget = memory_budget or MemoryBudget.default_budget()
+        self.pool_limit = BufferPool.worker_limit(memory_budget, self.workers)
+        self.memory_budget = memory_budget - self.workers * self.pool_limit
+        self.timing = timing
+        self.result_db = result_db
+
+        self.pelletsizer = PelletSizer()
+
+    def collect_paths(self, inputs: list) -> list:
+        """Resolves directories, glob patterns and single files to a sorted list of image paths.
+
+        Args:
+            inputs (list): str paths, directories or glob patterns
+
+        Returns:
+            list: image paths without duplicates
+        """
+        paths = []
+        seen = set()
+
+        for entry in inputs:
+
+            if os.path.isdir(entry):
+                candidates = sorted(os.path.join(entry, name) for name in os.listdir(entry))
+            elif os.path.isfile(entry):
+                candidates = [entry]
+            else:
+                candidates = sorted(glob.glob(entry, recursive=True))
+
+            for candidate in candidates:
+                if not os.path.isfile(candidate) or not candidate.lower().endswith(self.IMAGE_EXTENSIONS):
+                    continue
+
+                if candidate not in seen:
+                    seen.add(candidate)
+                    paths.append(candidate)
+
+        return paths
+
+    @staticmethod
+    def output_names(paths: list) -> list:
+        """Derives a unique file name stem per image from its path relative to the common folder of all images,
+        so images with the same name in different folders do not overwrite each others results.
+
+        Args:
+            paths (list): image paths
+
+        Returns:
+            list: name per path, e.g. "a_img1" and "b_img1" for a/img1.png and b/img1.png
+        """
+        if not paths:
+            return []
+
+        directories = [os.path.dirname(os.path.abspath(path)) for path in paths]
+
+        try:
+            root = os.path.commonpath(directories)
+        except ValueError:
+            # Different drives on Windows, the drive letter becomes part of the name
+            root = None
+
+        names = []
+        used = set()
+
+        for path in paths:
+            if root is None:
+                drive, relative = os.path.splitdrive(os.path.abspath(path))
+                relative = drive.rstrip(":") + relative
+            else:
+                relative = os.path.relpath(os.path.abspath(path), root)
+
+            name = os.path.splitext(relative)[0].strip(os.sep + "/").replace(os.sep, "_").replace("/", "_")
+
+            # Still equal after flattening (e.g. "a_b/c" and "a/b_c") or only the extension differed
+            candidate, i = name, 1
+            while candidate in used:
+                i += 1
+                candidate = f"{name}_{i}"
+
+            used.add(candidate)
+            names.append(candidate)
+
+        return names
+
+    def run(self, paths: list, settings: list) -> dict:
+        """Processes all paths and writes the results incrementally.
+
+        Args:
+            paths (list): image paths
+            settings (list): [thresh_value, blur, magnification] used for every image
+
+        Returns:
+            dict: {"Images": processed, "Failed": failed, "Seconds": runtime, "Throughput": images/s, "Buffers": scratch memory of all images, "Timing": steps of all images}
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        summary_path = os.path.join(self.output_dir, "summary.csv")
+
+        names = self.output_names(paths)
+
+        processed = 0
+        failed = 0
+        buffers = {}
+        timings = {}
+        start = time.perf_counter()
+
+        writer = DataWriter() if self.result_db else None
+        run = datetime.now().isoformat(timespec="seconds")
+
+        # One row per image and step in the timing file
+        timing_path = os.path.join(self.output_dir, "timing.csv")
+
+        with open(summary_path, "w", newline="", encoding="utf-8") as summary_file, (open(timing_path, "w", newline="", encoding="utf-8") if self.timing else nullcontext()) as timing_file, ProcessPoolExecutor(max_workers=self.workers, initializer=BufferPool.limit_worker, initargs=(self.pool_limit,)) as executor:
+
+            summary = csv.writer(summary_file)
+            summary.writerow(["Image", "Pellets", "Threshold", "Status"])
+
+            if timing_file:
+                csv.writer(timing_file).writerow(["Image", "Step", *StageTimer.METRICS])
+
+            # Shared automatic thresholds are computed from the histograms of all images before the main pass
+            image_settings = BatchThreshold.apply([settings] * len(paths), BatchThreshold.compute(paths, [settings] * len(paths), self.threshold_mode, executor))
+
+            # Large images first, so they do not end up in the tail of the batch
+            costs = [MemoryBudget.estimate(path) for path in paths]
+            order = iter(sorted(range(len(paths)), key=lambda i: costs[i], reverse=True))
+            waiting = next(order, None)
+
+            pending = {}
+            in_flight = 0
+
+            while True:
+
+                # Topping up the pool, never more than max_in_flight images or the memory budget are held at once
+                while waiting is not None and len(pending) < self.max_in_flight and MemoryBudget.admit(costs[waiting], in_flight, len(pending), self.memory_budget):
+                    future = executor.submit(self.pelletsizer.processing, paths[waiting], self.save_images, image_settings[waiting], PelletSizer.Transport.PICKLE, False, self.cache, self.timing)
+                    pending[future] = waiting
+                    in_flight += costs[waiting]
+
+                    waiting = next(order, None)
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    index = pending.pop(future)
+                    in_flight -= costs[index]
+                    path = paths[index]
+
+                    try:
+                        result = future.result()
+                        self._write_result(names[index], result)
+
+                        if writer:
+                            writer.pellet_size_writer(self.result_db, path, result, run)
+                        buffers = BufferPool.add(buffers, result["Buffers"])
+
+                        if timing_file:
+                            timings = StageTimer.add(timings, result["Timing"])
+                            csv.writer(timing_file).writerows([path, step, *(metrics[metric] for metric in StageTimer.METRICS)] for step, metrics in result["Timing"].items())
+
+                        summary.writerow([path, len(result["Data"]), result["Threshold"], "OK"])
+                        processed += 1
+
+                    except Exception as e:
+                        self.logger.error(f"Error occured in pellet sizer for {path}: {e}.")
+
+                        summary.writerow([path, 0, "", f"Error: {e}"])
+                        failed += 1
+
+                summary_file.flush()
+
+        # The rows are written in the background, everything is in the database when the run returns
+        if writer:
+            writer.write_queue.flush()
+            writer.sql.close(self.result_db)
+
+        runtime = time.perf_counter() - start
+        throughput = processed / runtime if runtime > 0 else 0.0
+
+        self.logger.info(f"Batch finished: {processed} images, {failed} failed in {runtime:.2f} s ({throughput:.2f} images/s).")
+        self.logger.info(f"Scratch buffers: {buffers.get('Allocated', 0) / 1024 ** 2:.1f} MiB allocated, {buffers.get('Reused', 0) / 1024 ** 2:.1f} MiB reused.")
+
+        if timings:
+            self.logger.info(f"Steps: {StageTimer.summary(timings)}.")
+
+        return {
+            "Images": processed,
+            "Failed": failed,
+            "Seconds": runtime,
+            "Throughput": throughput,
+            "Buffers": buffers,
+            "Timing": timings
+        }
+
+    def _write_result(self, image_basename: str, result: dict) -> None:
+        """Writes the result table (and image) of a single image into the output directory.
+
+        Args:
+            image_basename (str): unique name of the image from output_names
+            result (dict): result of PelletSizer.processing
+        """
+        table_path = os.path.join(self.output_dir, f"result_table_{image_basename}.csv")
+
+        with open(table_path, "w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(PelletSizer.RESULT_COLUMNS)
+            writer.writerows(result["Data"])
+
+        if self.save_images and result.get("Image") is not None:
+            import cv2
+            cv2.imwrite(os.path.join(self.output_dir, f"result_image_{image_basename}.bmp"), result["Image"])
+
+
+def _parse_settings(values: list, pipeline: str = None) -> list:
+    """Converts the CLI settings into the [thresh_value, blur, magnification, stages] list of the PelletSizer.
+    The pipeline is a JSON list of stages or the path of a JSON file with it."""
+
+    thresh, blur, magnification = values
+
+    if not pipeline:
+        return [int(thresh), blur, magnification]
+
+    if os.path.isfile(pipeline):
+        with open(pipeline, "r", encoding="utf-8") as file:
+            stages = json.load(file)
+    else:
+        stages = json.loads(pipeline)
+
+    return [int(thresh), blur, magnification, stages]
+
+
+def main(argv: list = None) -> int:
+
+    parser = argparse.ArgumentParser(prog="python -m controller.algorithms.pellet_sizer", description="Headless pellet size analysis of microscope images.")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", default="pellet_results", help="directory for the result tables")
+    parser.add_argument("-s", "--settings", nargs=3, default=["-1", "Gaussian", "2X"], metavar=("THRESH", "BLUR", "MAGNIFICATION"), help="thresh value (-1 = Otsu), blur (Gaussian, Median, Stacked) and magnification (2X ... 100X)")
+    parser.add_argument("-p", "--pipeline", default=None, metavar="JSON", help="preprocessing stages as JSON list or JSON file, replaces the blur")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="maximum number of images held by the pool at once")
+    parser.add_argument("--memory-budget", type=int, default=None, metavar="MB", help="memory the images in flight may use (estimated from the headers), default half of the RAM")
+    parser.add_argument("--save-images", action="store_true", help="also export the annotated result images")
+    parser.add_argument("--timing", action="store_true", help="write the time and memory of every step of every image to timing.csv")
+    parser.add_argument("--db", default=None, metavar="FILE", help="also store the image and pellet measurements in this SQLite database")
+    parser.add_argument("--cache", default=None, metavar="DIR", help="result cache directory, unchanged images are not processed again")
+    parser.add_argument("--cache-size", type=int, default=1024, metavar="MB", help="size limit of the result cache")
+    parser.add_argument("--threshold-mode", choices=[mode.value for mode in BatchThreshold.Mode], default=BatchThreshold.Mode.IMAGE.value, help="automatic threshold per image, one for the whole batch or one per folder")
+
+    args = parser.parse_args(argv)
+
+    # The masks are only needed to render the images of cached results
+    cache = ResultCache(args.cache, args.cache_size * 1024 ** 2, store_masks=args.save_images) if args.cache else None
+
+    memory_budget = args.memory_budget * 1024 ** 2 if args.memory_budget else None
+
+    runner = PelletBatchRunner(args.output, args.workers, args.max_in_flight, args.save_images, cache, BatchThreshold.Mode(args.threshold_mode), memory_budget, args.timing, args.db)
+
+    paths = runner.collect_paths(args.inputs)
+    if not paths:
+        print("No images found.")
+        return 1
+
+    try:
+        settings = _parse_settings(args.settings, args.pipeline)
+        PreprocessingPipeline.from_settings(settings)
+    except (ValueError, TypeError) as e:
+        print(f"Invalid settings: {e}")
+        return 1
+
+    summary = runner.run(paths, settings)
+
+    print(f"Processed {summary['Images']} images ({summary['Failed']} failed) in {summary['Seconds']:.2f} s - {summary['Throughput']:.2f} images/s.")
+
+    return 0 if summary["Failed"] == 0 else 2
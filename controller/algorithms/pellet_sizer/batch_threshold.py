@@ -0,0 +1,199 @@
+
+import json
+import os
+from concurrent.futures import CancelledError
+from enum import Enum
+
+import cv2
+import numpy as np
+
+from controller.algorithms.pellet_sizer.bit_depth import BitDepth
+from controller.algorithms.pellet_sizer.steps.pipeline import PreprocessingPipeline
+from controller.algorithms.pellet_sizer.steps.preprocessing import Preprocessor
+
+from operator_mod.logger.global_logger import Logger
+
+class BatchThreshold:
+    """Automatic thresholding across images. Instead of running Otsu on every image on its own, the grayscale
+    histograms of all images are computed in one cheap pass, averaged per group and a single Otsu threshold per group
+    is used for the main pass. Images of one sample are then binarized consistently.
+
+    Only images with automatic thresholding (settings[0] < 0) are affected, manual thresholds are kept.
+
+    Integration:
+        thresholds = BatchThreshold.compute(paths, settings, BatchThreshold.Mode.BATCH, executor)
+        settings = BatchThreshold.apply(settings, thresholds)
+    """
+
+    class Mode(Enum):
+        # Otsu on every image on its own, the default of the Preprocessor
+        IMAGE = "image"
+        # One threshold for all images
+        BATCH = "batch"
+        # One threshold per folder
+        FOLDER = "folder"
+
+    @staticmethod
+    def histogram(path: str, settings: list) -> np.ndarray:
+        """Computes the normalized histogram of the grayscale image after the gray stages, like it is thresholded by the Preprocessor.
+
+        Args:
+            path (str): image path
+            settings (list): [thresh_value, blur, magnification, stages (optional)] of the image
+
+        Returns:
+            np.ndarray: histogram with 256 bins, sums up to 1
+        """
+        prepro = Preprocessor(path, settings)
+
+        img = cv2.imread(path, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
+        gray = prepro.blur_tile(img)
+
+        # Thresholds are in 8-bit units, native high bit depth images are shifted for the histogram
+        if gray.dtype != np.uint8:
+            hist = np.bincount(BitDepth.to_8bit(gray, prepro.bits).ravel(), minlength=256).astype(np.float64)
+        else:
+            hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+        prepro.pipeline.release(gray)
+
+        return hist / hist.sum()
+
+    @staticmethod
+    def otsu(hist: np.ndarray) -> int:
+        """Otsu's threshold of a histogram, the same value cv2.THRESH_OTSU computes for an image with this histogram.
+
+        Args:
+            hist (np.ndarray): histogram with one bin per gray value
+
+        Returns:
+            int: threshold, pixels above are foreground of THRESH_BINARY
+        """
+        p = hist / hist.sum()
+        values = np.arange(len(p), dtype=np.float64)
+
+        q1 = np.cumsum(p)
+        q2 = 1.0 - q1
+        m1 = np.cumsum(values * p)
+        mu = m1[-1]
+
+        # Splits with an (almost) empty class are skipped
+        valid = (np.minimum(q1, q2) >= np.finfo(np.float32).eps) & (np.maximum(q1, q2) <= 1.0 - np.finfo(np.float32).eps)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mu1 = m1 / q1
+            mu2 = (mu - m1) / q2
+            sigma = q1 * q2 * (mu1 - mu2) ** 2
+
+        sigma[~valid] = -1.0
+
+        if not valid.any():
+            return 0
+
+        return int(np.argmax(sigma))
+
+    @staticmethod
+    def group_key(path: str, settings: list, mode: "BatchThreshold.Mode") -> tuple:
+        """Returns the group of an image, the histograms of one group are thresholded together.
+
+        Args:
+            path (str): image path
+            settings (list): [thresh_value, blur, magnification] of the image
+            mode (BatchThreshold.Mode): how the images are grouped
+
+        Returns:
+            tuple: (gray stages, folder), the histogram depends on the gray stages so they are always part of the group
+        """
+        pipeline = PreprocessingPipeline.from_settings(settings)
+        stages = json.dumps([stage.to_dict() for stage in pipeline.gray_stages], sort_keys=True)
+
+        folder = os.path.dirname(os.path.abspath(path)) if mode == BatchThreshold.Mode.FOLDER else None
+
+        return stages, folder
+
+    @staticmethod
+    def compute(paths: list, settings: list, mode: "BatchThreshold.Mode", executor=None, track=None) -> list:
+        """Computes the thresholds of all images with automatic thresholding.
+
+        Args:
+            paths (list): image paths
+            settings (list): [thresh_value, blur, magnification] per image
+            mode (BatchThreshold.Mode): how the images are grouped
+            executor (Executor, optional): pool for the histogram pass. Defaults to None (sequential).
+            track (callable, optional): receives the futures of the histogram pass, e.g. to cancel them. Defaults to None.
+
+        Returns:
+            list: threshold per image, None for manual thresholds, Mode.IMAGE and images that could not be read
+        """
+        thresholds = [None] * len(paths)
+
+        if mode == BatchThreshold.Mode.IMAGE:
+            return thresholds
+
+        auto = [i for i in range(len(paths)) if not settings[i] or settings[i][0] < 0]
+
+        if executor is not None:
+            futures = [executor.submit(BatchThreshold.histogram, paths[i], settings[i]) for i in auto]
+
+            if track is not None:
+                track(futures)
+
+            histograms = [BatchThreshold._result(future.result, paths[i]) for i, future in zip(auto, futures)]
+        else:
+            histograms = [BatchThreshold._result(lambda i=i: BatchThreshold.histogram(paths[i], settings[i]), paths[i]) for i in auto]
+
+        # Every image has the same weight in its group, no matter its size
+        groups = {}
+        for i, hist in zip(auto, histograms):
+
+            # Left out of its group, the main pass reports the image as failed
+            if hist is None:
+                continue
+
+            key = BatchThreshold.group_key(paths[i], settings[i], mode)
+
+            indices, total = groups.get(key, ([], 0))
+            indices.append(i)
+            groups[key] = (indices, total + hist)
+
+        for indices, hist in groups.values():
+            threshold = BatchThreshold.otsu(hist)
+
+            for i in indices:
+                thresholds[i] = threshold
+
+        return thresholds
+
+    @staticmethod
+    def _result(call, path: str) -> np.ndarray:
+        """Returns the histogram of one image, None if it can not be read. A cancelled pass is raised."""
+
+        try:
+            return call()
+        except CancelledError:
+            raise
+        except Exception as e:
+            Logger("PelletSizer").logger.warning(f"No histogram for {path}, left out of the shared threshold: {e}.")
+            return None
+
+    @staticmethod
+    def apply(settings: list, thresholds: list) -> list:
+        """Puts the computed thresholds into the settings.
+
+        Args:
+            settings (list): [thresh_value, blur, magnification] per image
+            thresholds (list): from BatchThreshold.compute
+
+        Returns:
+            list: new settings per image
+        """
+        applied = []
+
+        for setting, threshold in zip(settings, thresholds):
+            setting = list(setting or [-1, "Gaussian", "2X"])
+
+            if threshold is not None:
+                setting[0] = threshold
+
+            applied.append(setting)
+
+        return applied
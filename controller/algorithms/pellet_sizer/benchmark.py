@@ -0,0 +1,351 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from operator_mod.logger.global_logger import Logger
+
+from controller.algorithms.pellet_sizer.pellet_sizer import PelletSizer
+from controller.algorithms.pellet_sizer.batch_runner import _parse_settings
+from controller.algorithms.pellet_sizer.buffer_pool import BufferPool
+from controller.algorithms.pellet_sizer.steps.preprocessing import Preprocessor
+from controller.algorithms.pellet_sizer.steps.processing import Processor
+from controller.algorithms.pellet_sizer.steps.postprocessing import PostProcessing
+
+class PelletBenchmark:
+    """Deterministic benchmark of the pellet sizer. Synthetic microscope-like images (dark elliptic pellets on a
+    bright, slightly uneven background with noise) are generated from a seed, so every run and every commit
+    measures the same images. The ellipses are the ground truth for the accuracy.
+
+    Every case reports the median time of each step, the throughput, the peak memory of one run and the
+    error of the pellet count, areas and feret diameters. The report is JSON, two reports can be compared.
+
+    Integration:
+        benchmark = PelletBenchmark(sizes=[1024, 2048], repeats=3)
+        report = benchmark.run()
+        PelletBenchmark.save(report, "benchmark.json")
+    """
+
+    # Pellets per megapixel
+    DENSITIES = {"sparse": 40, "dense": 160}
+
+    # Semi-major axis of the pellets in pixels, larger than the area filter of the Processor
+    RADIUS_RANGE = (22, 60)
+
+    BACKGROUND = 190
+    PELLET = 70
+    NOISE = 12
+
+    # Significant bits of the 16-bit images, like a 12-bit camera
+    HIGH_BITS = 12
+
+    def __init__(self, sizes: list = None, densities: list = None, bits: list = None, repeats: int = 3, seed: int = 0, settings: list = None) -> None:
+        """Sets up the cases, one per size, density and bit depth.
+
+        Args:
+            sizes (list, optional): edge lengths of the square images. Defaults to [1024, 2048, 4096].
+            densities (list, optional): keys of DENSITIES. Defaults to all.
+            bits (list, optional): 8 and/or 16. Defaults to [8, 16].
+            repeats (int, optional): timed runs per case, the median is reported. Defaults to 3.
+            seed (int, optional): seed of the image generation. Defaults to 0.
+            settings (list, optional): [thresh_value, blur, magnification, stages (optional)]. Defaults to [-1, "Gaussian", "2X"].
+        """
+        self.logger = Logger("PelletSizer").logger
+
+        self.sizes = sizes or [1024, 2048, 4096]
+        self.densities = densities or list(self.DENSITIES)
+        self.bits = bits or [8, 16]
+        self.repeats = max(repeats, 1)
+        self.seed = seed
+        self.settings = settings or [-1, "Gaussian", "2X"]
+
+    @staticmethod
+    def synthetic_image(size: int, density: str, bits: int, seed: int) -> tuple:
+        """Generates an image with non-overlapping pellets away from the border.
+
+        Args:
+            size (int): edge length
+            density (str): key of DENSITIES
+            bits (int): 8 or 16
+            seed (int): seed
+
+        Returns:
+            tuple: (image, ground truth as rows of [area, feret_max] in pixels)
+        """
+        rng = np.random.default_rng(seed)
+
+        target = int(PelletBenchmark.DENSITIES[density] * size * size / 1e6)
+        low, high = PelletBenchmark.RADIUS_RANGE
+
+        centers = np.empty((0, 2))
+        radii = np.empty(0)
+        truth = []
+
+        # Uneven illumination, the pellets are drawn as a mask first
+        ramp = np.linspace(-10, 10, size, dtype=np.float32)
+        img = PelletBenchmark.BACKGROUND + ramp[None, :] + ramp[:, None] * 0.5
+        mask = np.zeros((size, size), dtype=np.uint8)
+
+        for _ in range(target * 20):
+            if len(truth) >= target:
+                break
+
+            a = rng.uniform(low, high)
+            b = a * rng.uniform(0.6, 1.0)
+            center = rng.uniform(high + 4, size - high - 4, 2)
+
+            # Circumscribed circles with a gap, so pellets never touch after the blur
+            if len(radii) and np.any(np.hypot(*(centers - center).T) < radii + a + 6):
+                continue
+
+            cv2.ellipse(mask, (center * 16).astype(int).tolist(), (int(a * 16), int(b * 16)), rng.uniform(0, 180), 0, 360, 255, -1, cv2.LINE_8, 4)
+
+            centers = np.vstack([centers, center])
+            radii = np.append(radii, a)
+            truth.append([np.pi * a * b, 2 * a])
+
+        img[mask > 0] = PelletBenchmark.PELLET
+        img += rng.normal(0, PelletBenchmark.NOISE, img.shape).astype(np.float32)
+
+        if bits == 16:
+            img = np.clip(img * (1 << (PelletBenchmark.HIGH_BITS - 8)), 0, (1 << PelletBenchmark.HIGH_BITS) - 1).astype(np.uint16)
+        else:
+            img = np.clip(img, 0, 255).astype(np.uint8)
+
+        return img, truth
+
+    @staticmethod
+    def accuracy(pixels: list, truth: list) -> dict:
+        """Compares the measured pellets with the ground truth. The areas and ferets are matched by rank, as
+        the pellets are separated and the sizes are what is compared.
+
+        Args:
+            pixels (list): "Pixels" of the result, rows of [area, arc_length, feret_max]
+            truth (list): rows of [area, feret_max]
+
+        Returns:
+            dict: "Expected" and "Detected" pellets, "CountError", "AreaError" and "FeretError" as mean relative errors
+        """
+        detected = np.asarray(pixels, dtype=np.float64).reshape(-1, 3)
+        expected = np.asarray(truth, dtype=np.float64).reshape(-1, 2)
+
+        n = min(len(detected), len(expected))
+
+        def error(measured, real):
+            if n == 0:
+                return None
+            return float(np.mean(np.abs(np.sort(measured)[-n:] - np.sort(real)[-n:]) / np.sort(real)[-n:]))
+
+        return {
+            "Expected": len(expected),
+            "Detected": len(detected),
+            "CountError": abs(len(detected) - len(expected)) / len(expected) if len(expected) else 0.0,
+            "AreaError": error(detected[:, 0], expected[:, 0]),
+            "FeretError": error(detected[:, 2], expected[:, 1])
+        }
+
+    def run_case(self, path: str, truth: list) -> dict:
+        """Times the steps and the whole PelletSizer on one image.
+
+        Args:
+            path (str): image path
+            truth (list): ground truth of synthetic_image
+
+        Returns:
+            dict: "Stages" median seconds per step, "Steps" the timing of the last PelletSizer run, "Throughput" images/s and megapixels/s, "Accuracy", "PeakMemory" bytes
+        """
+        timings = {"Preprocessing": [], "Processing": [], "Postprocessing": [], "Render": [], "Total": []}
+
+        # The first run loads the image into the file cache and fills the buffer pool
+        PelletSizer().processing(path, False, self.settings)
+
+        for _ in range(self.repeats):
+            start = time.perf_counter()
+            img = Preprocessor(path, self.settings).process()
+            timings["Preprocessing"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            pro = Processor(img)
+            contours = pro.process()
+            timings["Processing"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            _, overlay = PostProcessing(contours, img, self.settings, pro.table).postprocess()
+            timings["Postprocessing"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            overlay.render()
+            timings["Render"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            result = PelletSizer().processing(path, False, self.settings, timing=True)
+            timings["Total"].append(time.perf_counter() - start)
+
+        stages = {name: statistics.median(values) for name, values in timings.items()}
+
+        # The peak RSS of the process only ever grows, so the memory of the case is traced in an extra, untimed run.
+        # The buffer pool is emptied before, its buffers would otherwise come from earlier cases
+        BufferPool().clear()
+        tracemalloc.start()
+        try:
+            PelletSizer().processing(path, False, self.settings)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        height, width = img.shape[:2]
+
+        return {
+            "Stages": stages,
+            "Steps": result["Timing"],
+            "Throughput": {
+                "Images": 1 / stages["Total"] if stages["Total"] > 0 else None,
+                "Megapixels": height * width / 1e6 / stages["Total"] if stages["Total"] > 0 else None
+            },
+            "Threshold": result["Threshold"],
+            "Accuracy": self.accuracy(result["Pixels"], truth),
+            # NumPy arrays, including the results of OpenCV, not the temporary memory inside OpenCV
+            "PeakMemory": peak
+        }
+
+    def run(self) -> dict:
+        """Runs all cases.
+
+        Returns:
+            dict: "Meta" (versions, machine, commit, parameters) and "Cases"
+        """
+        cases = []
+
+        with tempfile.TemporaryDirectory(prefix="pellet_benchmark_") as directory:
+
+            for size, density, bits in ((s, d, b) for s in self.sizes for d in self.densities for b in self.bits):
+
+                name = f"{size}px-{density}-{bits}bit"
+
+                # Same pellets for every bit depth of a size and density
+                img, truth = self.synthetic_image(size, density, bits, self.seed + size + list(self.DENSITIES).index(density))
+
+                path = os.path.join(directory, f"{name}.png")
+                cv2.imwrite(path, img)
+
+                case = {"Name": name, "Size": size, "Density": density, "Bits": bits, **self.run_case(path, truth)}
+                cases.append(case)
+
+                self.logger.info(f"Benchmark {name}: {case['Stages']['Total'] * 1000:.1f} ms, {case['Accuracy']['Detected']}/{case['Accuracy']['Expected']} pellets.")
+
+        return {"Meta": self.meta(), "Cases": cases}
+
+    def meta(self) -> dict:
+        """Describes the run, so reports of different commits and machines can be told apart."""
+
+        try:
+            commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+
+        return {
+            "Commit": commit,
+            "Date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "Python": platform.python_version(),
+            "OpenCV": cv2.__version__,
+            "NumPy": np.__version__,
+            "Platform": platform.platform(),
+            "CPUs": os.cpu_count(),
+            "AlgorithmVersion": PelletSizer.ALGORITHM_VERSION,
+            "Seed": self.seed,
+            "Repeats": self.repeats,
+            "Settings": self.settings
+        }
+
+    @staticmethod
+    def save(report: dict, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    @staticmethod
+    def compare(report: dict, baseline: dict) -> list:
+        """Compares the step times and errors of two reports case by case.
+
+        Args:
+            report (dict): current report
+            baseline (dict): earlier report
+
+        Returns:
+            list: rows of [case, metric, baseline, current, relative change]
+        """
+        rows = []
+        earlier = {case["Name"]: case for case in baseline.get("Cases", [])}
+
+        for case in report.get("Cases", []):
+            before = earlier.get(case["Name"])
+
+            if before is None:
+                continue
+
+            metrics = [(f"{name} [s]", case["Stages"][name], before["Stages"].get(name)) for name in case["Stages"]]
+            metrics += [(name, case["Accuracy"][name], before["Accuracy"].get(name)) for name in ("Detected", "AreaError", "FeretError")]
+            metrics.append(("PeakMemory [B]", case.get("PeakMemory"), before.get("PeakMemory")))
+
+            for metric, current, previous in metrics:
+                change = (current - previous) / previous if previous and current is not None else None
+                rows.append([case["Name"], metric, previous, current, change])
+
+        return rows
+
+
+def main(argv: list = None) -> int:
+
+    parser = argparse.ArgumentParser(prog="python -m controller.algorithms.pellet_sizer.benchmark", description="Deterministic benchmark of the pellet sizer on synthetic images.")
+    parser.add_argument("-o", "--output", default="pellet_benchmark.json", help="JSON report")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1024, 2048, 4096], help="edge lengths of the images")
+    parser.add_argument("--densities", nargs="+", choices=list(PelletBenchmark.DENSITIES), default=list(PelletBenchmark.DENSITIES), help="pellet densities")
+    parser.add_argument("--bits", nargs="+", type=int, choices=[8, 16], default=[8, 16], help="bit depths")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="timed runs per case")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the images")
+    parser.add_argument("-s", "--settings", nargs=3, default=["-1", "Gaussian", "2X"], metavar=("THRESH", "BLUR", "MAGNIFICATION"), help="settings of the pellet sizer")
+    parser.add_argument("-p", "--pipeline", default=None, metavar="JSON", help="preprocessing stages as JSON list or JSON file")
+    parser.add_argument("--compare", default=None, metavar="JSON", help="earlier report to compare with")
+
+    args = parser.parse_args(argv)
+
+    try:
+        settings = _parse_settings(args.settings, args.pipeline)
+    except (ValueError, TypeError) as e:
+        print(f"Invalid settings: {e}")
+        return 1
+
+    benchmark = PelletBenchmark(args.sizes, args.densities, args.bits, args.repeats, args.seed, settings)
+    report = benchmark.run()
+    PelletBenchmark.save(report, args.output)
+
+    for case in report["Cases"]:
+        accuracy = case["Accuracy"]
+        print(f"{case['Name']:<24} {case['Stages']['Total'] * 1000:9.1f} ms {case['Throughput']['Megapixels']:8.1f} MP/s  "
+              f"{accuracy['Detected']:5d}/{accuracy['Expected']:<5d} pellets  area error {accuracy['AreaError'] or 0:.2%}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+
+        for name, metric, previous, current, change in PelletBenchmark.compare(report, baseline):
+            previous = "-" if previous is None else f"{previous:.4g}"
+            current = "-" if current is None else f"{current:.4g}"
+            change = "" if change is None else f"{change:+.1%}"
+
+            print(f"{name:<24} {metric:<20} {previous:>12} -> {current:<12} {change}")
+
+    print(f"Report written to {args.output}.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+
+import cv2
+import numpy as np
+
+from controller.algorithms.pellet_sizer.buffer_pool import BufferPool
+
+class BitDepth:
+    """Handling of high bit depth images (e.g. camera-native 12-bit TIFFs stored as uint16). Images are converted
+    to 8-bit with an integer shift by the number of significant bits, without float temporaries.
+
+    Thresholds are always given in 8-bit units, for high bit depth images they are scaled by 2 ** (bits - 8).
+    """
+
+    # Bit depths of camera sensors, a detected depth is rounded up to the next one
+    COMMON_BITS = (10, 12, 14, 16)
+
+    @staticmethod
+    def bits(img) -> int:
+        """Detects the significant bits of an image from its maximum, rounded up to COMMON_BITS.
+
+        Args:
+            img (MatLike): image
+
+        Returns:
+            int: 8 for 8-bit images, else 10, 12, 14 or 16
+        """
+        if img.dtype == np.uint8:
+            return 8
+
+        if img.dtype != np.uint16:
+            return 8 * img.dtype.itemsize
+
+        significant = int(img.max()).bit_length()
+
+        return next(bits for bits in BitDepth.COMMON_BITS if significant <= bits)
+
+    @staticmethod
+    def scale(bits: int) -> int:
+        """Returns the factor between 8-bit units and an image with the given bits."""
+        return 1 << max(bits - 8, 0)
+
+    @staticmethod
+    def to_8bit(img, bits: int = None, out=None):
+        """Converts an image to 8-bit by shifting out the least significant bits.
+
+        Args:
+            img (MatLike): image (uint8 images are returned as they are)
+            bits (int, optional): significant bits of the image. Defaults to None (detected).
+            out (MatLike, optional): uint8 buffer with the shape of img. Defaults to None.
+
+        Returns:
+            MatLike: uint8 image
+        """
+        if img.dtype == np.uint8:
+            return img
+
+        if img.dtype != np.uint16:
+            # Float or 32-bit images have no fixed range
+            return cv2.normalize(img, out, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+
+        detected = bits is None
+        bits = BitDepth.bits(img) if detected else bits
+
+        pool = BufferPool()
+        shifted = pool.acquire(img.shape, img.dtype)
+
+        np.right_shift(img, max(bits - 8, 0), out=shifted)
+
+        # Only a given bit depth can be lower than the data
+        if not detected:
+            np.minimum(shifted, 255, out=shifted)
+
+        if out is None:
+            out = np.empty(img.shape, dtype=np.uint8)
+
+        np.copyto(out, shifted, casting="unsafe")
+        pool.release(shifted)
+
+        return out
@@ -0,0 +1,186 @@
+
+from threading import Lock
+
+import numpy as np
+
+class BufferPool:
+    """Process-wide pool of scratch arrays keyed by (shape, dtype). The pellet pipeline draws its intermediate
+    images from here, so a long-lived worker processing images of the same size allocates them only once.
+
+    Buffers are handed out exclusively by acquire() and come back with release(), their content is undefined.
+    Every worker process has its own pool, limited to its share of the memory budget (worker_limit).
+
+    Integration:
+        pool = BufferPool()
+        buffer = pool.acquire(shape, dtype)
+        ...
+        pool.release(buffer)
+        pool.stats()   # {"Allocated": bytes, "Reused": bytes, ...}
+    """
+
+    _instance = None
+    _lock = Lock()
+
+    # Free buffers above this size are dropped instead of kept
+    DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(BufferPool, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self) -> None:
+
+        if hasattr(self, '_initialized') and self._initialized:
+            return
+
+        self.max_bytes = self.DEFAULT_MAX_BYTES
+
+        # (shape, dtype) -> free buffers
+        self._free = {}
+        self._free_bytes = 0
+
+        self._allocated_bytes = 0
+        self._reused_bytes = 0
+        self._allocations = 0
+        self._reuses = 0
+
+        self._initialized = True
+
+    def acquire(self, shape: tuple, dtype) -> np.ndarray:
+        """Hands out a buffer, a free one of the same shape and dtype if there is one.
+
+        Args:
+            shape (tuple): shape
+            dtype (dtype): dtype
+
+        Returns:
+            np.ndarray: the buffer, its content is undefined
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+
+        with self._lock:
+            free = self._free.get(key)
+
+            if free:
+                buffer = free.pop()
+                self._free_bytes -= buffer.nbytes
+                self._reused_bytes += buffer.nbytes
+                self._reuses += 1
+                return buffer
+
+        buffer = np.empty(shape, dtype=dtype)
+
+        with self._lock:
+            self._allocated_bytes += buffer.nbytes
+            self._allocations += 1
+
+        return buffer
+
+    def release(self, buffer: np.ndarray) -> None:
+        """Gives a buffer back. The caller must not use it afterwards.
+
+        Args:
+            buffer (np.ndarray): buffer from acquire()
+        """
+        # Views would keep their base alive and overlap other buffers
+        if buffer is None or buffer.base is not None or not buffer.flags.c_contiguous:
+            return
+
+        key = (buffer.shape, buffer.dtype.str)
+
+        with self._lock:
+            if self._free_bytes + buffer.nbytes > self.max_bytes:
+                return
+
+            self._free.setdefault(key, []).append(buffer)
+            self._free_bytes += buffer.nbytes
+
+    def limit(self, max_bytes: int) -> None:
+        """Sets the size limit of the free buffers and drops the ones above it.
+
+        Args:
+            max_bytes (int): free bytes the pool may keep
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+
+            for key in list(self._free):
+                buffers = self._free[key]
+
+                while buffers and self._free_bytes > max_bytes:
+                    self._free_bytes -= buffers.pop().nbytes
+
+                if not buffers:
+                    del self._free[key]
+
+    @staticmethod
+    def limit_worker(max_bytes: int) -> None:
+        """Initializer of a worker process, sets the limit of its pool."""
+        BufferPool().limit(max_bytes)
+
+    @staticmethod
+    def worker_limit(budget: int, workers: int) -> int:
+        """Returns the free bytes the pool of one worker process may keep, so the idle pools of all workers
+        together hold at most half of the memory budget.
+
+        Args:
+            budget (int): memory budget of the worker processes in bytes, None for no limit
+            workers (int): number of worker processes
+
+        Returns:
+            int: limit per worker, at most DEFAULT_MAX_BYTES
+        """
+        if budget is None:
+            return BufferPool.DEFAULT_MAX_BYTES
+
+        return min(BufferPool.DEFAULT_MAX_BYTES, budget // (2 * max(workers, 1)))
+
+    def clear(self) -> None:
+        """Drops all free buffers."""
+
+        with self._lock:
+            self._free = {}
+            self._free_bytes = 0
+
+    def stats(self) -> dict:
+        """Returns the counters since the start of the process.
+
+        Returns:
+            dict: "Allocated" and "Reused" in bytes, "Allocations" and "Reuses" as counts, "Free" bytes held
+        """
+        with self._lock:
+            return {
+                "Allocated": self._allocated_bytes,
+                "Reused": self._reused_bytes,
+                "Allocations": self._allocations,
+                "Reuses": self._reuses,
+                "Free": self._free_bytes
+            }
+
+    @staticmethod
+    def difference(after: dict, before: dict) -> dict:
+        """Returns the counters between two stats() calls, e.g. of one image.
+
+        Args:
+            after (dict): later stats()
+            before (dict): earlier stats()
+
+        Returns:
+            dict: "Allocated", "Reused", "Allocations" and "Reuses" in between
+        """
+        return {name: after[name] - before[name] for name in ("Allocated", "Reused", "Allocations", "Reuses")}
+
+    @staticmethod
+    def add(total: dict, stats: dict) -> dict:
+        """Sums up counters, e.g. of all images of a batch.
+
+        Args:
+            total (dict): sum so far, may be empty
+            stats (dict): counters to add
+
+        Returns:
+            dict: the sum
+        """
+        return {name: total.get(name, 0) + value for name, value in stats.items()}
@@ -0,0 +1,177 @@
+
+import os
+import struct
+
+class MemoryBudget:
+    """Estimates the memory one image needs in a worker from its header, without decoding it, and decides how
+    many images may be processed at once so the sum stays below a budget.
+
+    Integration:
+        costs = [MemoryBudget.estimate(path) for path in paths]
+        if MemoryBudget.admit(costs[i], in_flight_bytes, in_flight_count, budget):
+            submit(...)
+    """
+
+    # Gray-sized scratch copies besides the decoded image (gray, ping/pong of the stages, binary)
+    SCRATCH_COPIES = 4
+
+    # Decoded size per file byte when the header can not be read (typical compression of microscope images)
+    FALLBACK_RATIO = 10
+
+    # Share of the physical memory the images in flight may use by default
+    DEFAULT_FRACTION = 0.5
+    FALLBACK_PHYSICAL = 8 * 1024 ** 3
+
+    @staticmethod
+    def physical_memory() -> int:
+        """Returns the physical memory of the machine in bytes."""
+
+        try:
+            return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (AttributeError, ValueError, OSError):
+            pass
+
+        # Windows has no sysconf
+        try:
+            import ctypes
+
+            class MemoryStatus(ctypes.Structure):
+                _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong), ("ullTotalPhys", ctypes.c_ulonglong),
+                            ("ullAvailPhys", ctypes.c_ulonglong), ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                            ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong), ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+            status = MemoryStatus()
+            status.dwLength = ctypes.sizeof(MemoryStatus)
+
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return status.ullTotalPhys
+
+        except (AttributeError, OSError):
+            pass
+
+        return MemoryBudget.FALLBACK_PHYSICAL
+
+    @staticmethod
+    def default_budget() -> int:
+        """Returns DEFAULT_FRACTION of the physical memory in bytes."""
+        return int(MemoryBudget.physical_memory() * MemoryBudget.DEFAULT_FRACTION)
+
+    @staticmethod
+    def image_shape(path: str) -> tuple:
+        """Reads the dimensions of a PNG, JPEG, TIFF or BMP image from its header.
+
+        Args:
+            path (str): image path
+
+        Returns:
+            tuple: (height, width, channels as loaded by cv2, bytes per sample), None for other or broken files
+        """
+        try:
+            with open(path, "rb") as file:
+                head = file.read(32)
+
+                if head.startswith(b"\x89PNG\r\n\x1a\n"):
+                    width, height, depth, color = struct.unpack(">IIBB", head[16:26])
+                    # cv2 expands palettes to color and drops alpha
+                    channels = 1 if color in (0, 4) else 3
+                    return height, width, channels, 2 if depth == 16 else 1
+
+                if head.startswith(b"\xff\xd8"):
+                    return MemoryBudget._jpeg_shape(file)
+
+                if head.startswith((b"II*\x00", b"MM\x00*")):
+                    return MemoryBudget._tiff_shape(file, "<" if head[:2] == b"II" else ">")
+
+                if head.startswith(b"BM"):
+                    width, height = struct.unpack("<ii", head[18:26])
+                    return abs(height), width, 3, 1
+
+        except (OSError, struct.error):
+            pass
+
+        return None
+
+    @staticmethod
+    def _jpeg_shape(file) -> tuple:
+
+        file.seek(2)
+
+        while True:
+            marker = file.read(2)
+
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+
+            length = struct.unpack(">H", file.read(2))[0]
+
+            # Start of frame markers, except DHT, JPG and DAC
+            if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                precision, height, width, channels = struct.unpack(">BHHB", file.read(6))
+                return height, width, channels, 2 if precision > 8 else 1
+
+            file.seek(length - 2, os.SEEK_CUR)
+
+    @staticmethod
+    def _tiff_shape(file, order: str) -> tuple:
+
+        file.seek(4)
+        file.seek(struct.unpack(order + "I", file.read(4))[0])
+
+        tags = {}
+        for _ in range(struct.unpack(order + "H", file.read(2))[0]):
+            tag, kind, count, value = struct.unpack(order + "HHI4s", file.read(12))
+
+            # SHORT values are left-aligned in the value field, several of them are stored elsewhere (same for all samples)
+            if kind == 3 and count <= 2:
+                tags[tag] = struct.unpack(order + "H", value[:2])[0]
+            elif kind == 4 and count == 1:
+                tags[tag] = struct.unpack(order + "I", value)[0]
+            elif kind == 3:
+                position = file.tell()
+                file.seek(struct.unpack(order + "I", value)[0])
+                tags[tag] = struct.unpack(order + "H", file.read(2))[0]
+                file.seek(position)
+
+        if 256 not in tags or 257 not in tags:
+            return None
+
+        channels = 1 if tags.get(277, 1) == 1 else 3
+
+        return tags[257], tags[256], channels, max(tags.get(258, 8) // 8, 1)
+
+    @staticmethod
+    def estimate(path: str) -> int:
+        """Estimates the peak memory of processing one image in bytes.
+
+        Args:
+            path (str): image path
+
+        Returns:
+            int: decoded image plus the scratch copies, from the file size if the header can not be read
+        """
+        shape = MemoryBudget.image_shape(path)
+
+        if shape is None:
+            try:
+                return os.path.getsize(path) * MemoryBudget.FALLBACK_RATIO
+            except OSError:
+                return 0
+
+        height, width, channels, sample = shape
+
+        return height * width * sample * (channels + MemoryBudget.SCRATCH_COPIES)
+
+    @staticmethod
+    def admit(cost: int, in_flight_bytes: int, in_flight_count: int, budget: int) -> bool:
+        """Checks if one more image fits into the budget. A single image is always admitted, even above the budget.
+
+        Args:
+            cost (int): estimate of the image
+            in_flight_bytes (int): estimates of the images in flight
+            in_flight_count (int): number of images in flight
+            budget (int): budget in bytes, None for no limit
+
+        Returns:
+            bool: if the image may be submitted
+        """
+        return budget is None or in_flight_count == 0 or in_flight_bytes + cost <= budget
@@ -1,28 +1,55 @@
 
 import os
+from enum import Enum
+
+import cv2
+import numpy as np
 
 from controller.algorithms.pellet_sizer.steps.postprocessing import PostProcessing
 from controller.algorithms.pellet_sizer.steps.preprocessing import Preprocessor
+from controller.algorithms.pellet_sizer.steps.pipeline import PreprocessingPipeline
 from controller.algorithms.pellet_sizer.steps.processing import Processor
+from controller.algorithms.pellet_sizer.steps.overlay import Overlay
+from controller.algorithms.pellet_sizer.steps.scaling import Scaling
+from controller.algorithms.pellet_sizer.shared_image import SharedImage
+from controller.algorithms.pellet_sizer.buffer_pool import BufferPool
+from controller.algorithms.pellet_sizer.result_cache import ResultCache
+from controller.algorithms.pellet_sizer.stage_timer import StageTimer
 
 class PelletSizer:
     
+    # Column names of the rows in "Data"
+    RESULT_COLUMNS = ["Area [-]", "(eq) Diameter [-]", "(eq) Perimeter [-]","Area [mym^2]", "(eq) Diameter [mym]","(eq) Perimeter [mym]", "Perimeter [mym]","Feret_max [mym]", "(eq) Volume [mym^3] " , "circularity [-]", "compactness [-]"]
+    
+    # Increase whenever a change in the steps changes the results, invalidates cached results
+    ALGORITHM_VERSION = 2
+    
+    class Transport(Enum):
+        # The image is pickled back through the process pool pipe
+        PICKLE = "pickle"
+        # The image is drawn into a memory-mapped scratch file and only a SharedImage handle is returned
+        SHARED = "shared"
+    
     def __init__(self) -> None:
         pass
     
-    def processing(self, path : str, visualization: bool = False, settings : list = None) -> dict:
+    def processing(self, path : str, visualization: bool = False, settings : list = None, transport: Transport = Transport.PICKLE, lazy: bool = False, cache: ResultCache = None, timing: bool = False) -> dict:
         """Processes a given pellet image to analzye for pellet sizes.
 
         Args:
             path (str): file path
             visualization (bool, optional): if an image should be returned. Defaults to False.
             settings (list, optional): a list of settings for individualization. Defaults to False.
+            transport (Transport, optional): how the image is returned. Defaults to Transport.PICKLE.
+            lazy (bool, optional): if an unrendered Overlay is returned instead of the annotated image. Defaults to False.
+            cache (ResultCache, optional): cache to look up and store the results. Defaults to None.
+            timing (bool, optional): if the time and memory of every step is returned as "Timing". Defaults to False.
 
         Raises:
             ValueError: If the path object does not exists.
 
         Returns:
-            dict: "image" : Image if visualization, "Data" : data
+            dict: "image" : Image (SharedImage or Overlay) if visualization, "Data" : data, "Pixels" : [area, arc_length, feret_max] per pellet in pixel units, "Threshold" : threshold used for binarization, "Settings" : settings with the preprocessing stages, "Buffers" : scratch bytes allocated and reused, "Timing" : StageTimer.timings if timing
         """
         
         self.path = path
@@ -30,25 +57,127 @@ class PelletSizer:
         if not os.path.exists(path):
             raise ValueError("Path object does not exist in PelletSizer.") 
         
-        # Preprocessing
-        prepro = Preprocessor(self.path, settings)
-        img = prepro.process()
+        buffers = BufferPool().stats()
+        timer = StageTimer(timing)
         
-        # Processing
-        pro = Processor(img)
-        contours = pro.process()
+        # Looking for results of the same image content, settings and algorithm version. The magnification
+        # only scales the results, so images are only segmented again if the threshold or blur changed.
+        key, cached = None, None
+        if cache is not None:
+            with timer.stage("Cache"):
+                key = cache.key(path, self.segmentation_settings(settings), self.ALGORITHM_VERSION)
+                cached = cache.get(key, need_mask=visualization)
         
-        # Postprocessing
-        post = PostProcessing(contours, img, settings)
-        results, image = post.postprocess()
+        if cached is not None:
+            pixels, img, threshold = cached
+            results = Scaling.apply(pixels, Scaling.pixel_to_um(Scaling.magnification_from_settings(settings)))
+            
+            # Only the overlay is rebuilt from the cached mask
+            if visualization:
+                pro = Processor(img, timer)
+                contours = pro.process()
+                overlay = Overlay(img, contours, np.column_stack([pro.table["x"], pro.table["y"]]))
         
-        if visualization:
-            return {
-                "Image": image,
-                "Data": results
-            }
+        else:
+            # Preprocessing
+            prepro = Preprocessor(self.path, settings, timer)
+            img = prepro.process()
+            threshold = prepro.threshold_value
+            
+            # Processing
+            pro = Processor(img, timer)
+            contours = pro.process()
             
+            # Postprocessing
+            with timer.stage("Postprocessing"):
+                post = PostProcessing(contours, img, settings, pro.table)
+                results, overlay = post.postprocess()
+                pixels = post.pixels
+            
+            if key is not None:
+                with timer.stage("Cache"):
+                    cache.put(key, pixels, img, threshold)
+        
+        # The settings with the stages, so the result documents its preprocessing
+        settings = PreprocessingPipeline.from_settings(settings).to_settings(settings)
+        
+        # Scratch memory of this image, allocated vs reused from earlier images of this worker
+        buffers = BufferPool.difference(BufferPool().stats(), buffers)
+        
+        # Data only, nothing is rendered
+        if not visualization:
+            result = {
+                "Data": results,
+                "Pixels": pixels,
+                "Threshold": threshold,
+                "Settings": settings,
+                "Buffers": buffers
+                }
+        
         else:
-            return {
-                "Data": results
-                }
\ No newline at end of file
+            if lazy:
+                if transport == PelletSizer.Transport.SHARED:
+                    with timer.stage("Transport"):
+                        overlay.share()
+                
+                image = overlay
+            
+            elif transport == PelletSizer.Transport.SHARED:
+                with timer.stage("Render"):
+                    # The annotations are drawn straight into the scratch file
+                    handle, out = SharedImage.create((*img.shape[:2], 3), img.dtype)
+                    
+                    image = overlay.render(out)
+                    if image is not out:
+                        out[...] = image
+                    
+                    out.flush()
+                    image = handle
+                
+            else:
+                with timer.stage("Render"):
+                    image = overlay.render()
+            
+            result = {
+                "Image": image,
+                "Data": results,
+                "Pixels": pixels,
+                "Threshold": threshold,
+                "Settings": settings,
+                "Buffers": buffers
+            }
+        
+        if timing:
+            result["Timing"] = timer.timings
+        
+        return result
+    
+    @staticmethod
+    def segmentation_settings(settings: list) -> list:
+        """Returns the settings that change the binary image, all but the magnification.
+
+        Args:
+            settings (list): [thresh_value, blur, magnification, stages (optional)]
+
+        Returns:
+            list: [thresh_value, blur, stages...]
+        """
+        settings = settings or []
+        
+        return settings[:2] + settings[3:]
+    
+    @staticmethod
+    def warmup() -> bool:
+        """Runs all steps once on a small dummy image. Used to load cv2/numpy in fresh worker processes.
+
+        Returns:
+            bool: True when done
+        """
+        img = np.zeros((64, 64), dtype=np.uint8)
+        
+        img = Preprocessor(None, []).process_tile_with_settings(cv2.cvtColor(img, cv2.COLOR_GRAY2BGR))
+        contours = Processor(img).process()
+        _, overlay = PostProcessing(contours, img).postprocess()
+        overlay.render()
+        
+        return True
@@ -0,0 +1,212 @@
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import uuid
+
+import numpy as np
+
+class ResultCache:
+    """Content-addressed on-disk cache for pellet sizer results. An entry is keyed by the image content, the settings
+    and the algorithm version and holds the pixel measurement table, the threshold and optionally the binary mask. The cache is bounded
+    in size, the least recently used entries are evicted first.
+
+    The cache only holds its directory and limits, so it can be handed to worker processes.
+
+    Integration:
+        cache = ResultCache(directory)
+        key = cache.key(path, settings, version)
+        entry = cache.get(key)              # None or (pixels, mask, threshold)
+        cache.put(key, pixels, mask, threshold)
+    """
+
+    DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), "MicroBioVision", "pellet_cache")
+    DEFAULT_MAX_BYTES = 1024 ** 3
+
+    # The directory is scanned at most every this many puts of a process, in between the size is estimated from
+    # the entries this process wrote. Other processes writing the same cache are seen on the next scan
+    SCAN_INTERVAL = 64
+
+    # Eviction goes down to this share of max_bytes, so a full cache is not scanned again on the next put
+    LOW_WATER = 0.9
+
+    # directory -> [estimated bytes, puts since the last scan], per process as the cache itself is pickled per task
+    _estimates = {}
+    _estimates_lock = threading.Lock()
+
+    def __init__(self, directory: str = None, max_bytes: int = DEFAULT_MAX_BYTES, store_masks: bool = False) -> None:
+        """Sets up the cache.
+
+        Args:
+            directory (str, optional): cache directory. Defaults to DEFAULT_DIRECTORY.
+            max_bytes (int, optional): size limit of the cache directory. Defaults to 1 GiB.
+            store_masks (bool, optional): if the binary masks are stored to render overlays without reprocessing, costs a compressed full-size mask per entry. Defaults to False.
+        """
+        self.directory = directory or self.DEFAULT_DIRECTORY
+        self.max_bytes = max_bytes
+        self.store_masks = store_masks
+
+    @classmethod
+    def for_project(cls, project_path: str = None, **kwargs) -> "ResultCache":
+        """Returns a cache inside the project folder.
+
+        Args:
+            project_path (str, optional): path of the current project. Defaults to None.
+
+        Returns:
+            ResultCache: the cache, None if no project is open
+        """
+        if not project_path:
+            return None
+
+        return cls(os.path.join(project_path, "cache", "pellet_sizer"), **kwargs)
+
+    def key(self, path: str, settings: list, version: int) -> str:
+        """Builds the cache key from the image content, the settings and the algorithm version.
+
+        Args:
+            path (str): image path
+            settings (list): settings that change the segmentation, [thresh_value, blur]
+            version (int): algorithm version
+
+        Returns:
+            str: hex key
+        """
+        digest = hashlib.blake2b(digest_size=20)
+
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+
+        digest.update(json.dumps([settings, version], default=str).encode())
+
+        return digest.hexdigest()
+
+    def get(self, key: str, need_mask: bool = False) -> tuple:
+        """Looks up an entry and marks it as recently used.
+
+        Args:
+            key (str): from ResultCache.key
+            need_mask (bool, optional): if an entry without mask counts as a miss. Defaults to False.
+
+        Returns:
+            tuple: (pixels, mask, threshold) with pixels as list of rows, mask and threshold or None, None on a miss
+        """
+        entry = self._entry_path(key)
+
+        try:
+            with np.load(entry) as stored:
+                pixels = stored["pixels"].tolist()
+                mask = stored["mask"] if "mask" in stored.files else None
+                threshold = float(stored["threshold"]) if "threshold" in stored.files else None
+
+        except (OSError, KeyError, ValueError):
+            return None
+
+        if need_mask and mask is None:
+            return None
+
+        # The modification time is the LRU timestamp
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+
+        return pixels, mask, threshold
+
+    def put(self, key: str, pixels: list, mask=None, threshold: float = None) -> None:
+        """Stores an entry and evicts old entries if the cache is too large.
+
+        Args:
+            key (str): from ResultCache.key
+            pixels (list): rows of the pixel measurement table
+            mask (MatLike, optional): binary mask, only stored with store_masks. Defaults to None.
+            threshold (float, optional): threshold the mask was binarized with. Defaults to None.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        arrays = {"pixels": np.asarray(pixels, dtype=np.float64)}
+        if self.store_masks and mask is not None:
+            arrays["mask"] = np.asarray(mask)
+        if threshold is not None:
+            arrays["threshold"] = np.float64(threshold)
+
+        # Written under a temporary name first, so readers in other processes never see half written entries
+        temporary = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+
+        with open(temporary, "wb") as file:
+            np.savez_compressed(file, **arrays)
+
+        entry = self._entry_path(key)
+        os.replace(temporary, entry)
+
+        try:
+            size = os.path.getsize(entry)
+        except OSError:
+            size = 0
+
+        with self._estimates_lock:
+            estimate = self._estimates.get(self.directory)
+
+            if estimate is not None:
+                estimate[0] += size
+                estimate[1] += 1
+
+            scan = estimate is None or estimate[0] > self.max_bytes or estimate[1] >= self.SCAN_INTERVAL
+
+        if scan:
+            self.evict()
+
+    def evict(self) -> None:
+        """Removes the least recently used entries once the cache is above max_bytes, down to LOW_WATER of it."""
+
+        entries = []
+        total = 0
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+
+        target = self.max_bytes * self.LOW_WATER if total > self.max_bytes else self.max_bytes
+
+        for _, size, name in sorted(entries):
+            if total <= target:
+                break
+
+            try:
+                os.remove(os.path.join(self.directory, name))
+                total -= size
+            except OSError:
+                pass
+
+        with self._estimates_lock:
+            self._estimates[self.directory] = [total, 0]
+
+    def clear(self) -> None:
+        """Removes all entries."""
+
+        with self._estimates_lock:
+            self._estimates.pop(self.directory, None)
+
+        if not os.path.isdir(self.directory):
+            return
+
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
@@ -0,0 +1,128 @@
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import weakref
+
+import numpy as np
+
+class SharedImage:
+    """Handle to an image in a memory-mapped scratch file. Used to hand result images from worker processes
+    to the main process without pickling the pixel data through the process pool pipe.
+
+    Integration:
+    In the worker:
+        handle, buffer = SharedImage.create(shape, dtype)
+        ... write/draw into buffer ...
+        return handle
+
+    In the main process:
+        image = handle.attach()
+    """
+
+    # Every main process (GUI, batch CLI) has its own subdirectory, named after its PID and shared with its workers
+    ROOT_DIRECTORY = os.path.join(tempfile.gettempdir(), "MicroBioVision", "shared_images")
+
+    # Subdirectories of other processes untouched for this long are left over from a crash
+    STALE_SECONDS = 24 * 3600
+
+    def __init__(self, path: str, shape: tuple, dtype: str) -> None:
+
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = dtype
+
+    def __repr__(self) -> str:
+        return f"SharedImage({os.path.basename(self.path)}, {self.shape}, {self.dtype})"
+
+    @classmethod
+    def directory(cls) -> str:
+        """Returns the scratch directory of this process, the one of the main process in a worker."""
+
+        parent = multiprocessing.parent_process()
+        owner = parent.pid if parent is not None else os.getpid()
+
+        return os.path.join(cls.ROOT_DIRECTORY, str(owner))
+
+    @classmethod
+    def create(cls, shape: tuple, dtype, directory: str = None) -> tuple:
+        """Creates a new scratch file and maps it.
+
+        Args:
+            shape (tuple): shape of the image
+            dtype (np.dtype): dtype of the image
+            directory (str, optional): scratch directory. Defaults to directory().
+
+        Returns:
+            tuple: (SharedImage, np.ndarray) the handle and the writable buffer
+        """
+        directory = directory or cls.directory()
+        os.makedirs(directory, exist_ok=True)
+
+        path = os.path.join(directory, f"{uuid.uuid4().hex}.npy")
+        dtype = np.dtype(dtype)
+
+        buffer = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=tuple(shape))
+
+        return cls(path, shape, dtype.str), buffer
+
+    def attach(self) -> np.ndarray:
+        """Maps the scratch file into the current process without copying.
+
+        Returns:
+            np.ndarray: the image (copy-on-write, changes are not written back to the file)
+        """
+        image = np.load(self.path, mmap_mode="c")
+
+        # The mapping stays valid without the file on POSIX. On Windows a mapped file can not be removed, so it
+        # is removed again once the mapping is closed, i.e. when the last view of the image is dropped
+        self.release()
+
+        if os.path.exists(self.path):
+            weakref.finalize(getattr(image, "_mmap", None) or image, SharedImage.release, self)
+
+        return image
+
+    def release(self) -> None:
+        """Removes the scratch file if it is not in use anymore."""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    @classmethod
+    def cleanup(cls, directory: str = None) -> None:
+        """Removes the left over scratch files of this process that are not mapped anymore, and the directories
+        of other processes that were not used for STALE_SECONDS. Files of other running processes are kept.
+
+        Args:
+            directory (str, optional): scratch directory. Defaults to directory().
+        """
+        directory = directory or cls.directory()
+
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(".npy"):
+                    cls(os.path.join(directory, name), (), "").release()
+
+        if not os.path.isdir(cls.ROOT_DIRECTORY):
+            return
+
+        now = time.time()
+
+        for name in os.listdir(cls.ROOT_DIRECTORY):
+            other = os.path.join(cls.ROOT_DIRECTORY, name)
+
+            if os.path.normcase(other) == os.path.normcase(directory) or not os.path.isdir(other):
+                continue
+
+            try:
+                last_use = max([os.path.getmtime(other)] + [os.path.getmtime(os.path.join(other, file)) for file in os.listdir(other)])
+            except OSError:
+                continue
+
+            if now - last_use > cls.STALE_SECONDS:
+                shutil.rmtree(other, ignore_errors=True)
@@ -0,0 +1,114 @@
+
+import sys
+import time
+
+from controller.algorithms.pellet_sizer.buffer_pool import BufferPool
+
+class StageTimer:
+    """Records the wall time and memory of the steps of one image. A disabled timer does nothing, so the steps
+    can always be wrapped.
+
+    Integration:
+        timer = StageTimer()
+        with timer.stage("Read"):
+            img = cv2.imread(path)
+        timer.timings   # {"Read": {"Seconds": ..., "Allocated": ..., "PeakRSS": ...}}
+    """
+
+    # Metrics of a stage, all are summed up when aggregated
+    METRICS = ("Seconds", "Allocated", "PeakRSS")
+
+    def __init__(self, enabled: bool = True) -> None:
+
+        self.enabled = enabled
+
+        # stage -> metrics, in order of the first call, repeated stages (e.g. tiles) are summed up
+        self.timings = {}
+
+        self._name = None
+        self._start = None
+
+    def stage(self, name: str) -> "StageTimer":
+        """Returns the timer as context manager for the given stage. Stages are not nested."""
+
+        self._name = name
+        return self
+
+    def __enter__(self) -> "StageTimer":
+
+        if self.enabled:
+            self._allocated = BufferPool().stats()["Allocated"]
+            self._rss = self.peak_rss()
+            self._start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *exc) -> bool:
+
+        if self.enabled:
+            seconds = time.perf_counter() - self._start
+
+            self.add_stage(self._name, {
+                "Seconds": seconds,
+                # Scratch buffers newly allocated in the stage
+                "Allocated": BufferPool().stats()["Allocated"] - self._allocated,
+                # Growth of the peak memory of the process, 0 when the stage stayed below an earlier peak
+                "PeakRSS": self.peak_rss() - self._rss
+            })
+
+        return False
+
+    def add_stage(self, name: str, metrics: dict) -> None:
+        """Adds metrics to a stage, e.g. measured somewhere else like the transport of the result."""
+
+        if not self.enabled:
+            return
+
+        stage = self.timings.setdefault(name, dict.fromkeys(self.METRICS, 0))
+
+        for metric, value in metrics.items():
+            stage[metric] = stage.get(metric, 0) + value
+
+    @staticmethod
+    def peak_rss() -> int:
+        """Returns the peak resident memory of the process in bytes, 0 where it is not available (Windows)."""
+
+        try:
+            import resource
+        except ImportError:
+            return 0
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    @staticmethod
+    def add(total: dict, timings: dict) -> dict:
+        """Sums up the timings of several images per stage.
+
+        Args:
+            total (dict): sum so far, may be empty
+            timings (dict): "Timing" of a result
+
+        Returns:
+            dict: the sum, with "Images" counting the images per stage
+        """
+        total = {name: dict(metrics) for name, metrics in total.items()}
+
+        for name, metrics in (timings or {}).items():
+            stage = total.setdefault(name, {"Images": 0})
+            stage["Images"] += 1
+
+            for metric, value in metrics.items():
+                stage[metric] = stage.get(metric, 0) + value
+
+        return total
+
+    @staticmethod
+    def summary(total: dict) -> str:
+        """Formats summed timings for the log, e.g. "Read 1.20 s (12%), Gray 3.10 s (31%)"."""
+
+        seconds = sum(stage["Seconds"] for stage in total.values()) or 1.0
+
+        return ", ".join(f"{name} {stage['Seconds']:.2f} s ({stage['Seconds'] / seconds:.0%})" for name, stage in total.items())
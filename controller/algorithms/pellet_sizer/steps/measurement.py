@@ -0,0 +1,85 @@
+
+import cv2
+import numpy as np
+
+class Measurement:
+    """Computes the per-object features of all contours in one vectorized pass over the concatenated contour points.
+    The resulting structured array is the single table that filtering and the results are derived from.
+    """
+
+    # One row per contour, all values in pixel units
+    DTYPE = np.dtype([
+        ("points", np.int32),       # number of contour points
+        ("x", np.int32),            # bounding rect
+        ("y", np.int32),
+        ("w", np.int32),
+        ("h", np.int32),
+        ("area", np.float64),       # same as cv2.contourArea
+        ("arc_length", np.float64), # same as cv2.arcLength(closed=True)
+        ("feret_max", np.float64)   # longer side of the minAreaRect of the hull, NaN until measure_feret
+    ])
+
+    @staticmethod
+    def measure(contours: list) -> np.ndarray:
+        """Measures all contours at once.
+
+        Args:
+            contours (list): contours as returned by cv2.findContours
+
+        Returns:
+            np.ndarray: structured array with Measurement.DTYPE
+        """
+        table = np.zeros(len(contours), dtype=Measurement.DTYPE)
+        table["feret_max"] = np.nan
+
+        if len(contours) == 0:
+            return table
+
+        lengths = np.fromiter((len(contour) for contour in contours), dtype=np.int64, count=len(contours))
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+        points = np.concatenate([np.asarray(contour).reshape(-1, 2) for contour in contours]).astype(np.int64)
+        x = points[:, 0]
+        y = points[:, 1]
+
+        # Index of the following point, the last point of a contour is connected back to its first one
+        following = np.arange(1, len(points) + 1)
+        following[starts + lengths - 1] = starts
+
+        x_next = x[following]
+        y_next = y[following]
+
+        # Shoelace formula and closed polygon length, summed per contour
+        cross = x * y_next - x_next * y
+        segments = np.sqrt(((x_next - x) ** 2 + (y_next - y) ** 2).astype(np.float64))
+
+        table["points"] = lengths
+        table["area"] = np.abs(np.add.reduceat(cross, starts)) / 2
+        table["arc_length"] = np.add.reduceat(segments, starts)
+
+        x_min = np.minimum.reduceat(x, starts)
+        y_min = np.minimum.reduceat(y, starts)
+
+        table["x"] = x_min
+        table["y"] = y_min
+        table["w"] = np.maximum.reduceat(x, starts) - x_min + 1
+        table["h"] = np.maximum.reduceat(y, starts) - y_min + 1
+
+        return table
+
+    @staticmethod
+    def measure_feret(contours: list, table: np.ndarray) -> np.ndarray:
+        """Fills the maximum feret diameter. Kept separate as it needs one hull per contour and is only done for the filtered contours.
+
+        Args:
+            contours (list): contours in the same order as the table
+            table (np.ndarray): table from Measurement.measure
+
+        Returns:
+            np.ndarray: the same table
+        """
+        for i, contour in enumerate(contours):
+            (width, height) = cv2.minAreaRect(cv2.convexHull(contour))[1]
+            table["feret_max"][i] = max(width, height)
+
+        return table
@@ -0,0 +1,78 @@
+
+import cv2
+import numpy as np
+
+from controller.algorithms.pellet_sizer.shared_image import SharedImage
+
+class Overlay:
+    """The annotation of a pellet image (numbers and contours on the binary image). Holds everything needed for
+    drawing, but only draws when render() is called, e.g. when the image is displayed or exported.
+    """
+
+    def __init__(self, mask, contours: list, positions: np.ndarray) -> None:
+        """Takes the parts of the annotation.
+
+        Args:
+            mask (MatLike | SharedImage): binary image
+            contours (list): contours of the pellets
+            positions (np.ndarray): (n, 2) text positions of the pellet numbers
+        """
+        self.mask = mask
+        self.contours = contours
+        self.positions = positions
+
+    def share(self) -> None:
+        """Moves the mask into a memory-mapped scratch file so it is not pickled through the process pool pipe."""
+
+        if isinstance(self.mask, SharedImage):
+            return
+
+        handle, buffer = SharedImage.create(self.mask.shape, self.mask.dtype)
+        buffer[...] = self.mask
+        buffer.flush()
+
+        self.mask = handle
+
+    def attach(self) -> None:
+        """Maps a shared mask into the current process."""
+
+        if isinstance(self.mask, SharedImage):
+            self.mask = self.mask.attach()
+
+    def render(self, out=None):
+        """Draws the annotated image.
+
+        Args:
+            out (MatLike, optional): preallocated (h, w, 3) buffer to draw into. Defaults to None.
+
+        Returns:
+            MatLike: the annotated RGB image
+        """
+        self.attach()
+
+        img = cv2.cvtColor(self.mask, cv2.COLOR_GRAY2RGB, dst=out)
+
+        xi, yi = img.shape[0:2]
+
+        larger_dimension = xi if xi > yi else yi
+
+        if larger_dimension < 2500:
+            font_size = 2
+            font_thickness = 2
+
+        elif larger_dimension < 5000:
+            font_size = 4
+            font_thickness = 10
+        else:
+            font_size = 15
+            font_thickness = 20
+
+        # Puts a number to the pellets
+        for number, (x, y) in enumerate(self.positions.tolist(), start=1):
+            img = cv2.putText(img, str(number), (x, y), cv2.FONT_HERSHEY_PLAIN, font_size, (0,0,255), font_thickness, cv2.LINE_AA)
+
+        # Drawing the contours
+        if self.contours:
+            img = cv2.drawContours(img, self.contours, -1, (0,255,0), 2, cv2.LINE_AA)
+
+        return img
@@ -0,0 +1,442 @@
+
+import json
+import threading
+
+import cv2
+import numpy as np
+from cv2.typing import *
+
+from controller.algorithms.pellet_sizer.buffer_pool import BufferPool
+from controller.algorithms.pellet_sizer.bit_depth import BitDepth
+
+class PipelineStage:
+    """A single preprocessing stage. Stages are created from plain dicts ({"stage": name, **params}) so a
+    pipeline can be stored in the settings list of the results.
+    """
+
+    NAME = ""
+
+    def __init__(self, **params) -> None:
+        self.params = params
+
+    def apply(self, img: MatLike, dst: MatLike, pipeline: "PreprocessingPipeline") -> MatLike:
+        """Applies the stage.
+
+        Args:
+            img (MatLike): input image, never written to
+            dst (MatLike): preallocated output buffer with the shape and dtype of img
+            pipeline (PreprocessingPipeline): the pipeline running the stage
+
+        Returns:
+            MatLike: the result, dst if the OpenCV call could write into it
+        """
+        raise NotImplementedError
+
+    def radius(self) -> int:
+        """Returns how far a pixel of the result depends on its neighbours, None if the stage is not local.
+        Used to decide if the stage can run on overlapping tiles."""
+        return 0
+
+    def to_dict(self) -> dict:
+        return {"stage": self.NAME, **self.params}
+
+
+class BlurStage(PipelineStage):
+
+    NAME = "blur"
+
+    def __init__(self, kind: str = "gaussian", ksize: int = 5) -> None:
+        super().__init__(kind=kind.lower(), ksize=int(ksize))
+
+    def apply(self, img, dst, pipeline):
+        kind, ksize = self.params["kind"], self.params["ksize"]
+
+        if kind == "gaussian":
+            return cv2.GaussianBlur(img, (ksize, ksize), 0, dst=dst)
+
+        elif kind == "median":
+            return cv2.medianBlur(img, ksize, dst=dst)
+
+        elif kind == "stacked":
+            return cv2.stackBlur(img, (ksize, ksize), dst=dst)
+
+        elif kind == "none":
+            dst[...] = img
+            return dst
+
+        raise ValueError(f"Unknown blur: {kind}.")
+
+    def radius(self):
+        # The result of stackBlur depends on the width of the image it runs on (its rounding differs between
+        # its code paths), so tiles would not match the full image at any fixed overlap
+        if self.params["kind"] == "stacked":
+            return None
+
+        return self.params["ksize"] // 2
+
+
+class ClaheStage(PipelineStage):
+
+    NAME = "clahe"
+
+    def __init__(self, clip_limit: float = 2.0, tile_grid: int = 8) -> None:
+        super().__init__(clip_limit=float(clip_limit), tile_grid=int(tile_grid))
+
+    def apply(self, img, dst, pipeline):
+        clahe = cv2.createCLAHE(self.params["clip_limit"], (self.params["tile_grid"], self.params["tile_grid"]))
+        return clahe.apply(img, dst)
+
+    def radius(self):
+        # The histogram grid spans the whole image
+        return None
+
+
+class BackgroundStage(PipelineStage):
+    """Flat-field correction: the background is estimated with a morphological closing, which removes the dark
+    pellets, and the image is divided by it. Pellets stay dark on an even bright background."""
+
+    NAME = "background"
+
+    def __init__(self, ksize: int = 51) -> None:
+        super().__init__(ksize=int(ksize))
+
+    def apply(self, img, dst, pipeline):
+        ksize = self.params["ksize"]
+
+        pool = BufferPool()
+
+        background = pool.acquire(img.shape, img.dtype)
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (ksize, ksize))
+        cv2.morphologyEx(img, cv2.MORPH_CLOSE, kernel, dst=background)
+
+        # The corrected image keeps the range of the significant bits
+        peak = 255 if img.dtype == np.uint8 else (1 << pipeline.current_bits) - 1
+
+        img = cv2.divide(img, background, dst=dst, scale=float(peak))
+        pool.release(background)
+
+        return img
+
+    def radius(self):
+        # Closing is a dilation followed by an erosion
+        return 2 * (self.params["ksize"] // 2)
+
+
+class ThresholdStage(PipelineStage):
+    """Binarizes the image, pellets (dark) become white. Without a value the threshold of the settings is used.
+    Thresholds are in 8-bit units, for high bit depth images they are scaled and the mask is written as 8-bit."""
+
+    NAME = "threshold"
+
+    def __init__(self, value: int = None) -> None:
+        super().__init__(**({} if value is None else {"value": int(value)}))
+
+    def apply(self, img, dst, pipeline, value: int = -1, bits: int = 8):
+        value = self.params.get("value", value)
+
+        if img.dtype == np.uint8:
+            if value is not None and value >= 0:
+                pipeline.threshold_value, img = cv2.threshold(img, value, 255, cv2.THRESH_BINARY_INV, dst=dst)
+            else:
+                pipeline.threshold_value, img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV+cv2.THRESH_OTSU, dst=dst)
+
+            return img
+
+        scale = BitDepth.scale(bits)
+
+        if value is not None and value >= 0:
+            thresh = int(value * scale)
+        else:
+            # Otsu on the full bit depth, only the value is used
+            pool = BufferPool()
+            scratch = pool.acquire(img.shape, img.dtype)
+            thresh, _ = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV+cv2.THRESH_OTSU, dst=scratch)
+            pool.release(scratch)
+
+        # Same as THRESH_BINARY_INV, but straight into the 8-bit mask
+        pipeline.threshold_value = thresh / scale
+
+        return cv2.compare(img, float(thresh), cv2.CMP_LE, dst=dst)
+
+
+class MorphologyStage(PipelineStage):
+
+    NAME = "morphology"
+
+    OPERATIONS = {
+        "open": cv2.MORPH_OPEN,
+        "close": cv2.MORPH_CLOSE
+    }
+
+    def __init__(self, op: str = "open", ksize: int = 3) -> None:
+        super().__init__(op=op.lower(), ksize=int(ksize))
+
+    def apply(self, img, dst, pipeline):
+        if self.params["op"] not in self.OPERATIONS:
+            raise ValueError(f"Unknown morphological operation: {self.params['op']}.")
+
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (self.params["ksize"], self.params["ksize"]))
+
+        return cv2.morphologyEx(img, self.OPERATIONS[self.params["op"]], kernel, dst=dst)
+
+    def radius(self):
+        return 2 * (self.params["ksize"] // 2)
+
+
+class DepthStage(PipelineStage):
+    """Not run in order, it sets how high bit depth images (e.g. 12-bit in uint16) are handled. By default they are
+    shifted to 8-bit right after the grayscale conversion. With native the gray stages and the threshold run on the
+    full bit depth. The significant bits are detected per image unless given."""
+
+    NAME = "depth"
+
+    def __init__(self, native: bool = False, bits: int = None) -> None:
+        super().__init__(native=bool(native), **({} if bits is None else {"bits": int(bits)}))
+
+
+class PreprocessingPipeline:
+    """Declarative preprocessing: grayscale conversion followed by a list of stages, e.g.
+
+        [{"stage": "background", "ksize": 51}, {"stage": "blur", "kind": "median", "ksize": 5},
+         {"stage": "threshold"}, {"stage": "morphology", "op": "open", "ksize": 3}]
+
+    The stages before the threshold work on the grayscale image ("gray stages"), the threshold and the stages
+    after it on the binary image. High bit depth images are shifted to 8-bit after the grayscale conversion, unless
+    a {"stage": "depth", "native": true} entry keeps them native up to the threshold. The list is stored as fourth entry of the settings list
+    [thresh_value, blur, magnification, stages]. Without it the legacy settings are used (blur with a 5x5 kernel
+    and threshold).
+
+    The stages run ping-pong between two buffers of the BufferPool, which are reused for the next image of the same
+    shape and dtype. Only the binary result is a fresh array, so it can be kept by the caller.
+
+    Integration:
+        pipeline = PreprocessingPipeline.from_settings(settings)
+        binary = pipeline.process(img, settings[0])
+    """
+
+    STAGES = {stage.NAME: stage for stage in (BlurStage, ClaheStage, BackgroundStage, ThresholdStage, MorphologyStage, DepthStage)}
+
+    # The pipelines of a worker, so the buffers are reused across images
+    _pipelines = {}
+    _pipelines_lock = threading.Lock()
+
+    def __init__(self, stages: list) -> None:
+        """Builds the pipeline.
+
+        Args:
+            stages (list): dicts {"stage": name, **params}, a threshold stage is appended if there is none
+
+        Raises:
+            ValueError: if a stage is unknown
+        """
+        self.stages = []
+
+        for spec in stages:
+            spec = dict(spec)
+            name = spec.pop("stage", None)
+
+            if name not in self.STAGES:
+                raise ValueError(f"Unknown preprocessing stage: {name}.")
+
+            self.stages.append(self.STAGES[name](**spec))
+
+        if not any(isinstance(stage, ThresholdStage) for stage in self.stages):
+            self.stages.append(ThresholdStage())
+
+        self.depth = next((stage for stage in self.stages if isinstance(stage, DepthStage)), DepthStage())
+        ordered = [stage for stage in self.stages if not isinstance(stage, DepthStage)]
+
+        split = next(i for i, stage in enumerate(ordered) if isinstance(stage, ThresholdStage))
+        self.gray_stages = ordered[:split]
+        self.binary_stages = ordered[split:]
+
+        self._local = threading.local()
+
+    @classmethod
+    def from_settings(cls, settings: list) -> "PreprocessingPipeline":
+        """Returns the pipeline of a settings list, the same instance for the same stages within a process.
+
+        Args:
+            settings (list): [thresh_value, blur, magnification, stages (optional)]
+
+        Returns:
+            PreprocessingPipeline: the pipeline
+        """
+        stages = cls.stages_from_settings(settings)
+        key = json.dumps(stages, sort_keys=True)
+
+        with cls._pipelines_lock:
+            if key not in cls._pipelines:
+                cls._pipelines[key] = cls(stages)
+
+            return cls._pipelines[key]
+
+    @staticmethod
+    def stages_from_settings(settings: list) -> list:
+        """Returns the stage dicts of a settings list, legacy settings are translated.
+
+        Args:
+            settings (list): [thresh_value, blur, magnification, stages (optional)]
+
+        Returns:
+            list: stage dicts
+        """
+        if settings and len(settings) > 3 and settings[3]:
+            return [dict(spec) for spec in settings[3]]
+
+        blur = settings[1] if settings and len(settings) > 1 else "Gaussian"
+
+        return [{"stage": "blur", "kind": str(blur).lower(), "ksize": 5}, {"stage": "threshold"}]
+
+    def to_dict(self) -> list:
+        """Returns the serializable stage dicts."""
+        return [stage.to_dict() for stage in self.stages]
+
+    def to_settings(self, settings: list) -> list:
+        """Returns the settings list with the stages of this pipeline.
+
+        Args:
+            settings (list): [thresh_value, blur, magnification, ...]
+
+        Returns:
+            list: [thresh_value, blur, magnification, stages]
+        """
+        settings = list(settings or [-1, "Gaussian", "2X"])
+        settings += [None] * (3 - len(settings))
+
+        return settings[:3] + [self.to_dict()]
+
+    @property
+    def threshold_value(self) -> float:
+        """The threshold used by the last binary() call of this thread."""
+        return getattr(self._local, "threshold_value", None)
+
+    @threshold_value.setter
+    def threshold_value(self, value: float) -> None:
+        self._local.threshold_value = value
+
+    @property
+    def current_bits(self) -> int:
+        """The significant bits of the image of the running gray() call of this thread."""
+        return getattr(self._local, "bits", 8)
+
+    def margin(self) -> int:
+        """Returns the tile overlap needed by the gray stages, None if they can not run on tiles."""
+        margin = 0
+
+        for stage in self.gray_stages:
+            radius = stage.radius()
+            if radius is None:
+                return None
+            margin += radius
+
+        return margin
+
+    def bit_depth(self, img: MatLike) -> int:
+        """Returns the significant bits of an image, the bits of the depth stage if given."""
+        return self.depth.params.get("bits") or BitDepth.bits(img)
+
+    def gray_dtype(self, dtype) -> np.dtype:
+        """Returns the dtype of the gray() result for an image dtype."""
+        return np.dtype(dtype) if self.depth.params["native"] else np.dtype(np.uint8)
+
+    def gray(self, img: MatLike, bits: int = None) -> MatLike:
+        """Converts the image to grayscale and runs the gray stages.
+
+        Args:
+            img (MatLike): loaded image (gray, BGR or BGRA)
+            bits (int, optional): significant bits of the whole image, tiles must not detect their own. Defaults to None (detected).
+
+        Returns:
+            MatLike: processed grayscale image, a buffer of the BufferPool, give it back with release()
+        """
+        pool = BufferPool()
+
+        bits = bits or self.bit_depth(img)
+        self._local.bits = bits
+
+        shape, dtype = img.shape[:2], img.dtype
+        ping, pong = pool.acquire(shape, dtype), pool.acquire(shape, dtype)
+
+        if img.ndim == 2:
+            current = img
+        elif img.shape[2] == 4:
+            current = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY, dst=ping)
+        else:
+            current = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=ping)
+
+        # High bit depth images continue in 8-bit, which halves the memory of all following stages
+        if current.dtype != self.gray_dtype(dtype):
+            converted = BitDepth.to_8bit(current, bits, out=pool.acquire(shape, np.uint8))
+
+            pool.release(ping)
+            pool.release(pong)
+            ping, pong = converted, pool.acquire(shape, np.uint8)
+            current = ping
+            self._local.bits = 8
+
+        for stage in self.gray_stages:
+            dst = pong if current is ping else ping
+            current = stage.apply(current, dst, self)
+
+        # The result is always one of the two buffers, never the input image
+        if current is img:
+            ping[...] = img
+            current = ping
+
+        pool.release(pong if current is ping else ping)
+
+        return current
+
+    def binary(self, gray: MatLike, threshold: int = -1, bits: int = None) -> MatLike:
+        """Runs the threshold and the stages after it.
+
+        Args:
+            gray (MatLike): grayscale image from gray()
+            threshold (int, optional): threshold in 8-bit units if the stage has none, -1 for Otsu. Defaults to -1.
+            bits (int, optional): significant bits of a native high bit depth image. Defaults to None (detected).
+
+        Returns:
+            MatLike: 8-bit binary image, a new array that is owned by the caller
+        """
+        result = np.empty(gray.shape, dtype=np.uint8)
+
+        if gray.dtype != np.uint8:
+            bits = bits or self.bit_depth(gray)
+
+        current = self.binary_stages[0].apply(gray, result, self, threshold, bits or 8)
+
+        if len(self.binary_stages) > 1:
+            pool = BufferPool()
+            # The stages after the threshold work on the 8-bit mask, whatever the depth of the gray image
+            scratch = pool.acquire(gray.shape, np.uint8)
+
+            for stage in self.binary_stages[1:]:
+                scratch[...] = current
+                current = stage.apply(scratch, result, self)
+
+            pool.release(scratch)
+
+        return current
+
+    def release(self, gray: MatLike) -> None:
+        """Gives the image of gray() back to the BufferPool."""
+        BufferPool().release(gray)
+
+    def process(self, img: MatLike, threshold: int = -1) -> MatLike:
+        """Runs the whole pipeline.
+
+        Args:
+            img (MatLike): loaded image
+            threshold (int, optional): threshold in 8-bit units if the stage has none, -1 for Otsu. Defaults to -1.
+
+        Returns:
+            MatLike: 8-bit binary image
+        """
+        bits = self.bit_depth(img)
+
+        gray = self.gray(img, bits)
+        binary = self.binary(gray, threshold, bits)
+        self.release(gray)
+
+        return binary
@@ -1,96 +1,49 @@
 
-import cv2
-
-
 import numpy as np
 
+from controller.algorithms.pellet_sizer.steps.measurement import Measurement
+from controller.algorithms.pellet_sizer.steps.overlay import Overlay
+from controller.algorithms.pellet_sizer.steps.scaling import Scaling
+
 class PostProcessing:
 
-    def __init__(self, contours, img, settings=None):
+    def __init__(self, contours, img, settings=None, table=None):
         
-        self.img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+        # The binary image, it is only converted to RGB when the overlay is rendered
+        self.img = img
         self.contours = contours
         
+        # The measurement table of the contours (Processor.table), measured here if not given
+        self.table = table
+        
         self.result = []
-        # Conversion factors (pixel → micrometer)
-        self.scale_factors = {
-            "2X": 4.5088,    # double of 4X
-            "4X": 2.2544,    # your base case
-            "10X": 0.90176,  # 4X/2.5
-            "20X": 0.45088,  # 4X/5
-            "40X": 0.22544,  # 4X/10
-            "100X": 0.090176 # 4X/25
-        }
-
-        # Default magnification
-        self.magnification = "4X"
-
-        try:
-            if settings:
-                chosen_mag = settings[2] if len(settings) > 2 else None
-                if chosen_mag in self.scale_factors:
-                    self.magnification = chosen_mag
-        except Exception as e:
-            print(f"[Warning] Failed to read magnification from settings: {e}. Falling back to 4X.")
-
+        # The measurements in pixel units, the result columns are derived from these
+        self.pixels = []
 
-        # Use correct scale factor
-        self.pixel_to_um = self.scale_factors[self.magnification]
+        # Use correct scale factor, unknown magnifications fall back to 4X
+        self.magnification = Scaling.magnification_from_settings(settings)
+        self.pixel_to_um = Scaling.pixel_to_um(self.magnification)
         
     def postprocess(self):
         
-        for i, contour in enumerate(self.contours):
-            
-            result = self.pellet_processor(contour, i+1)
-            self.result.append(result)
-            
+        if self.table is None:
+            self.table = Measurement.measure_feret(self.contours, Measurement.measure(self.contours))
         
-        return self.result, self.img        
-    
-    def pellet_processor(self, contour, number: int) -> list:
-        """Marks all pellets with a number and calculates the results."""
-
-        # Puts a number to the pellets
-        x, y, _, _ = cv2.boundingRect(contour)
-        xi, yi = self.img.shape[0:2]
-        
-        larger_dimension = xi if xi > yi else yi
-        
-        if larger_dimension < 2500:
-            font_size = 2
-            font_thickness = 2
-            
-        elif larger_dimension < 5000:
-            font_size = 4
-            font_thickness = 10
-        else:
-            font_size = 15
-            font_thickness = 20
+        self.pixels = Scaling.pixel_table(self.table)
+        self.result = self.pellet_processor(self.pixels)
         
-        self.img = cv2.putText(self.img, str(number), (x, y), cv2.FONT_HERSHEY_PLAIN, font_size, (0,0,255), font_thickness, cv2.LINE_AA)
+        # Nothing is drawn here, the overlay is rendered when the image is needed
+        overlay = Overlay(self.img, self.contours, np.column_stack([self.table["x"], self.table["y"]]))
         
-        # Drawing the contour
-        self.img = cv2.drawContours(self.img, [contour], 0, (0,255,0), 2, cv2.LINE_AA)
-        
-        # Calculating properties
-        area = cv2.contourArea(contour) 
-        diameter = ( (area*4) / np.pi ) ** 0.5
-        perimeter = diameter * np.pi
-        # for the max ferets diameter
-        hull = cv2.convexHull(contour)
-        rect = cv2.minAreaRect(hull)
-        (width, height) = rect[1]
-        feret_max = max(width, height)
-        compactness = diameter / feret_max 
+        return self.result, overlay
+    
+    def pellet_processor(self, pixels: list) -> list:
+        """Calculates the results of all pellets from their pixel measurements.
 
-        diametermy = diameter * self.pixel_to_um # Convert to micrometers
-        areamy = (diametermy ** 2) * np.pi / 4 # Area in square micrometers
-        perimetermy = diametermy * np.pi # Perimeter in micrometers
-        volumemy = (diametermy ** 3) * np.pi / 6 # Volume in cubic micrometers
-        circularity = perimeter / cv2.arcLength(contour, True) 
-        realperimeter = cv2.arcLength(contour, True)* self.pixel_to_um
-        feret_max_my = max(width, height)* self.pixel_to_um
+        Args:
+            pixels (list): rows of [area, arc_length, feret_max] in pixel units
 
-        results = [area, diameter, perimeter, areamy, diametermy, perimetermy,realperimeter, feret_max_my, volumemy, circularity, compactness]
-        
-        return results
\ No newline at end of file
+        Returns:
+            list: one row per pellet with the columns of PelletSizer.RESULT_COLUMNS
+        """
+        return Scaling.apply(pixels, self.pixel_to_um)
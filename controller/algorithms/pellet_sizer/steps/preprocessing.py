@@ -1,23 +1,77 @@
 
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 from cv2.typing import *
 
+from controller.algorithms.pellet_sizer.buffer_pool import BufferPool
+from controller.algorithms.pellet_sizer.stage_timer import StageTimer
+from controller.algorithms.pellet_sizer.steps.pipeline import PreprocessingPipeline
+
 class Preprocessor():
     
-    def __init__(self, path: str, settings : list = None):
+    # Images with at least this many pixels are preprocessed in tiles
+    TILED_MIN_PIXELS = 25_000_000
+    TILE_SIZE = 2048
+    # Minimal overlap of the tiles, it is increased to the radius of the gray stages of the pipeline
+    TILE_MARGIN = 8
+    # Threads for the tiles in a worker process, the other workers already use the remaining cores
+    WORKER_TILE_THREADS = 2
+    
+    def __init__(self, path: str, settings : list = None, timer: StageTimer = None):
         """Takes the path and settings
 
         Args:
             path (str): string path object
-            settings (list, optional): [thresh_value, blur]. Defaults to None.
+            settings (list, optional): [thresh_value, blur, magnification, stages (optional)]. Defaults to None.
+            timer (StageTimer, optional): records "Read", "Gray" and "Threshold". Defaults to None.
         """
         self.path = path
         self.settings = settings
         
-    def process(self):
+        # The stages of the settings, shared with all images of the same settings in this process
+        self.pipeline = PreprocessingPipeline.from_settings(settings)
+        
+        # The threshold used by threshold(), the computed one for Otsu (in 8-bit units)
+        self.threshold_value = None
+        
+        # Significant bits of the image, detected once per image so tiles are converted alike
+        self.bits = None
+        
+        self.timer = timer or StageTimer(enabled=False)
+        
+    def process(self, tiled: bool = None):
+        """Loads and binarizes the image.
+
+        Args:
+            tiled (bool, optional): if the image is preprocessed in parallel tiles. Defaults to None (automatic for large images).
+
+        Raises:
+            ValueError: if the image can not be read
+
+        Returns:
+            MatLike: binary image
+        """
         
         # We load the image
-        img = cv2.imread(self.path, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
+        with self.timer.stage("Read"):
+            img = cv2.imread(self.path, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
+            
+            if img is None:
+                raise ValueError(f"Could not read image {self.path}")
+            
+            self.bits = self.pipeline.bit_depth(img)
+        
+        if tiled is None:
+            tiled = img.shape[0] * img.shape[1] >= self.TILED_MIN_PIXELS
+        
+        # Stages that look at the whole image (CLAHE) can not run on tiles
+        tiled = tiled and self.pipeline.margin() is not None
+        
+        if tiled:
+            return self.process_tiled(img)
         
         img = self.process_tile_with_settings(img)
         
@@ -25,27 +79,91 @@ class Preprocessor():
     
     def process_tile_with_settings(self, img) -> MatLike:
         
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        with self.timer.stage("Gray"):
+            gray = self.blur_tile(img)
+        
+        with self.timer.stage("Threshold"):
+            img = self.threshold(gray)
         
-        # The defeault settings list is just empty
-        if self.settings != []:
+        self.pipeline.release(gray)
+        
+        return img
+    
+    def process_tiled(self, img: MatLike, tile_size: int = None, workers: int = None) -> MatLike:
+        """Runs the gray stages on overlapping tiles in parallel, stitches them and thresholds the stitched image.
+        The overlap makes every stitched pixel identical to the full image path, and as the threshold (also Otsu)
+        is computed on the whole stitched image the binary image and all contours are the same as well. Pipelines
+        with stages that can not run on tiles (CLAHE, stacked blur) use the full image instead.
+
+        Only the gray stages run in parallel, the stitched image is as large as the full one, so the peak memory
+        is the same as without tiles.
+
+        Args:
+            img (MatLike): the loaded image
+            tile_size (int, optional): edge length of the tiles. Defaults to TILE_SIZE.
+            workers (int, optional): number of threads. Defaults to os.cpu_count(), WORKER_TILE_THREADS in a worker process.
+
+        Returns:
+            MatLike: binary image
+        """
+        if self.pipeline.margin() is None:
+            return self.process_tile_with_settings(img)
+        
+        tile_size = tile_size or self.TILE_SIZE
+        margin = max(self.TILE_MARGIN, self.pipeline.margin())
+        
+        if self.bits is None:
+            self.bits = self.pipeline.bit_depth(img)
+        
+        height, width = img.shape[:2]
+        stitched = BufferPool().acquire((height, width), self.pipeline.gray_dtype(img.dtype))
+        
+        def blur_tile(y: int, x: int) -> None:
+            
+            # The tile with its overlap, clipped at the image border
+            y0, y1 = max(y - margin, 0), min(y + tile_size + margin, height)
+            x0, x1 = max(x - margin, 0), min(x + tile_size + margin, width)
+            
+            blurred = self.blur_tile(img[y0:y1, x0:x1])
             
-            if self.settings[1] == "Gaussian":
-                img = cv2.GaussianBlur(img, (5,5), 0)
-                
-            elif self.settings[1] == "Median":
-                img = cv2.medianBlur(img, (5,5), 0)
-                
-            elif self.settings[1] == "Stacked":
-                img = cv2.stackBlur(img, (5,5), 0)
+            # Only the core of the tile is written back
+            core_h = min(tile_size, height - y)
+            core_w = min(tile_size, width - x)
+            stitched[y:y + core_h, x:x + core_w] = blurred[y - y0:y - y0 + core_h, x - x0:x - x0 + core_w]
             
-            if self.settings[0] >= 0 :
-                _, img = cv2.threshold(img, self.settings[0], 255, cv2.THRESH_BINARY_INV)
-            elif self.settings[0] < 0:
-                _, img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV+cv2.THRESH_OTSU)
+            self.pipeline.release(blurred)
+        
+        tiles = [(y, x) for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+        
+        if workers is None:
+            workers = self.WORKER_TILE_THREADS if multiprocessing.parent_process() is not None else os.cpu_count() or 1
         
-        else:
-            img = cv2.GaussianBlur(img, (5,5), 0)
-            _, img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV+cv2.THRESH_OTSU)
+        # OpenCV releases the GIL, so threads run the tiles in parallel
+        with self.timer.stage("Gray"), ThreadPoolExecutor(max_workers=min(len(tiles), workers)) as executor:
+            list(executor.map(lambda tile: blur_tile(*tile), tiles))
         
-        return img
\ No newline at end of file
+        with self.timer.stage("Threshold"):
+            img = self.threshold(stitched)
+        BufferPool().release(stitched)
+        
+        return img
+    
+    def blur_tile(self, img) -> MatLike:
+        """Converts the image to grayscale and runs the gray stages (e.g. the blur).
+
+        Returns:
+            MatLike: grayscale image, a buffer of the BufferPool that can be given back with pipeline.release()
+        """
+        if self.bits is None:
+            self.bits = self.pipeline.bit_depth(img)
+        
+        return self.pipeline.gray(img, self.bits)
+    
+    def threshold(self, img) -> MatLike:
+        
+        thresh_value = self.settings[0] if self.settings else -1
+        
+        img = self.pipeline.binary(img, thresh_value, self.bits)
+        self.threshold_value = self.pipeline.threshold_value
+        
+        return img
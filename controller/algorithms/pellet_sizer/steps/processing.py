@@ -1,24 +1,43 @@
 
 import cv2
+import numpy as np
 from cv2.typing import *
 
+from controller.algorithms.pellet_sizer.steps.measurement import Measurement
+from controller.algorithms.pellet_sizer.stage_timer import StageTimer
+
 class Processor:
     
-    def __init__(self, img: MatLike):
+    def __init__(self, img: MatLike, timer: StageTimer = None):
         
         self.img = img
         
+        # Records "Contours", "Filter" and "Measurement"
+        self.timer = timer or StageTimer(enabled=False)
+        
+        # Measurement table of the filtered contours, filled by process()
+        self.table = None
+        
     def process(self):
         
         # Contours
-        cont = self.contours(self.img)
+        with self.timer.stage("Contours"):
+            cont = self.contours(self.img)
         
-        # Filtering the contours with shape & area
-        filteredcont = self.filter(cont)
+        with self.timer.stage("Filter"):
+            # Measuring all contours once, filtering and results are both based on this table
+            table = Measurement.measure(cont)
+            
+            # Filtering the contours with shape & area
+            keep = self.filter(table)
 
-        # Exclude edge contours
-        filteredcont = self.exclude_edge_contours(filteredcont, self.img.shape)
+            # Exclude edge contours
+            keep &= self.exclude_edge_contours(table, self.img.shape)
 
+            filteredcont = [cont[i] for i in np.flatnonzero(keep)]
+        
+        with self.timer.stage("Measurement"):
+            self.table = Measurement.measure_feret(filteredcont, table[keep])
                 
         return filteredcont
         
@@ -33,48 +52,31 @@ class Processor:
 
         return no_child_contours
 
-    def filter(self, conts: list, len_thresh: int = 50, area_thresh: int  = 1000) -> list: # change the area threshhold here to see smaller or only larger objects
+    def filter(self, table: np.ndarray, len_thresh: int = 50, area_thresh: int  = 1000) -> np.ndarray: # change the area threshhold here to see smaller or only larger objects
+        """Returns a mask of the contours in the measurement table that pass the shape & area filter."""
         
-        filtered_cont = []
+        w = table["w"].astype(np.float64)
+        h = table["h"].astype(np.float64)
         
-        for cont in conts:
-            
-            area = cv2.contourArea(cont)
+        aspect_ratio = np.maximum(w, h) / np.minimum(w, h)
+        extent = table["area"] / (w * h)
         
-            # First we take out small contours
-            if len(cont) <= len_thresh:
-                continue
-            
-            elif area < area_thresh: # as one pixel is roughly 0.55 µm 175 = 100µm
-                continue
-            
-            _, _, w, h = cv2.boundingRect(cont)
-            
-            aspect_ratio = max(w, h) / min(w, h)
-            if aspect_ratio > 2:
-                continue
-            
-            area = cv2.contourArea(cont)
-            extent = area / (w*h)
-            
-            if extent < 0.2:
-                continue
-            
-            filtered_cont.append(cont)
+        # First we take out small contours
+        keep = table["points"] > len_thresh
+        
+        keep &= table["area"] >= area_thresh # as one pixel is roughly 0.55 µm 175 = 100µm
+        
+        keep &= aspect_ratio <= 2
+        
+        keep &= extent >= 0.2
             
-        return filtered_cont
+        return keep
     
-    def exclude_edge_contours(self, conts: list, img_shape) -> list:
+    def exclude_edge_contours(self, table: np.ndarray, img_shape) -> np.ndarray:
+        """Returns a mask of the contours in the measurement table that do not touch the image edge."""
         height, width = img_shape[:2]
-        filtered = []
         
-        for cont in conts:
-            x, y, w, h = cv2.boundingRect(cont)
-            
-            # check if bounding box touches any image edge
-            if x <= 0 or y <= 0 or (x + w) >= width or (y + h) >= height:
-                continue  # skip this contour
-            
-            filtered.append(cont)
+        # check if bounding box touches any image edge
+        touches = (table["x"] <= 0) | (table["y"] <= 0) | (table["x"] + table["w"] >= width) | (table["y"] + table["h"] >= height)
             
-        return filtered
+        return ~touches
@@ -0,0 +1,100 @@
+
+import numpy as np
+
+class Scaling:
+    """Converts the pixel measurements of the pellets into the result columns. The segmentation does not depend on the
+    magnification, so results are kept in pixel units and the micrometer columns can be recomputed for any
+    magnification or calibration factor without touching the images.
+    """
+
+    # Conversion factors (pixel → micrometer)
+    SCALE_FACTORS = {
+        "2X": 4.5088,    # double of 4X
+        "4X": 2.2544,    # your base case
+        "10X": 0.90176,  # 4X/2.5
+        "20X": 0.45088,  # 4X/5
+        "40X": 0.22544,  # 4X/10
+        "100X": 0.090176 # 4X/25
+    }
+
+    # Default magnification
+    DEFAULT_MAGNIFICATION = "4X"
+
+    # Columns of the pixel table
+    PIXEL_COLUMNS = ["Area [px^2]", "Arc length [px]", "Feret_max [px]"]
+
+    @staticmethod
+    def pixel_to_um(magnification) -> float:
+        """Returns the scale factor for a magnification.
+
+        Args:
+            magnification (str | float): a key of SCALE_FACTORS or a custom calibration factor in micrometer per pixel
+
+        Returns:
+            float: micrometer per pixel, the factor of DEFAULT_MAGNIFICATION if the magnification is unknown
+        """
+        if magnification in Scaling.SCALE_FACTORS:
+            return Scaling.SCALE_FACTORS[magnification]
+
+        try:
+            factor = float(magnification)
+            if factor > 0:
+                return factor
+        except (TypeError, ValueError):
+            pass
+
+        return Scaling.SCALE_FACTORS[Scaling.DEFAULT_MAGNIFICATION]
+
+    @staticmethod
+    def magnification_from_settings(settings: list):
+        """Returns the magnification of a settings list [thresh_value, blur, magnification]."""
+
+        if settings and len(settings) > 2:
+            return settings[2]
+
+        return Scaling.DEFAULT_MAGNIFICATION
+
+    @staticmethod
+    def pixel_table(table: np.ndarray) -> list:
+        """Extracts the pixel table from a measurement table.
+
+        Args:
+            table (np.ndarray): structured array with Measurement.DTYPE
+
+        Returns:
+            list: one [area, arc_length, feret_max] row per pellet
+        """
+        return np.column_stack([table["area"], table["arc_length"], table["feret_max"]]).tolist()
+
+    @staticmethod
+    def apply(pixels: list, pixel_to_um: float) -> list:
+        """Calculates the result columns from the pixel table.
+
+        Args:
+            pixels (list): rows of [area, arc_length, feret_max] in pixel units
+            pixel_to_um (float): micrometer per pixel
+
+        Returns:
+            list: one row per pellet with the columns of PelletSizer.RESULT_COLUMNS
+        """
+        pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 3)
+
+        # Calculating properties
+        area = pixels[:, 0]
+        diameter = ( (area*4) / np.pi ) ** 0.5
+        perimeter = diameter * np.pi
+        # for the max ferets diameter
+        feret_max = pixels[:, 2]
+        compactness = diameter / feret_max
+
+        diametermy = diameter * pixel_to_um # Convert to micrometers
+        areamy = (diametermy ** 2) * np.pi / 4 # Area in square micrometers
+        perimetermy = diametermy * np.pi # Perimeter in micrometers
+        volumemy = (diametermy ** 3) * np.pi / 6 # Volume in cubic micrometers
+        circularity = perimeter / pixels[:, 1]
+        realperimeter = pixels[:, 1] * pixel_to_um
+        feret_max_my = feret_max * pixel_to_um
+
+        results = np.column_stack([area, diameter, perimeter, areamy, diametermy, perimetermy,realperimeter, feret_max_my, volumemy, circularity, compactness])
+
+        return results.tolist()
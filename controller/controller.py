@@ -25,6 +25,8 @@ class Controller:
 
         self.alg_man = AlgorithmManager()
         
+        # The worker processes are spawned and warmed up once here instead of on every analysis
+        self.alg_man.start_process_pool(warmup=True)
 
         
 
@@ -5,6 +5,7 @@ from view.start_gui import GUInterface
 from operator_mod.operator_mod import OperatorModerator
 
 from operator_mod.eventbus.event_handler import EventManager
+from model.utils.SQL.sql_manager import SQLManager
 
 class ApplicationCoordinator:
 
@@ -55,6 +56,19 @@ class ApplicationCoordinator:
         except Exception as e:
             print(f"❌ [ApplicationCoordinator] Exception during GUI shutdown: {e}")
 
+        # Stops the running states and the worker processes and removes their scratch files
+        try:
+            self.controller.shutdown()
+        except Exception as e:
+            print(f"❌ [ApplicationCoordinator] Exception during controller shutdown: {e}")
+
+        # The controller shutdown has written the results of the write-behind queue, the pooled database
+        # connections write their WAL back into the .db files when closed
+        try:
+            SQLManager().close()
+        except Exception as e:
+            print(f"❌ [ApplicationCoordinator] Exception while closing the databases: {e}")
+
 
 if __name__ == "__main__":
 
@@ -54,7 +54,7 @@ class JSONManager:
         
         try:
             with self._lock:
-                self.fam.get_access(path)
+                self.fam.get_access(path, FileAccessManager.Mode.READ)
                 with open(path, 'r') as file:
                     data = json.load(file)
                 self.logger.info(f"Successfully loaded data from {path}.")
@@ -1,6 +1,8 @@
 import asyncio
-import os
+import threading
+import time
 import aiosqlite
+import numpy as np
 
 from operator_mod.logger.global_logger import Logger
 from model.utils.file_access.file_access_manager import FileAccessManager
@@ -9,70 +11,265 @@ class SQLManager:
     """
     The global instance of the Database Manager. Can be called anywhere. Thread and singleton safe.
 
+    The connections are kept open per database file and run on one long-lived event loop thread, a query only
+    costs the statement itself. Connections that were not used for IDLE_TIMEOUT seconds are closed.
+
     Integration:
     When u want to write data to a sql.db file:
         create_tabel_statement, insert_statement = sql.generate_sql_statements(table_name, data)
         sql.read_or_write(path, insert_statement, "write")
 
+    When u want to write many rows at once (list of dicts, NumPy structured array or pandas DataFrame):
+        sql.write_rows(path, table_name, rows)
+
     When u want to read data from a sql.db file:
         result = sql.read_or_write(path, query, "read")
+        
+    Before the .db file is copied or moved:
+        sql.checkpoint(path)   # or sql.close(path)
     Returns:
         None
     """
 
     _instance = None
-    _lock = asyncio.Lock()
+    _lock = threading.Lock()
+    
+    # Seconds after which an unused connection is closed
+    IDLE_TIMEOUT = 30.0
+    
+    # Seconds to wait for the FileAccessManager, e.g. while the file is copied, before a read or write fails
+    ACCESS_TIMEOUT = 30.0
+    
+    # Applied to every new connection, WAL lets readers run next to the writer and NORMAL only syncs on checkpoints
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-16000",
+        "PRAGMA busy_timeout=5000"
+    )
 
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(SQLManager, cls).__new__(cls)
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(SQLManager, cls).__new__(cls)
         return cls._instance
 
     def __init__(self):
 
-        if not hasattr(self, '_initialized'):
-            self._initialized = True
+        with self._lock:
+            if hasattr(self, '_initialized'):
+                return
+            
             self.sqllogger = Logger("SQLManager").logger
             self.file_manager = FileAccessManager()
-            self._connection = None
-
-    async def _connect(self, path: str):
-        async with self._lock:
-            try:
-                self._connection = await aiosqlite.connect(path)
-            except Exception as e:
-                self.sqllogger.error(f"Error connecting: {e}")
-
-    async def _write(self, query: str) -> bool:
-        async with self._lock:
-            try:
-                async with self._connection.cursor() as cursor:  # noqa: F841
-                    await cursor.execute(query)
-                    await self._connection.commit()
-                return True
-            except Exception as e:
-                self.sqllogger.error(f"Writing Error: {e}")
-                return False
-
-    async def _read(self, query: str) -> list:
-        async with self._lock:
-            try:
-                async with self._connection.cursor() as cursor:
-                    await cursor.execute(query)
+            
+            # path -> [connection, asyncio.Lock, last use], only touched on the loop
+            self._connections = {}
+            
+            # path -> asyncio.Lock held while the connection is opened, so concurrent first uses open it once
+            self._opening = {}
+            
+            # (path, table) -> columns known to exist, so the schema is only checked once per connection
+            self._schemas = {}
+            
+            # One loop for all connections, aiosqlite runs every connection in its own thread next to it
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run_loop, name="SQLManager", daemon=True)
+            self._thread.start()
+            
+            self._initialized = True
+
+    def _run_loop(self):
+        
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_later(self.IDLE_TIMEOUT / 2, self._schedule_idle_check)
+        self._loop.run_forever()
+    
+    def _schedule_idle_check(self):
+        
+        self._loop.create_task(self._close_idle())
+        self._loop.call_later(self.IDLE_TIMEOUT / 2, self._schedule_idle_check)
+    
+    def _submit(self, coroutine):
+        """Runs a coroutine on the loop of the manager and waits for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _connect(self, path: str) -> list:
+        """Returns the pooled entry of a database, opens the connection on first use."""
+        
+        entry = self._connections.get(path)
+        
+        if entry is None:
+            async with self._opening.setdefault(path, asyncio.Lock()):
+                
+                # Opened by another coroutine while this one waited
+                entry = self._connections.get(path)
+                
+                if entry is None:
+                    # Autocommit, a single statement is its own transaction and needs no extra commit round trip
+                    connection = await aiosqlite.connect(path, isolation_level=None)
+                    
+                    try:
+                        for pragma in self.PRAGMAS:
+                            await connection.execute(pragma)
+                    except Exception:
+                        await connection.close()
+                        raise
+                    
+                    entry = [connection, asyncio.Lock(), time.monotonic()]
+                    self._connections[path] = entry
+                    
+                    self.sqllogger.info(f"Opened connection to {path}.")
+        
+        entry[2] = time.monotonic()
+        
+        return entry
+
+    async def _write(self, path: str, query: str) -> bool:
+        try:
+            connection, lock, _ = await self._connect(path)
+            
+            async with lock:
+                await connection.execute(query)
+            return True
+        except Exception as e:
+            self.sqllogger.error(f"Writing Error: {e}")
+            return False
+
+    async def _read(self, path: str, query: str) -> list:
+        try:
+            connection, lock, _ = await self._connect(path)
+            
+            async with lock:
+                async with connection.execute(query) as cursor:
                     result = await cursor.fetchall()
-                return result
-            except Exception as e:
-                self.sqllogger.error(f"Reading Error: {e}")
-                return []
-
-    async def _disconnect(self):
-        async with self._lock:
-            try:
-                if self._connection:
-                    await self._connection.close()
-                    self._connection = None
-            except Exception as e:
-                self.sqllogger.error(f"Error disconnecting: {e}")
+            return result
+        except Exception as e:
+            self.sqllogger.error(f"Reading Error: {e}")
+            return []
+
+    async def _write_many(self, path: str, table_name: str, columns: list, types: list, values: list) -> bool:
+        try:
+            connection, lock, _ = await self._connect(path)
+            
+            async with lock:
+                await connection.execute("BEGIN")
+                
+                try:
+                    await self._ensure_schema(connection, path, table_name, columns, types)
+                    
+                    names = ", ".join(f'"{column}"' for column in columns)
+                    placeholders = ", ".join("?" * len(columns))
+                    await connection.executemany(f'INSERT INTO "{table_name}" ({names}) VALUES ({placeholders});', values)
+                    
+                    await connection.execute("COMMIT")
+                    
+                except Exception:
+                    await connection.execute("ROLLBACK")
+                    raise
+                
+            return True
+        except Exception as e:
+            self.sqllogger.error(f"Writing Error: {e}")
+            return False
+    
+    async def _ensure_schema(self, connection, path: str, table_name: str, columns: list, types: list) -> None:
+        """Creates the table, or adds the columns it does not have yet."""
+        
+        known = self._schemas.get((path, table_name))
+        
+        if known is not None and known.issuperset(columns):
+            return
+        
+        definitions = ", ".join(f'"{column}" {sql_type}' for column, sql_type in zip(columns, types))
+        await connection.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}" ({definitions});')
+        
+        async with connection.execute(f'PRAGMA table_info("{table_name}")') as cursor:
+            known = {info[1] for info in await cursor.fetchall()}
+        
+        for column, sql_type in zip(columns, types):
+            if column not in known:
+                await connection.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{column}" {sql_type};')
+                known.add(column)
+        
+        self._schemas[(path, table_name)] = known
+    
+    async def _create_table(self, path: str, table_name: str, columns: dict, indexes: list) -> bool:
+        try:
+            connection, lock, _ = await self._connect(path)
+            
+            async with lock:
+                await connection.execute("BEGIN")
+                
+                try:
+                    definitions = ", ".join(f'"{column}" {sql_type}' for column, sql_type in columns.items())
+                    await connection.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}" ({definitions});')
+                    
+                    for index in indexes:
+                        name = "_".join(["idx", table_name, *index])
+                        names = ", ".join(f'"{column}"' for column in index)
+                        await connection.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table_name}" ({names});')
+                    
+                    await connection.execute("COMMIT")
+                    
+                except Exception:
+                    await connection.execute("ROLLBACK")
+                    raise
+                
+                # An existing table may still lack columns, they are added by the next write
+                async with connection.execute(f'PRAGMA table_info("{table_name}")') as cursor:
+                    self._schemas[(path, table_name)] = {info[1] for info in await cursor.fetchall()}
+                
+            return True
+        except Exception as e:
+            self.sqllogger.error(f"Error creating table {table_name}: {e}")
+            return False
+    
+    async def _disconnect(self, path: str):
+        
+        entry = self._connections.pop(path, None)
+        self._schemas = {key: columns for key, columns in self._schemas.items() if key[0] != path}
+        
+        if entry is None:
+            return
+        
+        connection, lock, _ = entry
+        
+        try:
+            async with lock:
+                # Closing the last connection also checkpoints the WAL into the .db file
+                await connection.close()
+            self.sqllogger.info(f"Closed connection to {path}.")
+        except Exception as e:
+            self.sqllogger.error(f"Error disconnecting: {e}")
+    
+    async def _close(self, path: str = None):
+        
+        for path in [path] if path is not None else list(self._connections):
+            await self._disconnect(path)
+    
+    async def _close_idle(self):
+        
+        now = time.monotonic()
+        
+        for path in [path for path, entry in self._connections.items() if now - entry[2] > self.IDLE_TIMEOUT]:
+            await self._disconnect(path)
+    
+    async def _checkpoint(self, path: str):
+        
+        entry = self._connections.get(path)
+        
+        if entry is None:
+            return
+        
+        connection, lock, _ = entry
+        
+        try:
+            async with lock:
+                await connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception as e:
+            self.sqllogger.error(f"Error in checkpoint: {e}")
 
     def read_or_write(self, path, query, task):
         """This is the main interactable that does reading/writing with automatic file access generation. Nothing to be done just call this.
@@ -87,38 +284,127 @@ class SQLManager:
         """
         try:
             if task == "write":
-                if os.path.exists(path):
-                    self.file_manager.get_access(path)
-                    asyncio.run(self._sql_handler(path, query, task))
-                    self.file_manager.release_access(path)
-                else:
-                    asyncio.run(self._sql_handler(path, query, task))
+                with self.file_manager.access(path, FileAccessManager.Mode.WRITE, self.ACCESS_TIMEOUT):
+                    self._submit(self._write(path, query))
             elif task == "read":
-                self.file_manager.get_access(path)
-                result = asyncio.run(self._sql_handler(path, query, task))
-                self.file_manager.release_access(path)
-                return result
+                # Readers of the same file do not wait for each other
+                with self.file_manager.access(path, FileAccessManager.Mode.READ, self.ACCESS_TIMEOUT):
+                    return self._submit(self._read(path, query))
         except Exception as e:   
             self.sqllogger.error(f"Error in writing: {e}.")
+    
+    def write_rows(self, path: str, table_name: str, rows, columns: list = None) -> bool:
+        """Writes many rows in one transaction with bound parameters. The table is created from the first row if
+        it does not exist and missing columns are added.
 
+        Args:
+            path (str): path to the .db file
+            table_name (str): any name
+            rows (list | np.ndarray | DataFrame): dicts, lists with columns, a NumPy (structured) array or a pandas DataFrame
+            columns (list, optional): column names for lists and plain arrays. Defaults to None.
 
-    async def _sql_handler(self, path, query, action):
-        """This is the actual async funtions thats executed."""
+        Returns:
+            bool: True if the rows were written
+        """
+        try:
+            columns, values = self._rows_to_values(rows, columns)
+            
+            if not values:
+                return True
+            
+            # The type of a column comes from its first value that is not NULL
+            types = [self._infer_sql_type(next((row[i] for row in values if row[i] is not None), None)) for i in range(len(columns))]
+            
+            with self.file_manager.access(path, FileAccessManager.Mode.WRITE, self.ACCESS_TIMEOUT):
+                return self._submit(self._write_many(path, table_name, columns, types, values))
+        
+        except Exception as e:
+            self.sqllogger.error(f"Error in writing rows: {e}.")
+            return False
+    
+    def create_table(self, path: str, table_name: str, columns: dict, indexes: list = None) -> bool:
+        """Creates a table with declared column types and its indexes, if they do not exist yet. Rows written
+        afterwards with write_rows keep these types.
 
-        await self._connect(path)
+        Args:
+            path (str): path to the .db file
+            table_name (str): any name
+            columns (dict): column name -> SQL type, e.g. {"Image": "TEXT", "Area": "REAL"}
+            indexes (list, optional): one list of column names per index. Defaults to None.
 
-        if action == "write":
-            await self._write(query)
+        Returns:
+            bool: True if the table and indexes exist
+        """
+        try:
+            with self.file_manager.access(path, FileAccessManager.Mode.WRITE, self.ACCESS_TIMEOUT):
+                return self._submit(self._create_table(path, table_name, columns, indexes or []))
+        
+        except Exception as e:
+            self.sqllogger.error(f"Error in creating table: {e}.")
+            return False
+    
+    @staticmethod
+    def _rows_to_values(rows, columns: list = None) -> tuple:
+        """Converts the supported row formats into (columns, list of tuples of Python values)."""
+        
+        # pandas DataFrame
+        if hasattr(rows, "itertuples") and hasattr(rows, "columns"):
+            columns = [str(column) for column in rows.columns]
+            rows = rows.itertuples(index=False, name=None)
+        
+        # NumPy structured array
+        elif isinstance(rows, np.ndarray) and rows.dtype.names:
+            columns = list(rows.dtype.names)
+            rows = rows.tolist()
+        
+        elif isinstance(rows, np.ndarray):
+            rows = rows.reshape(len(rows), -1).tolist()
+        
+        rows = list(rows)
+        
+        if rows and isinstance(rows[0], dict):
+            # All keys in order of appearance, rows without a key get NULL
+            columns = columns or list(dict.fromkeys(key for row in rows for key in row))
+            rows = [[row.get(column) for column in columns] for row in rows]
+        
+        if rows and not columns:
+            raise ValueError("Columns are needed for rows without names")
+        
+        return columns, [tuple(SQLManager._sql_value(value) for value in row) for row in rows]
+    
+    @staticmethod
+    def _sql_value(value):
+        
+        if isinstance(value, np.generic):
+            return value.item()
+        
+        # Stored as TEXT, like in generate_sql_statements
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return str(list(value))
+        
+        return value
+    
+    def checkpoint(self, path: str) -> None:
+        """Moves all changes from the WAL into the .db file, e.g. before the file is copied.
 
-        elif action == "read":
-            result = await self._read(query)
-            await self._disconnect()
-            return result
+        Args:
+            path (str): path to the .db file
+        """
+        self._submit(self._checkpoint(path))
+    
+    def close(self, path: str = None) -> None:
+        """Closes the connection to a database, e.g. before the file is moved or deleted.
 
-        await self._disconnect()
+        Args:
+            path (str, optional): path to the .db file. Defaults to None (all connections).
+        """
+        self._submit(self._close(path))
 
     def _infer_sql_type(self, value):
 
+        if isinstance(value, np.generic):
+            value = value.item()
+
         if isinstance(value, int):
             return "INT"
         elif isinstance(value, float):
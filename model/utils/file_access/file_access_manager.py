@@ -1,54 +1,247 @@
+import os
 import threading
-import queue
+import time
+from collections import deque
+from contextlib import contextmanager
+from enum import Enum
 
 from operator_mod.logger.global_logger import Logger
 
+class _PathLock:
+    """State of one path, only touched while holding the mutex of the FileAccessManager."""
+
+    def __init__(self, mutex: threading.Lock) -> None:
+
+        self.condition = threading.Condition(mutex)
+
+        # Tickets of the waiting threads in order of arrival, access is granted from the front only
+        self.queue = deque()
+
+        # thread -> depth of the readers, the writer and its depth
+        self.readers = {}
+        self.writer = None
+        self.writer_depth = 0
+
+        self.stats = {
+            "Reads": 0,
+            "Writes": 0,
+            "Contended": 0,
+            "Timeouts": 0,
+            "WaitTotal": 0.0,
+            "WaitMax": 0.0
+        }
+
+    def grantable(self, ticket: list) -> bool:
+        """Checks if the ticket is next in line and compatible with the current holders."""
+
+        if self.queue[0] is not ticket or self.writer is not None:
+            return False
+
+        return ticket[0] is FileAccessManager.Mode.READ or not self.readers
+
 class FileAccessManager:
-    
+    """Fair reader/writer locks per file path, shared by everything that touches files of the project.
+    Readers of a path run next to each other, a writer has it alone. Access is granted in order of arrival,
+    so readers do not starve a waiting writer and the other way round. The same thread may request a path
+    again, e.g. a read while it writes.
+
+    Integration:
+        fam = FileAccessManager()
+        with fam.access(path, FileAccessManager.Mode.READ, timeout=5):
+            shutil.copyfile(path, copy)
+        fam.get_stats()   # {path: {"Reads": 3, "Contended": 1, "WaitAvg": s, ...}}
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    class Mode(Enum):
+        READ = "read"
+        WRITE = "write"
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(FileAccessManager, cls).__new__(cls)
+        return cls._instance
+
     def __init__(self):
-        self.locks = {}
-        self.queues = {}
-        self.global_lock = threading.Lock()
-        self.logger = Logger("FileAccessManager").logger
-        self.logger.info("FileAccessManager initialized.")
-
-    def get_access(self, path):
-        self.logger.info(f"Requesting access for {path} by {threading.current_thread().name}")
-        with self.global_lock:
-            if path not in self.locks:
-                self.locks[path] = threading.Lock()
-                self.queues[path] = queue.Queue()
-                self.logger.info(f"Created new lock and queue for {path}")
-
-        file_lock = self.locks[path]
-        file_queue = self.queues[path]
-        
-        file_queue.put(threading.current_thread())
-        self.logger.info(f"{threading.current_thread().name} added to queue for {path}")
-
-        while file_queue.queue[0] is not threading.current_thread():
-            pass
-        
-        file_lock.acquire()
-        self.logger.info(f"{threading.current_thread().name} acquired lock for {path}")
-
-    def release_access(self, path):
-        self.logger.info(f"Releasing access for {path} by {threading.current_thread().name}")
-        with self.global_lock:
-            if path in self.locks:
-                file_lock = self.locks[path]
-                file_queue = self.queues[path]
-                
-                if file_lock.locked():
-                    file_lock.release()
-                    self.logger.info(f"{threading.current_thread().name} released lock for {path}")
-                    file_queue.get()
-                    self.logger.info(f"{threading.current_thread().name} removed from queue for {path}")
-
-    def __del__(self):
-        self.logger.info("FileAccessManager is being destroyed. Releasing all locks.")
-        # Ensure all locks are released when the manager is destroyed
-        for path, lock in self.locks.items():
-            if lock.locked():
-                lock.release()
-                print(f"Released lock for {path}")
\ No newline at end of file
+
+        with self._lock:
+            if hasattr(self, '_initialized'):
+                return
+
+            self.logger = Logger("FileAccessManager").logger
+
+            # One mutex for all paths, every path waits on its own condition
+            self._mutex = threading.Lock()
+            self._paths = {}
+
+            self._initialized = True
+
+    @staticmethod
+    def _key(path: str) -> str:
+        # Different spellings of the same file share one lock
+        return os.path.normcase(os.path.abspath(path))
+
+    def get_access(self, path: str, mode: "FileAccessManager.Mode" = Mode.WRITE, timeout: float = None) -> bool:
+        """Waits for access to a file. Every granted access needs a release_access of the same thread.
+
+        Args:
+            path (str): file path
+            mode (FileAccessManager.Mode, optional): READ is shared with other readers, WRITE is exclusive. Defaults to Mode.WRITE.
+            timeout (float, optional): seconds to wait. Defaults to None (no limit).
+
+        Raises:
+            RuntimeError: if a thread holding read access requests write access, it would wait for itself
+
+        Returns:
+            bool: True if access was granted, False on timeout
+        """
+        thread = threading.get_ident()
+
+        with self._mutex:
+            entry = self._paths.get(self._key(path))
+
+            if entry is None:
+                entry = self._paths[self._key(path)] = _PathLock(self._mutex)
+
+            # Reentrant requests are granted right away
+            if entry.writer == thread:
+                entry.writer_depth += 1
+                return True
+
+            if thread in entry.readers:
+                if mode is self.Mode.WRITE:
+                    raise RuntimeError(f"Read access to {path} can not be upgraded to write access.")
+
+                entry.readers[thread] += 1
+                return True
+
+            ticket = [mode]
+            entry.queue.append(ticket)
+
+            start = time.perf_counter()
+            contended = not entry.grantable(ticket)
+
+            while not entry.grantable(ticket):
+                remaining = None if timeout is None else start + timeout - time.perf_counter()
+
+                if remaining is not None and remaining <= 0:
+                    entry.queue.remove(ticket)
+                    entry.stats["Timeouts"] += 1
+
+                    # The ticket may have blocked the ones behind it
+                    entry.condition.notify_all()
+
+                    self.logger.warning(f"No {mode.value} access to {path} within {timeout} s.")
+                    return False
+
+                entry.condition.wait(remaining)
+
+            entry.queue.popleft()
+
+            if mode is self.Mode.WRITE:
+                entry.writer = thread
+                entry.writer_depth = 1
+                entry.stats["Writes"] += 1
+            else:
+                entry.readers[thread] = 1
+                entry.stats["Reads"] += 1
+
+                # The next one in line may be a reader as well
+                if entry.queue:
+                    entry.condition.notify_all()
+
+            if contended:
+                wait = time.perf_counter() - start
+
+                entry.stats["Contended"] += 1
+                entry.stats["WaitTotal"] += wait
+                entry.stats["WaitMax"] = max(entry.stats["WaitMax"], wait)
+
+                self.logger.debug(f"Waited {wait * 1000:.1f} ms for {mode.value} access to {path}.")
+
+            return True
+
+    def release_access(self, path: str) -> None:
+        """Releases the access of the current thread to a file. Does nothing if it holds none.
+
+        Args:
+            path (str): file path
+        """
+        thread = threading.get_ident()
+
+        with self._mutex:
+            entry = self._paths.get(self._key(path))
+
+            if entry is None:
+                return
+
+            if entry.writer == thread:
+                entry.writer_depth -= 1
+
+                if entry.writer_depth == 0:
+                    entry.writer = None
+
+            elif thread in entry.readers:
+                entry.readers[thread] -= 1
+
+                if entry.readers[thread] == 0:
+                    del entry.readers[thread]
+
+            else:
+                return
+
+            if entry.queue and entry.writer is None:
+                entry.condition.notify_all()
+
+    @contextmanager
+    def access(self, path: str, mode: "FileAccessManager.Mode" = Mode.WRITE, timeout: float = None):
+        """Context manager around get_access and release_access.
+
+        Args:
+            path (str): file path
+            mode (FileAccessManager.Mode, optional): READ or WRITE. Defaults to Mode.WRITE.
+            timeout (float, optional): seconds to wait. Defaults to None (no limit).
+
+        Raises:
+            TimeoutError: if the access was not granted in time
+        """
+        if not self.get_access(path, mode, timeout):
+            raise TimeoutError(f"No {mode.value} access to {path} within {timeout} s")
+
+        try:
+            yield
+        finally:
+            self.release_access(path)
+
+    def get_stats(self, path: str = None) -> dict:
+        """Returns the contention statistics of the paths.
+
+        Args:
+            path (str, optional): only this path. Defaults to None (all paths).
+
+        Returns:
+            dict: path -> "Reads" and "Writes" granted, "Contended" of them had to wait, "Timeouts", "WaitAvg" and
+                "WaitMax" of the contended ones in s, currently "Waiting" threads, "Readers" and "Writer" (bool)
+        """
+        with self._mutex:
+            keys = [self._key(path)] if path is not None else list(self._paths)
+
+            stats = {}
+            for key in keys:
+                entry = self._paths.get(key)
+
+                if entry is None:
+                    continue
+
+                metrics = dict(entry.stats)
+                metrics["WaitAvg"] = metrics.pop("WaitTotal") / metrics["Contended"] if metrics["Contended"] else 0.0
+                metrics["Waiting"] = len(entry.queue)
+                metrics["Readers"] = len(entry.readers)
+                metrics["Writer"] = entry.writer is not None
+
+                stats[key] = metrics
+
+        return stats
@@ -86,11 +86,17 @@ class InMemoryData:
         
         PELLET_SIZER_IMAGES = "PelletSizerImages"
         PELLET_SIZER_IMAGE_SETTINGS = "PelletSizerImageSettings"
+        PELLET_SIZER_THRESHOLD_MODE = "PelletSizerThresholdMode"
         PELLET_SIZER_RESULT = "PelletSizerResult"
+        PELLET_SIZER_RESULT_DB = "PelletSizerResultDB"
+        PELLET_SIZER_USE_CACHE = "PelletSizerUseCache"
         
         PELLET_SIZER_WIDGET_REFERENCE = "PelletSizerWidgetReference"
         BUBBLE_SIZER_WIDGET_REFERENCE = "BubbleSizeWidgetReference"
         
+        # Algorithm Manager tasks, kept in the namespace of the task
+        TASK_RESULT = "TaskResult"
+        
     class Namespaces(Enum):
         #CONTROLLER = "Controller"
         DEFAULT = "default"
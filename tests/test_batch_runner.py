@@ -0,0 +1,29 @@
+from controller.algorithms.pellet_sizer.batch_runner import PelletBatchRunner
+
+
+def test_output_names_are_relative_to_the_common_folder(tmp_path):
+
+    paths = [str(tmp_path / "a" / "img1.png"), str(tmp_path / "b" / "img1.png"), str(tmp_path / "b" / "c" / "img2.png")]
+
+    assert PelletBatchRunner.output_names(paths) == ["a_img1", "b_img1", "b_c_img2"]
+
+
+def test_output_names_of_one_folder_are_the_file_names(tmp_path):
+
+    assert PelletBatchRunner.output_names([str(tmp_path / "img1.png"), str(tmp_path / "img2.tif")]) == ["img1", "img2"]
+
+
+def test_colliding_output_names_get_a_suffix(tmp_path):
+
+    # Equal after flattening the folders, or only the extension differs
+    paths = [str(tmp_path / "a_b" / "c.png"), str(tmp_path / "a" / "b_c.png"), str(tmp_path / "a" / "b_c.tif")]
+
+    names = PelletBatchRunner.output_names(paths)
+
+    assert names == ["a_b_c", "a_b_c_2", "a_b_c_3"]
+    assert len(set(names)) == len(paths)
+
+
+def test_output_names_without_paths():
+
+    assert PelletBatchRunner.output_names([]) == []
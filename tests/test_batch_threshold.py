@@ -0,0 +1,55 @@
+import cv2
+import numpy as np
+
+from controller.algorithms.pellet_sizer.batch_threshold import BatchThreshold
+from controller.algorithms.pellet_sizer.benchmark import PelletBenchmark
+
+
+def write_images(folder, count: int) -> list:
+
+    paths = []
+    for seed in range(count):
+        img, _ = PelletBenchmark.synthetic_image(256, "sparse", 8, seed)
+
+        path = str(folder / f"img{seed}.png")
+        cv2.imwrite(path, img)
+        paths.append(path)
+
+    return paths
+
+
+def test_otsu_matches_opencv():
+
+    img, _ = PelletBenchmark.synthetic_image(256, "dense", 8, 3)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+    otsu, _ = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    assert BatchThreshold.otsu(np.bincount(gray.ravel(), minlength=256).astype(np.float64)) == int(otsu)
+
+
+def test_batch_threshold_is_shared_and_manual_thresholds_are_kept(tmp_path):
+
+    paths = write_images(tmp_path, 3)
+    settings = [[-1, "Gaussian", "2X"], [-1, "Gaussian", "2X"], [120, "Gaussian", "2X"]]
+
+    thresholds = BatchThreshold.compute(paths, settings, BatchThreshold.Mode.BATCH)
+
+    assert thresholds[0] is not None and thresholds[0] == thresholds[1]
+    assert thresholds[2] is None
+
+    assert [setting[0] for setting in BatchThreshold.apply(settings, thresholds)] == [thresholds[0], thresholds[0], 120]
+
+
+def test_unreadable_image_is_left_out_of_its_group(tmp_path):
+
+    paths = write_images(tmp_path, 2)
+    settings = [[-1, "Gaussian", "2X"]] * 3
+
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+
+    expected = BatchThreshold.compute(paths, settings[:2], BatchThreshold.Mode.BATCH)
+    thresholds = BatchThreshold.compute(paths + [str(broken)], settings, BatchThreshold.Mode.BATCH)
+
+    assert thresholds == expected + [None]
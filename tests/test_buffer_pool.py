@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from controller.algorithms.pellet_sizer.buffer_pool import BufferPool
+
+
+@pytest.fixture
+def pool():
+
+    pool = BufferPool()
+    pool.clear()
+
+    yield pool
+
+    pool.limit(BufferPool.DEFAULT_MAX_BYTES)
+    pool.clear()
+
+
+def test_released_buffers_are_reused(pool):
+
+    buffer = pool.acquire((64, 64), np.uint8)
+    pool.release(buffer)
+
+    before = pool.stats()
+    assert pool.acquire((64, 64), np.uint8) is buffer
+    assert pool.acquire((64, 64), np.uint16) is not buffer
+
+    assert BufferPool.difference(pool.stats(), before) == {"Allocated": 64 * 64 * 2, "Reused": 64 * 64, "Allocations": 1, "Reuses": 1}
+
+
+def test_views_are_not_kept(pool):
+
+    buffer = pool.acquire((64, 64), np.uint8)
+    pool.release(buffer[:32])
+
+    assert pool.stats()["Free"] == 0
+
+
+def test_limit_drops_free_buffers(pool):
+
+    buffers = [pool.acquire((1024,), np.uint8) for _ in range(4)]
+    for buffer in buffers:
+        pool.release(buffer)
+
+    assert pool.stats()["Free"] == 4096
+
+    pool.limit(2048)
+    assert pool.stats()["Free"] == 2048
+
+    # Above the limit buffers are dropped on release
+    pool.release(np.empty(1024, dtype=np.uint8))
+    assert pool.stats()["Free"] == 2048
+
+
+def test_worker_limit():
+
+    assert BufferPool.worker_limit(None, 4) == BufferPool.DEFAULT_MAX_BYTES
+    assert BufferPool.worker_limit(800 * 1024 ** 2, 4) == 100 * 1024 ** 2
+    assert BufferPool.worker_limit(64 * 1024 ** 3, 2) == BufferPool.DEFAULT_MAX_BYTES
+    assert BufferPool.worker_limit(1000, 0) == 500
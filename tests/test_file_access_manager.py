@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+
+from model.utils.file_access.file_access_manager import FileAccessManager
+
+Mode = FileAccessManager.Mode
+
+
+def hold(path: str, mode: Mode, events: list, name: str, release: threading.Event) -> threading.Thread:
+    """Starts a thread that takes access, records it and holds it until release is set."""
+
+    def run():
+        with FileAccessManager().access(path, mode):
+            events.append(name)
+            release.wait(5)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "condition not reached"
+        time.sleep(0.005)
+
+
+def waiting(path: str) -> int:
+    return next(iter(FileAccessManager().get_stats(path).values()))["Waiting"]
+
+
+def test_readers_share_a_path(tmp_path):
+
+    path = str(tmp_path / "shared.db")
+    events, release = [], threading.Event()
+
+    threads = [hold(path, Mode.READ, events, f"reader{i}", release) for i in range(3)]
+    wait_for(lambda: len(events) == 3)
+
+    assert next(iter(FileAccessManager().get_stats(path).values()))["Readers"] == 3
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+
+def test_access_is_granted_in_order_of_arrival(tmp_path):
+
+    path = str(tmp_path / "ordered.db")
+    events = []
+    first, rest = threading.Event(), threading.Event()
+
+    threads = [hold(path, Mode.READ, events, "reader", first)]
+    wait_for(lambda: events == ["reader"])
+
+    # A reader arriving after a waiting writer does not overtake it
+    threads.append(hold(path, Mode.WRITE, events, "writer", rest))
+    wait_for(lambda: waiting(path) == 1)
+
+    threads.append(hold(path, Mode.READ, events, "late reader", rest))
+    wait_for(lambda: waiting(path) == 2)
+
+    first.set()
+    wait_for(lambda: len(events) == 2)
+    assert events == ["reader", "writer"]
+
+    rest.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert events == ["reader", "writer", "late reader"]
+
+
+def test_timeout(tmp_path):
+
+    path = str(tmp_path / "busy.db")
+    events, release = [], threading.Event()
+
+    thread = hold(path, Mode.WRITE, events, "writer", release)
+    wait_for(lambda: events == ["writer"])
+
+    fam = FileAccessManager()
+    assert fam.get_access(path, Mode.READ, timeout=0.05) is False
+
+    with pytest.raises(TimeoutError):
+        with fam.access(path, Mode.WRITE, timeout=0.05):
+            pass
+
+    stats = next(iter(fam.get_stats(path).values()))
+    assert stats["Timeouts"] == 2
+    assert stats["Waiting"] == 0
+
+    release.set()
+    thread.join(5)
+
+    # The path is free again after the timeouts
+    assert fam.get_access(path, Mode.WRITE, timeout=1)
+    fam.release_access(path)
+
+
+def test_reentrant_access_and_upgrade(tmp_path):
+
+    path = str(tmp_path / "reentrant.db")
+    fam = FileAccessManager()
+
+    with fam.access(path, Mode.WRITE, timeout=1):
+        with fam.access(path, Mode.READ, timeout=1):
+            pass
+
+        # Still held by the outer access
+        assert next(iter(fam.get_stats(path).values()))["Writer"]
+
+    with fam.access(path, Mode.READ, timeout=1):
+        with pytest.raises(RuntimeError):
+            fam.get_access(path, Mode.WRITE, timeout=1)
+
+    stats = next(iter(fam.get_stats(path).values()))
+    assert not stats["Writer"] and stats["Readers"] == 0
@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+from controller.algorithms.algorithm_manager_class.abc_class.state_machine_template import Manager
+
+
+class RecordingState:
+    """Stand-in for a state, records its run and blocks until it is released or terminated."""
+
+    def __init__(self, manager, runtime, task_id) -> None:
+        self.manager = manager
+        self.task_id = task_id
+        self.result = None
+        self._stop = threading.Event()
+
+    def run(self) -> None:
+        self.manager.started.append(self.task_id)
+        self.manager.running.set()
+
+        if self.manager.block_next.is_set():
+            self.manager.block_next.clear()
+            self._stop.wait(5)
+
+        self.result = self.task_id
+
+    def terminate(self) -> None:
+        self.manager.terminated.append(self.task_id)
+        self._stop.set()
+
+
+@pytest.fixture
+def manager():
+
+    class TestManager(Manager):
+        _instance = None
+        MAX_RUNNING_STATES = 1
+
+        state_classes = {0: RecordingState}
+
+    manager = TestManager()
+    manager.started, manager.terminated = [], []
+    manager.running, manager.block_next = threading.Event(), threading.Event()
+
+    yield manager
+
+    manager.shutdown()
+
+
+def run_blocking(manager) -> int:
+    """Takes the only place of the manager with a task that runs until it is terminated."""
+
+    manager.block_next.set()
+    task_id = manager.add_task(0, 0)
+
+    assert manager.running.wait(5)
+    return task_id
+
+
+def test_tasks_run_by_priority_then_submission_order(manager):
+
+    blocking = run_blocking(manager)
+
+    done = threading.Semaphore(0)
+    callback = lambda task_id, result: done.release()
+
+    low = manager.add_task(0, 0, Manager.Priority.LOW, callback=callback)
+    normal = manager.add_task(0, 0, Manager.Priority.NORMAL, callback=callback)
+    high = manager.add_task(0, 0, Manager.Priority.HIGH, callback=callback)
+    normal_later = manager.add_task(0, 0, Manager.Priority.NORMAL, callback=callback)
+
+    assert manager.get_metrics()["Depth"] == 4
+
+    manager.cancel_task(blocking)
+    for _ in range(4):
+        assert done.acquire(timeout=5)
+
+    assert manager.started == [blocking, high, normal, normal_later, low]
+
+
+def test_cancel_queued_and_running_tasks(manager):
+
+    blocking = run_blocking(manager)
+
+    done = threading.Event()
+    queued = manager.add_task(0, 0)
+    last = manager.add_task(0, 0, callback=lambda task_id, result: done.set())
+
+    # A queued task is dropped, a running one is terminated
+    assert manager.cancel_task(queued)
+    assert manager.cancel_task(blocking)
+    assert done.wait(5)
+
+    assert manager.started == [blocking, last]
+    assert manager.terminated == [blocking]
+    assert not manager.cancel_task(queued)
+
+    metrics = manager.get_metrics()
+    assert metrics["Cancelled"] == 2 and metrics["Depth"] == 0
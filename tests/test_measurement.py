@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+import pytest
+
+from controller.algorithms.pellet_sizer.steps.measurement import Measurement
+
+
+def random_contours(seed: int) -> list:
+
+    rng = np.random.default_rng(seed)
+    mask = np.zeros((400, 400), dtype=np.uint8)
+
+    for _ in range(40):
+        center = tuple(int(v) for v in rng.integers(0, 400, 2))
+        axes = tuple(int(v) for v in rng.integers(1, 30, 2))
+        cv2.ellipse(mask, center, axes, float(rng.uniform(0, 180)), 0, 360, 255, -1)
+
+    # Single pixels and lines give contours with one and two points
+    mask[rng.integers(0, 400, 20), rng.integers(0, 400, 20)] = 255
+    cv2.line(mask, (10, 390), (60, 390), 255, 1)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_measure_matches_opencv(seed):
+
+    contours = random_contours(seed)
+    table = Measurement.measure(contours)
+
+    assert len(table) == len(contours)
+    assert np.isnan(table["feret_max"]).all()
+
+    for row, contour in zip(table, contours):
+        assert row["points"] == len(contour)
+        assert (row["x"], row["y"], row["w"], row["h"]) == cv2.boundingRect(contour)
+        assert row["area"] == pytest.approx(cv2.contourArea(contour))
+        assert row["arc_length"] == pytest.approx(cv2.arcLength(contour, True))
+
+
+def test_measure_feret_matches_opencv():
+
+    contours = random_contours(0)
+    table = Measurement.measure_feret(contours, Measurement.measure(contours))
+
+    for row, contour in zip(table, contours):
+        assert row["feret_max"] == pytest.approx(max(cv2.minAreaRect(cv2.convexHull(contour))[1]))
+
+
+def test_measure_without_contours():
+
+    assert len(Measurement.measure([])) == 0
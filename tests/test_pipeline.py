@@ -0,0 +1,22 @@
+import numpy as np
+
+from controller.algorithms.pellet_sizer.benchmark import PelletBenchmark
+from controller.algorithms.pellet_sizer.steps.pipeline import PreprocessingPipeline
+from controller.algorithms.pellet_sizer.steps.processing import Processor
+
+
+def test_native_depth_with_morphology_gives_8bit_mask():
+
+    img, truth = PelletBenchmark.synthetic_image(512, "sparse", 16, 0)
+
+    pipeline = PreprocessingPipeline.from_settings([-1, "Gaussian", "2X", [
+        {"stage": "depth", "native": True},
+        {"stage": "blur", "kind": "gaussian", "ksize": 5},
+        {"stage": "threshold"},
+        {"stage": "morphology", "op": "open", "ksize": 3}
+    ]])
+
+    binary = pipeline.process(img)
+
+    assert binary.dtype == np.uint8
+    assert len(Processor(binary).process()) == len(truth)
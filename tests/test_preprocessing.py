@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+import pytest
+
+from controller.algorithms.pellet_sizer.benchmark import PelletBenchmark
+from controller.algorithms.pellet_sizer.steps.preprocessing import Preprocessor
+
+
+@pytest.fixture(scope="module")
+def image_path(tmp_path_factory):
+
+    img, _ = PelletBenchmark.synthetic_image(1500, "dense", 8, 1)
+
+    path = str(tmp_path_factory.mktemp("images") / "pellets.png")
+    cv2.imwrite(path, img)
+
+    return path
+
+
+@pytest.mark.parametrize("blur", ["Gaussian", "Median", "Stacked", "None"])
+@pytest.mark.parametrize("tile_size", [256, 700])
+def test_tiled_equals_full_image(image_path, blur, tile_size):
+
+    settings = [-1, blur, "2X", [{"stage": "blur", "kind": blur.lower(), "ksize": 5}, {"stage": "threshold"}]]
+
+    full = Preprocessor(image_path, settings)
+    full_binary = full.process(tiled=False)
+
+    tiled = Preprocessor(image_path, settings)
+    tiled.bits = tiled.pipeline.bit_depth(cv2.imread(image_path, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH))
+    tiled_binary = tiled.process_tiled(cv2.imread(image_path, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH), tile_size)
+
+    assert tiled.threshold_value == full.threshold_value
+    assert np.array_equal(tiled_binary, full_binary)
+
+
+def test_unreadable_image_raises(tmp_path):
+
+    path = tmp_path / "broken.png"
+    path.write_bytes(b"not an image")
+
+    with pytest.raises(ValueError, match="Could not read image"):
+        Preprocessor(str(path), [-1, "Gaussian", "2X"]).process()
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+
+from controller.algorithms.pellet_sizer.result_cache import ResultCache
+
+
+def entry_size(tmp_path) -> int:
+
+    cache = ResultCache(str(tmp_path / "probe"))
+    cache.put("probe", [[1.0, 2.0]] * 10)
+
+    return os.path.getsize(cache._entry_path("probe"))
+
+
+def test_put_and_get(tmp_path):
+
+    cache = ResultCache(str(tmp_path / "cache"))
+    mask = np.zeros((8, 8), dtype=np.uint8)
+
+    cache.put("key", [[1.0, 2.0]], mask, 120.0)
+
+    pixels, stored_mask, threshold = cache.get("key")
+    assert pixels == [[1.0, 2.0]] and threshold == 120.0
+
+    # Masks are only stored when asked for
+    assert stored_mask is None
+    assert cache.get("key", need_mask=True) is None
+    assert cache.get("missing") is None
+
+
+def test_masks_are_stored_with_store_masks(tmp_path):
+
+    cache = ResultCache(str(tmp_path / "cache"), store_masks=True)
+    mask = np.eye(8, dtype=np.uint8) * 255
+
+    cache.put("key", [[1.0]], mask)
+
+    assert np.array_equal(cache.get("key", need_mask=True)[1], mask)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+
+    size = entry_size(tmp_path)
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=int(size * 3.5))
+
+    for i in range(3):
+        cache.put(f"key{i}", [[1.0, 2.0]] * 10)
+        os.utime(cache._entry_path(f"key{i}"), (1000 + i, 1000 + i))
+
+    # A hit makes the oldest entry the most recent one
+    assert cache.get("key0") is not None
+
+    cache.put("key3", [[1.0, 2.0]] * 10)
+
+    assert cache.get("key1") is None
+    assert all(cache.get(key) is not None for key in ("key0", "key2", "key3"))
+
+    cache.clear()
+    assert cache.get("key0") is None
+
+
+def test_directory_is_not_scanned_on_every_put(tmp_path, monkeypatch):
+
+    cache = ResultCache(str(tmp_path / "cache"))
+
+    scans = []
+    evict = ResultCache.evict
+    monkeypatch.setattr(ResultCache, "evict", lambda self: scans.append(1) or evict(self))
+
+    for i in range(200):
+        cache.put(f"key{i}", [[float(i)]])
+
+    # One scan for the first put, then one per SCAN_INTERVAL puts
+    assert len(scans) == 1 + 200 // ResultCache.SCAN_INTERVAL
@@ -0,0 +1,66 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from model.utils.SQL.sql_manager import SQLManager
+
+
+@pytest.fixture
+def db(tmp_path):
+
+    path = str(tmp_path / "test.db")
+    yield path
+
+    SQLManager().close(path)
+
+
+def column_types(path: str, table_name: str) -> dict:
+    return {info[1]: info[2] for info in SQLManager().read_or_write(path, f'PRAGMA table_info("{table_name}")', "read")}
+
+
+def test_write_rows_with_mixed_keys(db):
+
+    sql = SQLManager()
+
+    # The second row brings a column the first one does not have, its NULLs come first
+    assert sql.write_rows(db, "Mixed", [{"Image": "a.png", "Area": 1.5}, {"Image": "b.png", "Area": 2.0, "Count": 3}])
+
+    assert column_types(db, "Mixed") == {"Image": "VARCHAR(255)", "Area": "REAL", "Count": "INT"}
+    assert sql.read_or_write(db, 'SELECT "Image", "Area", "Count" FROM "Mixed"', "read") == [("a.png", 1.5, None), ("b.png", 2.0, 3)]
+
+
+def test_write_rows_types_from_first_value_that_is_not_null(db):
+
+    sql = SQLManager()
+
+    assert sql.write_rows(db, "NullFirst", [[None, None], [None, 2], [0.5, 3]], columns=["Ratio", "Count"])
+
+    assert column_types(db, "NullFirst") == {"Ratio": "REAL", "Count": "INT"}
+
+
+def test_write_rows_adds_columns_to_existing_table(db):
+
+    sql = SQLManager()
+
+    table = np.zeros(2, dtype=[("Id", np.int32), ("Area", np.float64)])
+    table["Id"] = [1, 2]
+
+    assert sql.write_rows(db, "Grow", table)
+    assert sql.write_rows(db, "Grow", [{"Id": 3, "Area": 1.0, "Label": "x"}])
+
+    assert column_types(db, "Grow") == {"Id": "INT", "Area": "REAL", "Label": "VARCHAR(255)"}
+    assert sql.read_or_write(db, 'SELECT "Id", "Label" FROM "Grow" ORDER BY "Id"', "read") == [(1, None), (2, None), (3, "x")]
+
+
+def test_concurrent_first_uses_open_one_connection(db):
+
+    sql = SQLManager()
+
+    async def connect_twice():
+        return await asyncio.gather(sql._connect(db), sql._connect(db))
+
+    first, second = sql._submit(connect_twice())
+
+    assert first is second
+    assert sql._connections[db] is first
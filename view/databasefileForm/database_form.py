@@ -60,7 +60,11 @@ class DataBaseForm(QWidget):
             # Create a new temp file path and copy database
             fd, self.new_temp_path = tempfile.mkstemp(suffix=".sqlite")
             os.close(fd)  # Close the file descriptor since we only need the path
-            self.file_access.get_access(self.path)
+            # Copying only reads the file, the SQLManager may read it at the same time
+            self.file_access.get_access(self.path, FileAccessManager.Mode.READ)
+            
+            # Recent writes are still in the WAL of the pooled connection
+            self.sql.checkpoint(self.path)
             shutil.copyfile(self.path, self.new_temp_path)
             
             if self.db is None:
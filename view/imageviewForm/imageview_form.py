@@ -5,6 +5,8 @@ from PySide6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsPixmapItem
 from PySide6.QtGui import QImage, QPixmap, QCloseEvent
 from PySide6.QtCore import Qt
 
+from controller.algorithms.pellet_sizer.bit_depth import BitDepth
+
 class ImageViewer(QWidget):
 
     def __init__(self, path) -> None:
@@ -39,10 +41,9 @@ class ImageViewer(QWidget):
         # Loading the actual image with 16-bit depth
         image = cv2.imread(self.path, cv2.IMREAD_ANYDEPTH | cv2.IMREAD_COLOR)
         
-        # Normalize the 12-bit image to 8-bit
-        if image is not None and image.dtype == 'uint16':
-            # Assuming the image is 12-bit
-            image = (image / 16).astype('uint8')
+        # Shift high bit depth images (e.g. 12-bit) to 8-bit
+        if image is not None:
+            image = BitDepth.to_8bit(image)
 
         # Convert the image from BGR (OpenCV) to RGB (Qt)
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -1,16 +1,20 @@
 
 from PySide6.QtWidgets import QWidget, QHBoxLayout, QVBoxLayout, QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QSlider, QGridLayout, QLabel, QPushButton, QComboBox, QCheckBox
 from PySide6.QtCore import Qt, QSize, QTimer
-from PySide6.QtGui import QImage, QPixmap, QResizeEvent
+from PySide6.QtGui import QImage, QPixmap, QResizeEvent, QShowEvent
 import cv2
 
+from controller.algorithms.pellet_sizer.bit_depth import BitDepth
+from controller.algorithms.pellet_sizer.steps.overlay import Overlay
+from controller.algorithms.pellet_sizer.steps.pipeline import PreprocessingPipeline
+
 class ImageDisplay(QWidget):
     
-    def __init__(self, image: str | list):
+    def __init__(self, image: str | list | Overlay):
         """A view on an image.
 
         Args:
-            image (str | MatLike): path to an image or the iamge itself
+            image (str | MatLike | Overlay): path to an image, the iamge itself or an overlay that is rendered when shown
             settings (list) : an settings list to be used on this image
         """
         super().__init__()
@@ -18,12 +22,17 @@ class ImageDisplay(QWidget):
         self.img = None
         self.img_item = None
         self.path = None
+        self.overlay = None
         
         if type(image) is str:
                     
             self.path = image
             self.img = cv2.imread(image, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
             
+        elif isinstance(image, Overlay):
+            # Rendered when the display is shown for the first time
+            self.overlay = image
+            
         else:
             self.img = image
         
@@ -42,10 +51,8 @@ class ImageDisplay(QWidget):
         self.img_scene.addItem(self.img_item)
         
         if self.img is not None:
-            # Normalize the 12-bit image to 8-bit
-            if self.img.dtype == 'uint16':
-                # Assuming the image is 12-bit
-                self.img = (self.img / 16).astype('uint8')
+            # Shift high bit depth images (e.g. 12-bit) to 8-bit
+            self.img = BitDepth.to_8bit(self.img)
                 
             # Convert the image from BGR (OpenCV) to RGB (Qt)
             image = cv2.cvtColor(self.img, cv2.COLOR_BGR2RGB)
@@ -73,6 +80,18 @@ class ImageDisplay(QWidget):
         if self.img_item and not self.img_item.pixmap().isNull():
             self._schedule_fit()
 
+    def showEvent(self, event: QShowEvent):
+        """Renders a pending overlay as soon as the display becomes visible."""
+        super().showEvent(event)
+        if self.overlay is not None:
+            self.set_image(self.get_image())
+
+    def get_image(self):
+        """Returns the image, a pending overlay is rendered first."""
+        if self.overlay is not None:
+            self.img = self.overlay.render()
+            self.overlay = None
+        return self.img
       
     def set_image(self, image: str | list) -> None:
         """Set a new image safely into the display."""
@@ -84,8 +103,7 @@ class ImageDisplay(QWidget):
         if self.img is None:
             return
 
-        if self.img.dtype == 'uint16':
-            self.img = (self.img / 16).astype('uint8')
+        self.img = BitDepth.to_8bit(self.img)
 
         image_rgb = cv2.cvtColor(self.img, cv2.COLOR_BGR2RGB)
         height, width, _ = image_rgb.shape
@@ -126,6 +144,11 @@ class ImageDisplay(QWidget):
 
 class ImageDisplaySettings(QWidget):
     
+    # The live preview is thresholded on a copy with at most this edge length
+    PREVIEW_MAX_SIDE = 1024
+    # Time after the last slider movement until the preview is updated
+    PREVIEW_DEBOUNCE_MS = 60
+    
     def __init__(self, image: str | list):
         """A view on an image.
 
@@ -140,6 +163,15 @@ class ImageDisplaySettings(QWidget):
         # ✅ default settings = [threshold_value_or_-1, blur_name, magnitude_name]
         self.settings: list = [-1, "Gaussian", "2X"]
         
+        # Downscaled grayscale+blurred images for the live preview, one per blur
+        self._preview_cache = {}
+        
+        # Restarted on every change, so only the last slider position is thresholded
+        self._preview_timer = QTimer(self)
+        self._preview_timer.setSingleShot(True)
+        self._preview_timer.setInterval(self.PREVIEW_DEBOUNCE_MS)
+        self._preview_timer.timeout.connect(self._update_preview)
+        
         if type(image) is str:
                     
             self.path = image
@@ -164,10 +196,8 @@ class ImageDisplaySettings(QWidget):
         self.img_scene.addItem(self.img_item)
         
         if self.img is not None:
-            # Normalize the 12-bit image to 8-bit
-            if self.img.dtype == 'uint16':
-                # Assuming the image is 12-bit
-                self.img = (self.img / 16).astype('uint8')
+            # Shift high bit depth images (e.g. 12-bit) to 8-bit
+            self.img = BitDepth.to_8bit(self.img)
                 
             # Convert the image from BGR (OpenCV) to RGB (Qt)
             image = cv2.cvtColor(self.img, cv2.COLOR_BGR2RGB)
@@ -219,6 +249,7 @@ class ImageDisplaySettings(QWidget):
         blur_label = QLabel("Blur")
         self.blur_picker_box = QComboBox()
         self.blur_picker_box.addItems(["Gaussian", "Median", "Stacked"])
+        self.blur_picker_box.currentTextChanged.connect(self._schedule_preview)
 
         # Magnitude
         magnitude_label = QLabel("Magnitude")
@@ -238,6 +269,15 @@ class ImageDisplaySettings(QWidget):
         settings_layout.addWidget(magnitude_label, 4, 0)
         settings_layout.addWidget(self.magnitude_box, 4, 1)
         
+        # Live preview of the binary image
+        self.preview_checkbox = QCheckBox("Live Preview")
+        self.preview_checkbox.stateChanged.connect(lambda: self._preview_check(self.preview_checkbox.isChecked()))
+        
+        self.preview_label = QLabel("")
+        
+        settings_layout.addWidget(self.preview_checkbox, 6, 1)
+        settings_layout.addWidget(self.preview_label, 7, 1)
+        
         settings_widget.setLayout(settings_layout)
         
         # Apply button
@@ -262,6 +302,10 @@ class ImageDisplaySettings(QWidget):
         if self.img_item and not self.img_item.pixmap().isNull():
             self._schedule_fit()
 
+    def showEvent(self, event: QShowEvent):
+        """Updates the live preview, the settings might have been changed while the tab was hidden."""
+        super().showEvent(event)
+        self._schedule_preview()
       
     def set_image(self, image: str | list) -> None:
         print(f"[DBG] set_image called. Image shape={self.img.shape if self.img is not None else None}, dtype={self.img.dtype if self.img is not None else None}")
@@ -274,10 +318,18 @@ class ImageDisplaySettings(QWidget):
         if self.img is None:
             return
 
-        if self.img.dtype == 'uint16':
-            self.img = (self.img / 16).astype('uint8')
+        self.img = BitDepth.to_8bit(self.img)
+
+        # The cached preview images belong to the old image
+        self._preview_cache = {}
 
         image_rgb = cv2.cvtColor(self.img, cv2.COLOR_BGR2RGB)
+        self._show_rgb(image_rgb)
+        
+        self._schedule_preview()
+
+    def _show_rgb(self, image_rgb) -> None:
+        """Puts an RGB image into the display."""
         height, width, _ = image_rgb.shape
         bytes_per_line = 3 * width
         q_image = QImage(image_rgb.data, width, height, bytes_per_line, QImage.Format.Format_RGB888)
@@ -293,14 +345,105 @@ class ImageDisplaySettings(QWidget):
         self._schedule_fit()
 
 
-
     
     def _auto_thresh_check(self, state : bool) -> None:
         self.thresh_slider.setEnabled(not state)
         self.thresh_value.setEnabled(not state)
+        
+        # The label might show the automatic threshold of the preview, the slider starts from there
+        if not state and self.thresh_value.text().isdigit():
+            self.thresh_slider.setValue(int(self.thresh_value.text()))
+        
+        self._schedule_preview()
     
     def _thresh_slider_value_changed(self, value : int) -> None:
         self.thresh_value.setText(str(value))
+        self._schedule_preview()
+    
+    def _preview_check(self, state: bool) -> None:
+        if state:
+            self._schedule_preview()
+            return
+        
+        # Back to the original image
+        self._preview_timer.stop()
+        self.preview_label.setText("")
+        if self.img is not None:
+            self._show_rgb(cv2.cvtColor(self.img, cv2.COLOR_BGR2RGB))
+    
+    def _schedule_preview(self) -> None:
+        """Debounces the preview, it is only updated once the controls rest for PREVIEW_DEBOUNCE_MS."""
+        if getattr(self, "preview_checkbox", None) is None or not self.preview_checkbox.isChecked():
+            return
+        self._preview_timer.start()
+    
+    def _preview_image(self, blur: str):
+        """Returns the downscaled grayscale+blurred image of a blur, it is computed once per image and blur.
+
+        Args:
+            blur (str): name of the blur
+
+        Returns:
+            MatLike: downscaled blurred grayscale image
+        """
+        if blur not in self._preview_cache:
+            
+            height, width = self.img.shape[:2]
+            scale = min(1.0, self.PREVIEW_MAX_SIDE / max(height, width))
+            
+            # Downscaled first so the GUI thread never blurs the full image, the kernels shrink with the image
+            # to keep the blur about as strong relative to the pellets as in the pellet sizer
+            if scale < 1.0:
+                small = cv2.resize(self.img, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+            else:
+                small = self.img
+            
+            stages = PreprocessingPipeline.stages_from_settings([-1, blur])
+            for spec in stages:
+                if "ksize" in spec:
+                    # The blurs need odd kernel sizes
+                    spec["ksize"] = max(1, int(round(spec["ksize"] * scale))) | 1
+            
+            pipeline = PreprocessingPipeline(stages)
+            gray = pipeline.gray(small, pipeline.bit_depth(small))
+            
+            # The blurred image is a pooled buffer, the cached one has to be a copy
+            blurred = gray.copy()
+            pipeline.release(gray)
+            
+            self._preview_cache[blur] = blurred
+        
+        return self._preview_cache[blur]
+    
+    def _update_preview(self) -> None:
+        """Thresholds the cached preview image with the current settings and shows the mask with its contours."""
+        if self.img is None or not self.preview_checkbox.isChecked():
+            return
+        
+        value = -1 if self.thresh_auto_checkbox.isChecked() else self.thresh_slider.value()
+        blur = self.blur_picker_box.currentText()
+        
+        try:
+            gray = self._preview_image(blur)
+        except Exception as e:
+            self.preview_label.setText(f"No preview for {blur}")
+            print(f"[ERROR] preview failed: {e}")
+            return
+        
+        if value < 0:
+            # The automatic threshold is shown, so it can be used as a starting point for the slider
+            otsu, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV+cv2.THRESH_OTSU)
+            self.thresh_value.setText(str(int(otsu)))
+        else:
+            _, mask = cv2.threshold(gray, value, 255, cv2.THRESH_BINARY_INV)
+        
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        preview = cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB)
+        cv2.drawContours(preview, contours, -1, (0,255,0), 1, cv2.LINE_AA)
+        
+        self.preview_label.setText(f"Contours: {len(contours)}")
+        self._show_rgb(preview)
 
 
     def _apply_settings(self) -> None:
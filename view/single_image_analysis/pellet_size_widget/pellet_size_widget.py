@@ -1,7 +1,8 @@
 
+import bisect
 import csv
 import os
-from PySide6.QtWidgets import QTabWidget, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QProgressBar, QTableView, QFileDialog, QMessageBox
+from PySide6.QtWidgets import QTabWidget, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QProgressBar, QTableView, QFileDialog, QMessageBox, QComboBox, QDoubleSpinBox, QCheckBox
 from PySide6.QtCore import QThread, Signal, QElapsedTimer, QTimer, QSignalBlocker
 from PySide6.QtGui import QStandardItemModel, QStandardItem
 import time
@@ -11,13 +12,19 @@ import numpy as np
 from view.single_image_analysis.graphics_view_widget import ImageDisplaySettings, ImageDisplay
 
 from controller.algorithms.algorithm_manager_class.algorithm_manager import AlgorithmManager
+from controller.algorithms.pellet_sizer.pellet_sizer import PelletSizer
+from controller.algorithms.pellet_sizer.batch_threshold import BatchThreshold
+from controller.algorithms.pellet_sizer.steps.scaling import Scaling
 from operator_mod.in_mem_storage.in_memory_data import InMemoryData
 from operator_mod.eventbus.event_handler import EventManager
 from operator_mod.logger.global_logger import Logger
 
 class PelletSizeWidghet(QTabWidget):
 
-    pellet_sizing_done = Signal()
+    # All carry the task id first, signals of an earlier task of this widget are ignored
+    pellet_sizing_done = Signal(int)
+    pellet_result_ready = Signal(int, int, object)
+    progress_changed = Signal(int, float)
 
     def __init__(self):
         
@@ -31,9 +38,17 @@ class PelletSizeWidghet(QTabWidget):
         self.logger = Logger("Application").logger   
         
         self.pellet_sizing_done.connect(self.display_results)
+        self.pellet_result_ready.connect(self.display_result)
+        self.progress_changed.connect(self._task_progress)
         
-        # Adding a reference to self into the datastore
-        self.data.add_data(self.data.Keys.PELLET_SIZER_WIDGET_REFERENCE, self, self.data.Namespaces.DEFAULT)
+        self.result_filepaths = []
+        self.result_order = []
+        # Pixel measurements per image index, the result tables are rescaled from these
+        self.result_pixels = {}
+        
+        # Task of the running analysis, for the stop button. The widget passes itself with the inputs of the task,
+        # so several widgets can analyze at once
+        self.task_id = None
         
     def setupForm(self):
 
@@ -79,14 +94,39 @@ class PelletSizeWidghet(QTabWidget):
         startbutton = QPushButton("Analyze")
         startbutton.clicked.connect(self.analyze_button_action)
         
+        # Stops a running analysis, the finished images are kept
+        stopbutton = QPushButton("Stop")
+        stopbutton.clicked.connect(self.stop_button_action)
+        
+        analyze_buttons_layout = QHBoxLayout()
+        analyze_buttons_layout.addWidget(startbutton)
+        analyze_buttons_layout.addWidget(stopbutton)
+        
         self.progressbar = QProgressBar()
 
-        analyze_layout.addWidget(startbutton)
+        analyze_layout.addLayout(analyze_buttons_layout)
         analyze_layout.addWidget(self.progressbar)
 
         apply_all_button = QPushButton("Apply Current Settings to All")
         apply_all_button.clicked.connect(self._apply_current_settings_to_all)
         analyze_layout.addWidget(apply_all_button)
+        
+        # How the automatic thresholds are computed
+        threshold_mode_layout = QHBoxLayout()
+        
+        self.threshold_mode_box = QComboBox()
+        self.threshold_mode_box.addItem("Per Image", BatchThreshold.Mode.IMAGE)
+        self.threshold_mode_box.addItem("Shared by all Images", BatchThreshold.Mode.BATCH)
+        self.threshold_mode_box.addItem("Shared per Folder", BatchThreshold.Mode.FOLDER)
+        
+        threshold_mode_layout.addWidget(QLabel("Automatic Threshold"))
+        threshold_mode_layout.addWidget(self.threshold_mode_box)
+        analyze_layout.addLayout(threshold_mode_layout)
+        
+        # Results of unchanged images are reused from the cache of the open project
+        self.use_cache_checkbox = QCheckBox("Reuse Cached Results")
+        self.use_cache_checkbox.setToolTip("Unchanged images with unchanged settings are not processed again. Needs an open project.")
+        analyze_layout.addWidget(self.use_cache_checkbox)
 
         
         ### back to welcome page
@@ -140,64 +180,113 @@ class PelletSizeWidghet(QTabWidget):
 
                 filesettings.append(widget.settings or [-1, "Gaussian", "2X"])
         
-        self.data.add_data(self.data.Keys.PELLET_SIZER_IMAGES, filepaths, self.data.Namespaces.DEFAULT)
-        self.data.add_data(self.data.Keys.PELLET_SIZER_IMAGE_SETTINGS, filesettings, self.data.Namespaces.DEFAULT)
-        self.algman.add_task(self.algman.States.PELLET_SIZER_SINGLE_STATE, 0)
+        inputs = {
+            self.data.Keys.PELLET_SIZER_IMAGES: filepaths,
+            self.data.Keys.PELLET_SIZER_IMAGE_SETTINGS: filesettings,
+            self.data.Keys.PELLET_SIZER_THRESHOLD_MODE: self.threshold_mode_box.currentData(),
+            self.data.Keys.PELLET_SIZER_USE_CACHE: self.use_cache_checkbox.isChecked(),
+            self.data.Keys.PELLET_SIZER_WIDGET_REFERENCE: self
+        }
+        
+        # A new analysis replaces a running one, whose late results would land in the new tabs
+        if self.task_id is not None:
+            self.algman.cancel_task(self.task_id)
+        
+        # Results are streamed into these tabs while the analysis is running
+        self._setup_result_tabs(filepaths)
+        
+        self.task_id = self.algman.add_task(self.algman.States.PELLET_SIZER_SINGLE_STATE, 0, inputs=inputs)
+    
+    def stop_button_action(self) -> None:
+        """Action for the stop button. Cancels the running analysis, images that are already processed stay in the results.
+        """
+        if self.task_id is not None and self.algman.cancel_task(self.task_id):
+            self.logger.info("Stopping the pellet sizer analysis.")
     
     ### Result logic
-    def display_results(self) -> None:
-        """Displays results after analyzing. Called from the WaiterThread by a signal.
+    def display_result(self, task_id: int, index: int, result: dict) -> None:
+        """Displays a single result as soon as it is finished. Called from the PelletSizerSingleState by a signal.
+
+        Args:
+            task_id (int): task of the result
+            index (int): index of the image in the analyzed filepaths
+            result (dict): "Image" : annotated image, "Data" : data, "Pixels" : pixel measurements, "Threshold" : threshold used
         """
-        self._progressbar_update(1)
-        self._progressbar_update(0)
+        if task_id != self.task_id:
+            return
         
-        # Fetching results
-        results = self.data.get_data(self.data.Keys.PELLET_SIZER_RESULT, self.data.Namespaces.DEFAULT)
+        try:
+            # The tabs are kept in the order of the filepaths even though results arrive in order of completion
+            position = bisect.bisect(self.result_order, index)
+            self.result_order.insert(position, index)
+            self.result_pixels[index] = result["Pixels"]
+
+            self._add_result_image(position, result["Image"], self.result_filepaths[index])
+            self._add_result_table(position, result["Data"], self.result_filepaths[index])
+            
+            if result.get("Threshold") is not None:
+                self.stacked_result_tab.setTabToolTip(position, f"Threshold: {result['Threshold']:g}")
+
+        except Exception as e:
+            self.logger.error(f"Error in displaying result {index}: {e}.")
+
+    def display_results(self, task_id: int) -> None:
+        """Finishes the result display after analyzing. Called from the PelletSizerSingleState by a signal.
+
+        Args:
+            task_id (int): task that finished
+        """
+        # The results arrived by signal, the namespace of the task is not needed anymore
+        self.algman.release_task(task_id)
         
-        images = []
-        data = []
+        # An earlier task that was replaced by a new analysis
+        if task_id != self.task_id:
+            return
         
-        for result in results:
-            images.append(result["Image"])
-            data.append(result["Data"])
+        self.task_id = None
         
-        # The images come back in the order of the filepaths given
-        filepaths = self.data.get_data(self.data.Keys.PELLET_SIZER_IMAGES, self.data.Namespaces.DEFAULT)
+        self._progressbar_update(1)
+        self._progressbar_update(0)
         
+        if not self.result_order:
+            self.logger.critical("No results for the given filepaths.")
+
+        elif len(self.result_order) != len(self.result_filepaths):
+            # Also the case when the analysis was stopped
+            self.logger.warning(
+                f"Result images and given paths do not match. "
+                f"images={len(self.result_order)} paths={len(self.result_filepaths)}"
+            )
+
+    def _setup_result_tabs(self, filepaths: list) -> None:
+        """Adds the empty result tabs that are filled by display_result.
+
+        Args:
+            filepaths (list): filepaths of the images to be analyzed
+        """
+        self.result_filepaths = filepaths
+        self.result_order = []
+        self.result_pixels = {}
+
         # Creating two widget to fit into QTabWidget
-        resultimage_widget = self._result_image_widget(images, filepaths)
-        result_table = self._result_table(data, filepaths)
+        resultimage_widget = self._result_image_widget()
+        result_table = self._result_table()
         
         self.addTab(resultimage_widget, "Result Images")
         self.addTab(result_table, "Result Values")
-        
-        ### Deleting the references to the images of the result to clean up the internal data
-        self.data.delete_data(self.data.Keys.PELLET_SIZER_RESULT, self.data.Namespaces.DEFAULT)
-        
-    def _result_image_widget(self, images: list, filepaths: list) -> QWidget:
-        try:
-            if not images or not filepaths:
-                self.logger.critical("No results or no filepaths provided.")
-                return QWidget()
 
-            if len(images) != len(filepaths):
-                self.logger.critical(
-                    f"Result images and given paths do not match. "
-                    f"images={len(images)} paths={len(filepaths)}"
-                )
-            n = min(len(images), len(filepaths))
+    def _ordered_result_filepaths(self) -> list:
+        """Returns the filepaths in the order of the result tabs."""
+        return [self.result_filepaths[i] for i in self.result_order]
 
+    def _result_image_widget(self) -> QWidget:
+        try:
             widget = QWidget()
             layout = QVBoxLayout()
             save_button = QPushButton("Save and Export")
-            save_button.clicked.connect(lambda: self._result_image_export_button(filepaths[:n]))
+            save_button.clicked.connect(lambda: self._result_image_export_button(self._ordered_result_filepaths()))
             self.img_stacked_tab = QTabWidget()
 
-            for i in range(n):
-                imgwidget = ImageDisplay(images[i])
-                imgwidget.setupForm()
-                self.img_stacked_tab.addTab(imgwidget, os.path.basename(filepaths[i]))
-
             layout.addWidget(self.img_stacked_tab)
             layout.addWidget(save_button)
             widget.setLayout(layout)
@@ -206,10 +295,18 @@ class PelletSizeWidghet(QTabWidget):
         except Exception as e:
             self.logger.error(f"Error in setting up image displays for results: {e}.")
             return QWidget()
- 
-        
-        except Exception as e:
-            self.logger.error(f"Error in setting up image displays for results: {e}.") 
+
+    def _add_result_image(self, position: int, image, filepath: str) -> None:
+        """Adds the image display of one result.
+
+        Args:
+            position (int): tab position
+            image (MatLike): annotated result image
+            filepath (str): path of the analyzed image
+        """
+        imgwidget = ImageDisplay(image)
+        imgwidget.setupForm()
+        self.img_stacked_tab.insertTab(position, imgwidget, os.path.basename(filepath))
     
     def _result_image_export_button(self, filepaths: list) -> None:
         """Exports the resulting images (all/current) as .bmp format.
@@ -241,7 +338,7 @@ class PelletSizeWidghet(QTabWidget):
 
             for i in range(self.img_stacked_tab.count()):
                 img_widget = self.img_stacked_tab.widget(i)
-                image = img_widget.img
+                image = img_widget.get_image()
 
                 image_basename = os.path.basename(filepaths[i])
                 image_basename = os.path.splitext(image_basename)[0]
@@ -261,7 +358,7 @@ class PelletSizeWidghet(QTabWidget):
 
             idx = self.img_stacked_tab.currentIndex()
             img_widget = self.img_stacked_tab.currentWidget()
-            image = img_widget.img
+            image = img_widget.get_image()
             
             if idx <= len(filepaths):
                 image_basename = os.path.basename(filepaths[idx])
@@ -281,13 +378,9 @@ class PelletSizeWidghet(QTabWidget):
         elif msg_box.clickedButton() == abort_button:
             return        
     
-    def _result_table(self, data: list, filepaths: list) -> QWidget:
+    def _result_table(self) -> QWidget:
         """Builds a parent Widget to house the TabResultWidget that contains the TableViews for data on image results.
 
-        Args:
-            data (list): data from algorithm PELLETSIZER
-            filepaths (list): filepaths for used images
-
         Returns:
             QWidget: parent widget w/ child TabWidget where results are displayed
         """
@@ -301,28 +394,35 @@ class PelletSizeWidghet(QTabWidget):
             # Store references to table models for later access
             self.table_models = []
 
-            for idx, image in enumerate(data):
-                table = QTableView()
-                model = QStandardItemModel()
-                model.setHorizontalHeaderLabels(["Area [-]", "(eq) Diameter [-]", "(eq) Perimeter [-]","Area [mym^2]", "(eq) Diameter [mym]","(eq) Perimeter [mym]", "Perimeter [mym]","Feret_max [mym]", "(eq) Volume [mym^3] " , "circularity [-]", "compactness [-]"])
-
-                for result in image:
-                    row = []
-                    for value in result:
-                        row.append(QStandardItem(str(value)))
-
-                    model.appendRow(row)
-
-                table.setModel(model)
-                self.table_models.append(model)
-
-                self.stacked_result_tab.addTab(table, str(str(os.path.basename(filepaths[idx]))))
-
             mainlayout.addWidget(self.stacked_result_tab)
 
+            # Rescaling of all tables without analyzing the images again
+            rescale_layout = QHBoxLayout()
+            
+            self.rescale_magnification_box = QComboBox()
+            self.rescale_magnification_box.addItems(list(Scaling.SCALE_FACTORS) + ["Custom [mym/px]"])
+            
+            self.rescale_factor_box = QDoubleSpinBox()
+            self.rescale_factor_box.setDecimals(6)
+            self.rescale_factor_box.setRange(0.000001, 1000)
+            self.rescale_factor_box.setValue(Scaling.SCALE_FACTORS[Scaling.DEFAULT_MAGNIFICATION])
+            self.rescale_factor_box.setEnabled(False)
+            
+            self.rescale_magnification_box.currentTextChanged.connect(lambda text: self.rescale_factor_box.setEnabled(text not in Scaling.SCALE_FACTORS))
+            
+            rescale_button = QPushButton("Rescale All")
+            rescale_button.clicked.connect(self._rescale_result_tables)
+            
+            rescale_layout.addWidget(QLabel("Magnification"))
+            rescale_layout.addWidget(self.rescale_magnification_box)
+            rescale_layout.addWidget(self.rescale_factor_box)
+            rescale_layout.addWidget(rescale_button)
+            
+            mainlayout.addLayout(rescale_layout)
+
             # Add Save Button
             save_button = QPushButton("Save and Export")
-            save_button.clicked.connect(lambda: self._save_result_tables(filepaths))  # Connect to the save function
+            save_button.clicked.connect(lambda: self._save_result_tables(self._ordered_result_filepaths()))  # Connect to the save function
             mainlayout.addWidget(save_button)
 
             widget.setLayout(mainlayout)
@@ -330,6 +430,43 @@ class PelletSizeWidghet(QTabWidget):
             return widget
         except Exception as e:
             self.logger.error(f"Error setting up result tables: {e}.")
+
+    def _add_result_table(self, position: int, data: list, filepath: str) -> None:
+        """Adds the TableView for the data of one result.
+
+        Args:
+            position (int): tab position
+            data (list): data from algorithm PELLETSIZER for one image
+            filepath (str): path of the analyzed image
+        """
+        table = QTableView()
+        model = QStandardItemModel()
+        model.setHorizontalHeaderLabels(PelletSizer.RESULT_COLUMNS)
+
+        self._fill_result_model(model, data)
+
+        table.setModel(model)
+        self.table_models.insert(position, model)
+
+        self.stacked_result_tab.insertTab(position, table, str(os.path.basename(filepath)))
+            
+    def _rescale_result_tables(self) -> None:
+        """Recalculates the micrometer columns of all result tables for the chosen magnification or calibration factor.
+        """
+        magnification = self.rescale_magnification_box.currentText()
+        
+        if magnification in Scaling.SCALE_FACTORS:
+            pixel_to_um = Scaling.pixel_to_um(magnification)
+        else:
+            pixel_to_um = self.rescale_factor_box.value()
+        
+        for position, index in enumerate(self.result_order):
+            model = self.table_models[position]
+            model.removeRows(0, model.rowCount())
+            
+            self._fill_result_model(model, Scaling.apply(self.result_pixels[index], pixel_to_um))
+        
+        self.logger.info(f"Rescaled {len(self.result_order)} result tables to {pixel_to_um} mym/px.")
             
     def _save_result_tables(self, filepaths: list) -> None:
         """Exports result tables (all/current) from the TabWidget View on Results.
@@ -394,6 +531,16 @@ class PelletSizeWidghet(QTabWidget):
             # Abort operation
             return        
     
+    def _fill_result_model(self, model: QStandardItemModel, data: list) -> None:
+        """Appends the rows of a result to a table model."""
+        
+        for result in data:
+            row = []
+            for value in result:
+                row.append(QStandardItem(str(value)))
+
+            model.appendRow(row)
+    
     def _export_model_to_csv(self, model: QStandardItemModel, file_path: str) -> None:
         """Exports a model to a .csv file.
 
@@ -452,6 +599,11 @@ class PelletSizeWidghet(QTabWidget):
         self.progressbar.setValue(int(value * 100))  # Convert to percentage
         self.progressbar.repaint()  # Ensure the UI reflects the change immediately
     
+    def _task_progress(self, task_id: int, value: float):
+        
+        if task_id == self.task_id:
+            self._progressbar_update(value)
+    
     def _change_counter(self, count: int):
         self.counter.setText(f"Number of selected images: {count}")
 